@@ -1,9 +1,35 @@
 import abc
-from typing import Dict, List, Tuple, Type
+from io import BytesIO
+from typing import Dict, List, NamedTuple, Optional, Tuple, Type
 
 from numpy import ndarray
+from PIL import Image as ImageModule
 from PIL.Image import Image
 
+from Manifest import MANIFEST_SLACK, ManifestEntry, encode_entry, parse_manifest
+from PngMetadata import PngHeader, parse_parameters, read_png_header
+from Thumbnail import EncodedImage, encode_image, encode_thumbnail
+
+
+class RemoteFile(NamedTuple):
+
+    """
+    RemoteFile: A file listed on a remote host.
+
+    Attributes
+    ----------
+    name : str
+        The path of the file, as accepted by `download`.
+    size : int
+        The size of the file in bytes, -1 when unknown.
+    mtime : float
+        The last modification time as a unix timestamp, 0 when unknown.
+    """
+
+    name: str
+    size: int = -1
+    mtime: float = 0.0
+
 
 class BaseConnector(metaclass=abc.ABCMeta):
 
@@ -18,11 +44,61 @@ class BaseConnector(metaclass=abc.ABCMeta):
         This method should implement the logic for storing the image file with the given name and png_info.
         This method is invoked when  extension get image from webui lifecycle hooks.
 
+    store_bytes(name:str, data:bytes) -> None:
+        Store an already encoded png file, the manager encodes the image once and
+        passes the same bytes to every connector. Connectors that do not override it
+        get their `store_file` invoked instead.
+
     before_unload() -> None:
         An abstract method that does not take in any parameters and does not return any value.
-        This methods is invoked after image is saved.
+        This methods is invoked when the connector is closed.
+
+    is_alive() -> bool:
+        Check that the connection to the remote host is still usable,
+        connectors are long-lived and get health checked before reuse.
+
+    list_files(sub_dir:str) -> List[RemoteFile]:
+        List the files of a directory with their size and modification time,
+        used to tell whether a cached download is still up to date.
+
+    dir_mtime(sub_dir:str) -> Optional[float]:
+        Return the modification time of a directory so cached listings can be validated without re-listing.
+
+    retrieve(name:str) -> bytes:
+        Fetch the raw bytes of a remote file.
+
+    fetch_thumbnail(name:str, size:int) -> EncodedImage:
+        Download a file and encode a thumbnail of it for serving over http.
+
+    read_range(name:str, offset:int, length:int) -> bytes:
+        Fetch a byte range of a remote file.
+
+    fetch_metadata(name:str) -> PngHeader:
+        Read the dimensions and text chunks of a remote png file without its image data.
+
+    locate(name:str) -> Tuple[str,str]:
+        Return the sub directory and the listed path a stored image ends up at.
+
+    stat_file(name:str) -> RemoteFile:
+        Return the size and modification time of a remote file.
+
+    append_bytes(name:str, data:bytes) -> None:
+        Append to a remote file that other hosts may append to at the same time.
+
+    manifest_path(sub_dir:str) -> str:
+        Return the path of the manifest of a directory.
+
+    append_manifest(name:str, data:bytes) -> None:
+        Record a stored image in the manifest of its directory, when `use_manifest` is set.
+
+    read_manifest(sub_dir:str) -> Optional[List[RemoteFile]]:
+        Return the files of a directory from its manifest, None when it is missing or stale.
     """
 
+    # set by the manager, connectors that support it keep a manifest in each directory.
+    use_manifest = False
+    _manifests: Optional[Dict[str, Tuple[int, Dict[str, RemoteFile]]]] = None
+
     @abc.abstractmethod
     def store_file(self, name: str, image: Type[Image], png_info: dict) -> None:
         """
@@ -42,11 +118,29 @@ class BaseConnector(metaclass=abc.ABCMeta):
         """
         pass
 
+    def store_bytes(self, name: str, data: bytes) -> None:
+        """
+        Perform saving an already encoded png file with the given name to the file system.
+
+        Parameters
+        ----------
+        name : str
+            raw path of the original image file.
+
+        data : bytes
+            The encoded png file, including the png_info text chunks.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def before_unload(self) -> None:
         """Perform a cleaning function for this connector."""
         pass
 
+    def is_alive(self) -> bool:
+        """Return False when the connection to the remote host is broken and the connector should be recreated."""
+        return True
+
     @abc.abstractmethod
     def traverse(self, sub_dir: str) -> List[str]:
         """
@@ -75,3 +169,186 @@ class BaseConnector(metaclass=abc.ABCMeta):
             A tuple containing the image data and the png_info of the image file.
         """
         pass
+
+    def list_files(self, sub_dir: str) -> List[RemoteFile]:
+        """
+        List the files of a directory with their size and modification time.
+
+        Connectors that do not override it only report the names returned by `traverse`.
+        """
+        return [RemoteFile(name) for name in self.traverse(sub_dir)]
+
+    def dir_mtime(self, sub_dir: str) -> Optional[float]:
+        """
+        Return the modification time of a directory, None when the protocol does not report it.
+
+        Parameters
+        ----------
+        sub_dir : str
+            The sub directory, as passed to `traverse`.
+        """
+        return None
+
+    def retrieve(self, name: str) -> bytes:
+        """
+        Fetch the raw bytes of a remote file.
+
+        Parameters
+        ----------
+        name : str
+            The name of the file to download(Path).
+        """
+        raise NotImplementedError
+
+    def fetch_thumbnail(self, name: str, size: int) -> EncodedImage:
+        """
+        Download a file and encode a thumbnail whose longest side is at most `size`, it is encoded once and served as is.
+
+        Connectors that do not implement `retrieve` get their full resolution download resized.
+        """
+        try:
+            data = self.retrieve(name)
+        except NotImplementedError:
+            image, info = self.download(name)
+            thumbnail = ImageModule.fromarray(image)
+            thumbnail.thumbnail((size, size))
+            return encode_image(thumbnail, info)
+        return encode_thumbnail(data, size)
+
+    def read_range(self, name: str, offset: int, length: int) -> bytes:
+        """
+        Fetch up to `length` bytes of a remote file starting at `offset`.
+
+        Parameters
+        ----------
+        name : str
+            The name of the file to download(Path).
+        offset : int
+            The position of the first byte.
+        length : int
+            The maximum number of bytes, fewer are returned at the end of the file.
+        """
+        raise NotImplementedError
+
+    def fetch_metadata(self, name: str) -> PngHeader:
+        """
+        Read the dimensions and text chunks (E.g. `parameters`) of a remote image file.
+
+        For png files only the chunks before the first IDAT are read with `read_range`,
+        usually a few KB. Other formats and connectors without `read_range` fetch the whole file.
+        """
+        try:
+            return read_png_header(lambda offset, length: self.read_range(name, offset, length))
+        except (NotImplementedError, ValueError):
+            pass
+        try:
+            data = self.retrieve(name)
+        except NotImplementedError:
+            image, info = self.download(name)
+            return PngHeader(image.shape[1], image.shape[0], info, -1)
+        with ImageModule.open(BytesIO(data)) as image:
+            # opening only parses the header, the pixels are not decoded.
+            info = {k: v for k, v in image.info.items() if isinstance(v, str)}
+            return PngHeader(image.width, image.height, info, -1)
+
+    def locate(self, name: str) -> Tuple[str, str]:
+        """
+        Return the sub directory and the path (as returned by `list_files`) of an image stored as `name`.
+
+        Used to index uploads without listing the directory, connectors that can not be browsed do not implement it.
+
+        Parameters
+        ----------
+        name : str
+            raw path of the original image file, as passed to `store_file`.
+        """
+        raise NotImplementedError
+
+    def stat_file(self, name: str) -> RemoteFile:
+        """
+        Return the size and modification time of a remote file.
+
+        Raises an OSError (or the protocol error) when the file does not exist.
+        """
+        raise NotImplementedError
+
+    def append_bytes(self, name: str, data: bytes) -> None:
+        """
+        Append `data` to a remote file in one piece, creating the file when it does not exist.
+
+        Other hosts may append to the same file, implementations must not overwrite their data.
+        """
+        raise NotImplementedError
+
+    def manifest_path(self, sub_dir: str) -> str:
+        """Return the path of the manifest of a directory, as accepted by `read_range`."""
+        raise NotImplementedError
+
+    def append_manifest(self, name: str, data: bytes) -> None:
+        """
+        Record an image stored as `name` in the manifest of its directory.
+
+        The first image of a directory without a manifest lists it once so the manifest starts complete.
+
+        Parameters
+        ----------
+        name : str
+            raw path of the original image file, as passed to `store_bytes`.
+        data : bytes
+            The stored png file, its header is parsed for the thumbnail offset and the prompt.
+        """
+        sub_dir, path = self.locate(name)
+        manifest = self.manifest_path(sub_dir)
+        stored = self.stat_file(path)
+        header = read_png_header(lambda offset, length: data[offset : offset + length])
+        prompt, _, _ = parse_parameters(header.text.get("parameters"))
+        lines = b""
+        try:
+            self.stat_file(manifest)
+        except Exception:
+            lines = b"".join(
+                encode_entry(ManifestEntry(f.name, f.size, f.mtime))
+                for f in self.list_files(sub_dir)
+                if f.name != path
+            )
+        lines += encode_entry(
+            ManifestEntry(path, stored.size, stored.mtime, header.data_offset, prompt)
+        )
+        self.append_bytes(manifest, lines)
+
+    def read_manifest(self, sub_dir: str) -> Optional[List[RemoteFile]]:
+        """
+        Return the files of a directory from its manifest, None when it is missing or stale.
+
+        Only the tail appended since the previous read of this connector is fetched with `read_range`.
+        The manifest is stale when the directory was modified after it, E.g. by a host that
+        does not keep the manifest or when files were deleted, the caller should list the directory then.
+        """
+        path = self.manifest_path(sub_dir)
+        try:
+            info = self.stat_file(path)
+        except Exception:
+            return None
+        dir_mtime = self.dir_mtime(sub_dir)
+        if dir_mtime is not None and dir_mtime > info.mtime + MANIFEST_SLACK:
+            return None
+        if self._manifests is None:
+            self._manifests = {}
+        offset, files = self._manifests.get(path, (0, {}))
+        if offset > info.size:
+            # the manifest was replaced, read it again.
+            offset, files = 0, {}
+        files = dict(files)
+        while offset < info.size:
+            data = self.read_range(path, offset, info.size - offset)
+            if not data:
+                break
+            entries, consumed = parse_manifest(data)
+            for entry in entries:
+                files[entry.name] = RemoteFile(entry.name, entry.size, entry.mtime)
+            if consumed == 0:
+                # a line still being written by another host.
+                break
+            offset += consumed
+        self._manifests[path] = (offset, files)
+        return list(files.values())
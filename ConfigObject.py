@@ -1,118 +1,188 @@
-from typing import List, Tuple, Union
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
 
 from modules import shared
 
+from ConnectorConfig import (
+    ConnectorConfig,
+    GDriveConfig,
+    SFTPConfig,
+    SMBConfig,
+    parse_sftp,
+    parse_smb,
+)
+
+# the settings the connector config is compiled from.
+CONNECTOR_CONFIG_OPTIONS = (
+    "sd_web_ui_connect_smb_path",
+    "sd_web_ui_connect_smb_domain",
+    "sd_web_ui_connect_smb_user_passwd",
+    "sd_web_ui_connect_smb_ip_port",
+    "sd_web_ui_connect_smb_server_name_service_name",
+    "sd_web_ui_connect_sftp_user_passwd",
+    "sd_web_ui_connect_sftp_ip_port",
+    "sd_web_ui_connect_sftp_remote_path",
+    "sd_web_ui_connect_gdrive_client_secret",
+    "sd_web_ui_connect_gdrive_save_dir",
+    "sd_web_ui_connect_gdrive_chunk_mb",
+    "sd_web_ui_connect_gdrive_api_url",
+)
+
 
 class ConfigObject:
 
     """This class is used to store the configuration of the extensions."""
 
-    def get_smb_config(self) -> Union[List[List[str]], None]:
-        """Return a list of list of strings that contains the configuration of the SMB connector."""
-        if (
-            shared.opts.sd_web_ui_connect_smb_path == ""
-            or shared.opts.sd_web_ui_connect_smb_user_passwd == ""
-            or shared.opts.sd_web_ui_connect_smb_ip_port == ""
-            or shared.opts.sd_web_ui_connect_smb_server_name_service_name == ""
-        ):
-            return None
-
-        smb_path_lst: List[str] = shared.opts.sd_web_ui_connect_smb_path.split(
-            ",")
-        smb_domain_lst: List[str] = shared.opts.sd_web_ui_connect_smb_domain.split(
-            ",")
-        smb_user_passwd_lst: List[
-            str
-        ] = shared.opts.sd_web_ui_connect_smb_user_passwd.split(",")
-        smb_ip_port_lst: List[str] = shared.opts.sd_web_ui_connect_smb_ip_port.split(
-            ","
+    # the connector config compiled from the settings, with the snapshot of the settings it was compiled from.
+    _compiled: Optional[Tuple[tuple, ConnectorConfig]] = None
+
+    def get_connector_config(self) -> ConnectorConfig:
+        """
+        Return the validated connector config.
+
+        It is compiled once and reused until one of the `CONNECTOR_CONFIG_OPTIONS` changes,
+        settings that are rejected are printed once when they are compiled.
+        """
+        snapshot = (
+            *(getattr(shared.opts, name) for name in CONNECTOR_CONFIG_OPTIONS),
+            shared.cmd_opts.connect_save_path,
+        )
+        compiled = ConfigObject._compiled
+        if compiled is not None and compiled[0] == snapshot:
+            return compiled[1]
+        connector_config = self._compile_connector_config()
+        for error in connector_config.errors:
+            print(f"Invalid remote drive setting, {error}")
+        ConfigObject._compiled = (snapshot, connector_config)
+        return connector_config
+
+    def _compile_connector_config(self) -> ConnectorConfig:
+        smb, smb_errors = parse_smb(
+            shared.opts.sd_web_ui_connect_smb_path,
+            shared.opts.sd_web_ui_connect_smb_domain,
+            shared.opts.sd_web_ui_connect_smb_user_passwd,
+            shared.opts.sd_web_ui_connect_smb_ip_port,
+            shared.opts.sd_web_ui_connect_smb_server_name_service_name,
+        )
+        sftp, sftp_errors = parse_sftp(
+            shared.opts.sd_web_ui_connect_sftp_user_passwd,
+            shared.opts.sd_web_ui_connect_sftp_ip_port,
+            shared.opts.sd_web_ui_connect_sftp_remote_path,
+        )
+        gdrive = None
+        gdrive_client_secret = shared.opts.sd_web_ui_connect_gdrive_client_secret.strip()
+        gdrive_save_dir = shared.opts.sd_web_ui_connect_gdrive_save_dir.strip()
+        if gdrive_client_secret != "" and gdrive_save_dir != "":
+            try:
+                chunk_mb = max(1, int(shared.opts.sd_web_ui_connect_gdrive_chunk_mb))
+            except (TypeError, ValueError):
+                chunk_mb = 8
+            gdrive = GDriveConfig(
+                gdrive_client_secret,
+                gdrive_save_dir,
+                shared.opts.sd_web_ui_connect_gdrive_api_url.strip(),
+                chunk_mb * 1024 * 1024,
+                self.get_save_path("gdrive-uploads"),
+            )
+        return ConnectorConfig(
+            tuple(smb), tuple(sftp), gdrive, tuple(smb_errors + sftp_errors)
+        )
+
+    def get_smb_config(self) -> Union[List[SMBConfig], None]:
+        """Return the configured SMB connections, None when there is none."""
+        return list(self.get_connector_config().smb) or None
+
+    def get_gdrive_config(self) -> Union[GDriveConfig, None]:
+        """Return the Google Drive connection, None when it is not configured."""
+        return self.get_connector_config().gdrive
+
+    def get_sftp_config(self) -> Union[List[SFTPConfig], None]:
+        """Return the configured SFTP connections, None when there is none."""
+        return list(self.get_connector_config().sftp) or None
+
+    def get_upload_queue_config(self) -> Tuple[int, int, str]:
+        """Return a tuple of (queue size, worker count, backpressure policy) of the background upload queue."""
+        return (
+            int(shared.opts.sd_web_ui_connect_upload_queue_size),
+            int(shared.opts.sd_web_ui_connect_upload_workers),
+            shared.opts.sd_web_ui_connect_upload_backpressure,
+        )
+
+    def get_fanout_config(self) -> Tuple[float, int]:
+        """Return a tuple of (upload timeout in seconds per connector, concurrent uploads per connector)."""
+        return (
+            max(0.0, float(shared.opts.sd_web_ui_connect_upload_timeout)),
+            max(1, int(shared.opts.sd_web_ui_connect_uploads_per_destination)),
         )
-        smb_server_name_service_name_lst: List[
-            str
-        ] = shared.opts.sd_web_ui_connect_smb_server_name_service_name.split(",")
-        smb_user_passwd_lst_splited = [
-            x.split(":") for x in smb_user_passwd_lst]
-        smb_ip_port_lst_splited = [x.split(":") for x in smb_ip_port_lst]
-        smb_server_name_service_name_lst_splited = [
-            x.split(":") for x in smb_server_name_service_name_lst
-        ]
-
-        preprocesed_setting = []
-
-        if (
-            len(smb_path_lst) != len(smb_user_passwd_lst_splited)
-            or len(smb_path_lst) != len(smb_ip_port_lst_splited)
-            or len(smb_path_lst) != len(smb_server_name_service_name_lst_splited)
-        ):
-            return None
-
-        for i in range(len(smb_path_lst)):
-            smb_path = smb_path_lst[i]
-            user = smb_user_passwd_lst_splited[i][0]
-            passwd = smb_user_passwd_lst_splited[i][1]
-            server_name = smb_server_name_service_name_lst_splited[i][0]
-            service_name = smb_server_name_service_name_lst_splited[i][1]
-            domain = smb_domain_lst[i]
-
-            ip = smb_ip_port_lst_splited[i][0]
-            port = smb_ip_port_lst_splited[i][1]
-            temp = [
-                user,
-                passwd,
-                "local",
-                server_name,
-                service_name,
-                domain,
-                ip,
-                port,
-                smb_path,
-            ]
-            preprocesed_setting.append(temp)
-        return preprocesed_setting
-
-    def get_gdrive_config(self) -> Union[Tuple[str, str], None]:
-        """Return a tuple of strings that contains the configuration of the Google Drive connector."""
-        gdrive_client_secret = shared.opts.sd_web_ui_connect_gdrive_client_secret
-        gdrive_save_dir = shared.opts.sd_web_ui_connect_gdrive_save_dir
-
-        if gdrive_client_secret == "" or gdrive_save_dir == "":
-            return None
-        return (gdrive_client_secret, gdrive_save_dir)
-
-    def get_sftp_config(self) -> Union[List[List[str]], None]:
-        """Return a list of list of strings that contains the configuration of the SFTP connector."""
-        if (
-            shared.opts.sd_web_ui_connect_sftp_user_passwd == ""
-            or shared.opts.sd_web_ui_connect_sftp_ip_port == ""
-        ):
-            return None
-
-        sftp_user_passwd_lst: List[
-            str
-        ] = shared.opts.sd_web_ui_connect_sftp_user_passwd.split(",")
-        sftp_ip_port_lst: List[str] = shared.opts.sd_web_ui_connect_sftp_ip_port.split(
-            ","
+
+    def get_idle_timeout(self) -> float:
+        """Return the seconds an unused pooled connection is kept open."""
+        return float(shared.opts.sd_web_ui_connect_idle_timeout)
+
+    def get_encoder_config(self) -> Tuple[int, int]:
+        """Return a tuple of (encoder process count, png compression level)."""
+        return (
+            int(shared.opts.sd_web_ui_connect_encoder_workers),
+            int(shared.opts.sd_web_ui_connect_png_compress_level),
+        )
+
+    def get_spool_config(self) -> Tuple[int, float]:
+        """Return a tuple of (maximum size in MB, maximum age in hours) of the upload spool."""
+        return (
+            int(shared.opts.sd_web_ui_connect_spool_max_mb),
+            float(shared.opts.sd_web_ui_connect_spool_max_age),
         )
-        sftp_user_passwd_lst_splited = [
-            x.split(":") for x in sftp_user_passwd_lst]
-        sftp_ip_port_lst_splited = [x.split(":") for x in sftp_ip_port_lst]
-        sftp_remote_path: List[
-            str
-        ] = shared.opts.sd_web_ui_connect_sftp_remote_path.split(",")
-        preprocesed_setting = []
-
-        if len(sftp_ip_port_lst_splited) == 0 or len(sftp_user_passwd_lst_splited) == 0:
-            return None
-
-        if len(sftp_ip_port_lst_splited) != len(sftp_user_passwd_lst_splited):
-            return None
-
-        for i in range(len(sftp_user_passwd_lst)):
-            user = sftp_user_passwd_lst_splited[i][0]
-            passwd = sftp_user_passwd_lst_splited[i][1]
-            ip = sftp_ip_port_lst_splited[i][0]
-            port = sftp_ip_port_lst_splited[i][1]
-            temp = [ip, user, passwd, sftp_remote_path[i], port]
-            preprocesed_setting.append(temp)
-
-        return preprocesed_setting
+
+    def get_spool_path(self) -> str:
+        """Return the directory of the upload spool, defaults to `--connect-save-path`/spool."""
+        spool_path = shared.opts.sd_web_ui_connect_spool_path
+        if spool_path == "":
+            return self.get_save_path("spool")
+        return spool_path
+
+    def get_browser_config(self) -> Tuple[int, float]:
+        """Return a tuple of (concurrent downloads, page timeout in seconds) of the remote browser."""
+        return (
+            max(1, int(shared.opts.sd_web_ui_connect_browser_workers)),
+            float(shared.opts.sd_web_ui_connect_page_timeout),
+        )
+
+    def get_prefetch_config(self) -> Tuple[int, int, int]:
+        """
+        Return a tuple of (pages prefetched on each side, prefetch workers, connections reserved from prefetching).
+
+        The workers are the bandwidth share (percent) of the maximum connections per remote drive.
+        """
+        depth = max(0, int(shared.opts.sd_web_ui_connect_prefetch_depth))
+        share = min(100, max(0, int(shared.opts.sd_web_ui_connect_prefetch_share)))
+        max_connections = self.get_max_connections()
+        workers = max_connections * share // 100
+        if share > 0:
+            workers = max(1, workers)
+        return depth, workers, max_connections - workers
+
+    def get_stream_pages(self) -> bool:
+        """Return whether the remote browser shows images as they arrive, it needs the gradio queue."""
+        return bool(shared.opts.sd_web_ui_connect_stream_pages) and not getattr(
+            shared.cmd_opts, "no_gradio_queue", False
+        )
+
+    def get_listing_ttl(self) -> float:
+        """Return the seconds a directory listing is served without contacting the remote host."""
+        return float(shared.opts.sd_web_ui_connect_listing_ttl)
+
+    def get_image_cache_size(self) -> int:
+        """Return the memory budget in bytes of the downloaded image cache."""
+        return int(shared.opts.sd_web_ui_connect_image_cache_mb) * 1024 * 1024
+
+    def get_max_connections(self) -> int:
+        """Return the maximum number of pooled connections per remote drive."""
+        return max(1, int(shared.opts.sd_web_ui_connect_max_connections))
+
+    def get_manifest_enabled(self) -> bool:
+        """Return whether connectors keep a manifest in each remote directory."""
+        return bool(shared.opts.sd_web_ui_connect_manifest)
+
+    def get_save_path(self, *sub_dirs: str) -> str:
+        """Return a path inside the local directory of this extension (`--connect-save-path`)."""
+        return str(Path(shared.cmd_opts.connect_save_path).joinpath(*sub_dirs))
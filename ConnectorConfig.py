@@ -0,0 +1,249 @@
+from typing import FrozenSet, List, NamedTuple, Optional, Tuple
+
+MAX_PORT = 65535
+
+
+class SMBConfig(NamedTuple):
+
+    """
+    SMBConfig: The validated settings of a SMB connection, in the argument order of `SMBConector`.
+
+    Attributes
+    ----------
+    username : str
+    password : str
+    local_name : str
+    server_name : str
+        The remote name of the server.
+    service_name : str
+        The name of the shared folder.
+    domain : str
+    ip : str
+    port : int
+    save_dir : str
+        The directory inside the shared folder images are saved to.
+    """
+
+    username: str
+    password: str
+    local_name: str
+    server_name: str
+    service_name: str
+    domain: str
+    ip: str
+    port: int
+    save_dir: str
+
+    def key(self) -> Tuple:
+        """Return the pool key of the connection."""
+        return ("SMB", *self)
+
+
+class SFTPConfig(NamedTuple):
+
+    """
+    SFTPConfig: The validated settings of a SFTP connection, in the argument order of `SFTPConnector`.
+
+    Attributes
+    ----------
+    host : str
+    username : str
+    password : str
+    remote_path : str
+    port : int
+    """
+
+    host: str
+    username: str
+    password: str
+    remote_path: str
+    port: int
+
+    def key(self) -> Tuple:
+        """Return the pool key of the connection."""
+        return ("SFTP", *self)
+
+
+class GDriveConfig(NamedTuple):
+
+    """
+    GDriveConfig: The validated settings of the Google Drive connection, in the argument order of `GDriveConnector`.
+
+    Attributes
+    ----------
+    client_secret : str
+        The path to the client_secret.json file.
+    save_dir : str
+        The name of the folder in google drive.
+    api_url : str
+        The base url uploads are sent to, empty for the google api.
+    chunk_size : int
+        The size of each uploaded chunk in bytes.
+    session_dir : str
+        The directory upload session uris are persisted in.
+    """
+
+    client_secret: str
+    save_dir: str
+    api_url: str
+    chunk_size: int
+    session_dir: str
+
+    def key(self) -> Tuple:
+        """Return the pool key of the connection."""
+        return ("GDrive", *self)
+
+
+class ConnectorConfig(NamedTuple):
+
+    """
+    ConnectorConfig: The compiled connector settings.
+
+    Attributes
+    ----------
+    smb : Tuple[SMBConfig, ...]
+    sftp : Tuple[SFTPConfig, ...]
+    gdrive : Optional[GDriveConfig]
+    errors : Tuple[str, ...]
+        Why settings were rejected, the connections they describe are left out.
+    """
+
+    smb: Tuple[SMBConfig, ...] = ()
+    sftp: Tuple[SFTPConfig, ...] = ()
+    gdrive: Optional[GDriveConfig] = None
+    errors: Tuple[str, ...] = ()
+
+    def keys(self) -> Tuple[Tuple, ...]:
+        """Return the pool keys of every configured connection."""
+        keys = [config.key() for config in (*self.smb, *self.sftp)]
+        if self.gdrive is not None:
+            keys.append(self.gdrive.key())
+        return tuple(keys)
+
+
+class ConfigDiff(NamedTuple):
+
+    """
+    ConfigDiff: The connections that changed between two configs.
+
+    Attributes
+    ----------
+    added : FrozenSet[Tuple]
+        The pool keys that are only in the new config.
+    removed : FrozenSet[Tuple]
+        The pool keys that are only in the old config, their connections should be closed.
+    unchanged : FrozenSet[Tuple]
+        The pool keys of both configs, their connections can be kept.
+    """
+
+    added: FrozenSet[Tuple]
+    removed: FrozenSet[Tuple]
+    unchanged: FrozenSet[Tuple]
+
+
+def diff_keys(old: Tuple[Tuple, ...], new: Tuple[Tuple, ...]) -> ConfigDiff:
+    """Compare the pool keys of two configs."""
+    old_keys, new_keys = frozenset(old), frozenset(new)
+    return ConfigDiff(new_keys - old_keys, old_keys - new_keys, old_keys & new_keys)
+
+
+def _split(value: str) -> List[str]:
+    """Split a comma separated setting, an empty setting has no items."""
+    return [item.strip() for item in value.split(",")] if value.strip() else []
+
+
+def _pair(value: str, what: str, errors: List[str]) -> Optional[Tuple[str, str]]:
+    first, separator, second = value.partition(":")
+    if not separator or not first:
+        errors.append(f"'{value}' is not a valid {what}")
+        return None
+    return first, second
+
+
+def _port(value: str, errors: List[str]) -> Optional[int]:
+    try:
+        port = int(value)
+    except ValueError:
+        port = 0
+    if not 0 < port <= MAX_PORT:
+        errors.append(f"'{value}' is not a valid port")
+        return None
+    return port
+
+
+def parse_smb(
+    paths: str,
+    domains: str,
+    user_passwords: str,
+    ip_ports: str,
+    server_service_names: str,
+) -> Tuple[List[SMBConfig], List[str]]:
+    """
+    Compile the comma separated SMB settings, the n-th item of each setting belongs to the n-th connection.
+
+    A single domain applies to every connection. Return the connections and the errors of rejected ones,
+    when the settings have different lengths no connection is returned because the items can not be paired.
+    """
+    errors: List[str] = []
+    path_lst = _split(paths)
+    columns = [_split(user_passwords), _split(ip_ports), _split(server_service_names)]
+    if not path_lst or not all(columns):
+        return [], []
+    if any(len(column) != len(path_lst) for column in columns):
+        return [], ["SMB: path, username/password, ip/port and remote name/service name need the same number of items"]
+    domain_lst = _split(domains)
+    if len(domain_lst) == 1:
+        domain_lst = domain_lst * len(path_lst)
+    configs = []
+    for i, (path, user_passwd, ip_port, server_service) in enumerate(zip(path_lst, *columns)):
+        entry_errors: List[str] = []
+        user = _pair(user_passwd, "username:password", entry_errors)
+        ip_port_pair = _pair(ip_port, "ip:port", entry_errors)
+        port = _port(ip_port_pair[1], entry_errors) if ip_port_pair else None
+        names = _pair(server_service, "remote_name:service_name", entry_errors)
+        if entry_errors:
+            errors.extend(f"SMB connection {i}: {error}" for error in entry_errors)
+            continue
+        configs.append(
+            SMBConfig(
+                user[0],
+                user[1],
+                "local",
+                names[0],
+                names[1],
+                domain_lst[i] if i < len(domain_lst) else "",
+                ip_port_pair[0],
+                port,
+                path,
+            )
+        )
+    return configs, errors
+
+
+def parse_sftp(
+    user_passwords: str, ip_ports: str, remote_paths: str
+) -> Tuple[List[SFTPConfig], List[str]]:
+    """
+    Compile the comma separated SFTP settings, the n-th item of each setting belongs to the n-th connection.
+
+    A missing remote path defaults to `/`. Return the connections and the errors of rejected ones.
+    """
+    errors: List[str] = []
+    user_lst, ip_port_lst = _split(user_passwords), _split(ip_ports)
+    if not user_lst or not ip_port_lst:
+        return [], []
+    if len(user_lst) != len(ip_port_lst):
+        return [], ["SFTP: username/password and ip/port need the same number of items"]
+    path_lst = _split(remote_paths)
+    configs = []
+    for i, (user_passwd, ip_port) in enumerate(zip(user_lst, ip_port_lst)):
+        entry_errors: List[str] = []
+        user = _pair(user_passwd, "username:password", entry_errors)
+        ip_port_pair = _pair(ip_port, "ip:port", entry_errors)
+        port = _port(ip_port_pair[1], entry_errors) if ip_port_pair else None
+        if entry_errors:
+            errors.extend(f"SFTP connection {i}: {error}" for error in entry_errors)
+            continue
+        remote_path = path_lst[i] if i < len(path_lst) and path_lst[i] else "/"
+        configs.append(SFTPConfig(ip_port_pair[0], user[0], user[1], remote_path, port))
+    return configs, errors
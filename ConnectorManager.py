@@ -1,11 +1,31 @@
-from typing import List, Type
+import hashlib
+import importlib
+import threading
+import time
+from io import BytesIO
+from typing import Callable, ContextManager, Dict, List, Optional, Set, Tuple, Type
 
+from PIL import Image as ImageModule
 from PIL.Image import Image
 
 from BaseConnector import BaseConnector
-from GDriveConnector import GDriveConnector
-from SFTPConnector import SFTPConnector
-from SMBConnector import SMBConector
+from ConnectorConfig import ConfigDiff, GDriveConfig, SFTPConfig, SMBConfig, diff_keys
+from ConnectorPool import ConnectorPool
+from ListingCache import listing_cache
+from MetadataIndex import IndexCrawler, MetadataIndex
+from Metrics import metrics
+from PngEncoder import PngEncoder
+from PngMetadata import read_png_header
+from UploadFanout import UploadFanout
+from UploadQueue import UploadJob, UploadQueue
+from UploadSpool import SpoolJobDropped, UploadSpool
+
+# the module and class of each connector type, backends are only imported once a connector of their type is used.
+CONNECTOR_TYPES = {
+    "SMB": ("SMBConnector", "SMBConector"),
+    "SFTP": ("SFTPConnector", "SFTPConnector"),
+    "GDrive": ("GDriveConnector", "GDriveConnector"),
+}
 
 
 class ConnectorManager:
@@ -14,18 +34,64 @@ class ConnectorManager:
     ConnectorManager: A class that manages all the connector objects.
 
     It is responsible for creating and storing the connector objects and invoking a Connector method.
+    Connectors are long-lived, they are kept in a `ConnectorPool` keyed by their config tuple
+    and reused by every upload until the settings change.
 
     Attributes
     ----------
-    connector : List[BaseConnector]
-        A list of connector objects.
+    connector : List[Tuple]
+        A list of config tuples of the configured connectors, the first item is the connector type.
+    pool : ConnectorPool
+        The pool of live connector objects.
+    encoder : PngEncoder
+        Encodes each image once before it is handed to the connectors.
+    fanout : UploadFanout
+        Uploads each image to all connectors at the same time, with a timeout and a concurrency limit per connector.
+    upload_queue : UploadQueue
+        The background upload queue, None until `start_upload_queue` is called.
+    spool : UploadSpool
+        The on-disk spool of failed uploads, None until `start_spool` is called.
+    index : MetadataIndex
+        The local index of remote images, None until `open_index` is called.
+    use_manifest : bool
+        Whether connectors keep a manifest in each remote directory, see `BaseConnector.append_manifest`.
 
     Methods
     -------
     create_smb_connector(username:str, password:str,local_name:str,server_name:str,service_name:str,domain:str,ip:str,port:int=445,save_dir:str='sd_web_ui') -> None:
-        Create a SMBConnector object and add it to the connector list.
+        Add a SMBConnector config to the connector list.
     create_sftp_connector(host:str,username:str, password:str, remote_path='/',port=22) -> None:
-        Create a SFTPConnector object and add it to the connector list.
+        Add a SFTPConnector config to the connector list.
+    get_smb_key(...) / get_sftp_key(...) -> Tuple:
+        Return the config tuple of a connector, used as its key in the pool.
+    connector_class(connector_type:str) -> Type[BaseConnector]:
+        Return the connector class of a connector type, imported on first use.
+    metric_labels(key:Tuple) -> dict:
+        Return the metric labels of a connector.
+    key_of(connector_id:str) -> Optional[Tuple]:
+        Return the config tuple of a connector id, None when it is not configured.
+    connection(key:Tuple, reserve:int) -> ContextManager[BaseConnector]:
+        Borrow a pooled connector of a config tuple, `reserve` connections are left to other borrowers.
+    reconfigure(setup:Callable[[ConnectorManager],None]) -> ConfigDiff:
+        Swap in a new connector list, removed connectors are closed once their queued uploads are done.
+    set_manifest(enabled:bool) -> None:
+        Turn the remote manifests on or off, pooled connectors are recreated.
+    configure_encoder(workers:int, compress_level:int) -> None:
+        Replace the png encoder when its settings changed.
+    start_spool(directory:str, max_bytes:int, max_age:float) -> None:
+        Start the spool that retries failed uploads.
+    start_upload_queue(handler:Callable[[UploadJob],None], maxsize:int, workers:int, policy:str) -> None:
+        Start the background upload queue, the `spill` policy writes to the spool.
+    enqueue_image(image:Image, name:str, png_info:dict) -> None:
+        Snapshot the image and hand it to the background upload queue.
+    upload_job(job:UploadJob) -> None:
+        Upload a queued job to the connectors that were configured when it was queued.
+    open_index(path:str) -> None:
+        Open the metadata index, uploads are indexed from then on.
+    request_crawl(key:Tuple, sub_dir:str) -> None:
+        Index the existing files of a remote directory in the background.
+    shutdown(timeout:float) -> None:
+        Drain the background upload queue, stop its workers, the spool and close the pooled connectors.
     """
 
     def __init__(self) -> None:
@@ -33,15 +99,98 @@ class ConnectorManager:
         Initiate a empty connector list.
 
         :warning: GDriveConnector is contained manual authentication flow with oauth provider(Deprecated).
-        it need to seperate with other conectors and it will instantiate when app starts
-        if you need to apply it you need to restart the webui server.
+        it need to seperate with other conectors, it is authorized on a background thread when app starts
+        or when its settings are applied.
         """
-        self.connector: List[BaseConnector] = []
+        self.connector: List[Tuple] = []
+        self.pool = ConnectorPool()
+        self.encoder = PngEncoder()
+        self.fanout = UploadFanout()
+        self.upload_queue: Optional[UploadQueue] = None
+        self.spool: Optional[UploadSpool] = None
+        self.index: Optional[MetadataIndex] = None
+        self._crawler: Optional[IndexCrawler] = None
+        self.use_manifest = False
+        self._config_lock = threading.Lock()
+        # queued uploads per connector and the removed connectors that wait for theirs to finish.
+        self._pending: Dict[Tuple, int] = {}
+        self._retiring: Set[Tuple] = set()
 
     def __reset__(self) -> None:
         """Reset the connector list.This will get Invoke when want to reset an attribute."""
         self.connector = []
 
+    def reconfigure(self, setup: Callable[["ConnectorManager"], None]) -> ConfigDiff:
+        """
+        Rebuild the connector list with `setup` and swap it in atomically, return the difference to the old list.
+
+        Unchanged configs keep their warm connections. Removed ones are closed once the uploads queued
+        for them are done and new ones are connected in the background, so applying settings never
+        waits for the network.
+        """
+        with self._config_lock:
+            old = tuple(self.connector)
+            self.__reset__()
+            setup(self)
+            diff = diff_keys(old, tuple(self.connector))
+            self._retiring -= diff.added
+            retired = [key for key in diff.removed if not self._pending.get(key)]
+            self._retiring |= diff.removed - set(retired)
+        if retired:
+            self._in_background(self.pool.invalidate, retired)
+        for key in diff.added:
+            self._in_background(self._warm_up, key)
+        return diff
+
+    def _warm_up(self, key: Tuple) -> None:
+        """Connect a new connector so the first upload does not pay for the handshake."""
+        try:
+            with self.connection(key):
+                pass
+        except Exception as e:
+            print(f"Failed to connect to {key[0]}: {e!r}")
+
+    @staticmethod
+    def _in_background(target: Callable, *args: object) -> None:
+        threading.Thread(
+            target=target, args=args, name="sd-web-ui-connect-reconfigure", daemon=True
+        ).start()
+
+    def _hold(self, keys: Tuple[Tuple, ...]) -> None:
+        """Count a queued upload against its connectors, removed connectors are kept until it is done."""
+        with self._config_lock:
+            for key in keys:
+                self._pending[key] = self._pending.get(key, 0) + 1
+
+    def _release(self, keys: Tuple[Tuple, ...]) -> None:
+        """Count a queued upload as done and close the removed connectors nothing is queued for anymore."""
+        retired = []
+        with self._config_lock:
+            for key in keys:
+                self._pending[key] -= 1
+                if self._pending[key] == 0:
+                    del self._pending[key]
+                    if key in self._retiring:
+                        self._retiring.discard(key)
+                        retired.append(key)
+        if retired:
+            self.pool.invalidate(retired)
+
+    def set_manifest(self, enabled: bool) -> None:
+        """Turn the remote manifests on or off, pooled connectors pick it up when they are recreated."""
+        if self.use_manifest == enabled:
+            return
+        self.use_manifest = enabled
+        self._in_background(self.pool.invalidate)
+
+    def configure_encoder(self, workers: int, compress_level: int) -> None:
+        """Replace the png encoder when its worker count or compression level changed."""
+        old = self.encoder
+        if old.workers == workers and old.compress_level == compress_level:
+            return
+        self.encoder = PngEncoder(workers, compress_level)
+        old.shutdown()
+
     def create_smb_connector(
         self,
         username: str,
@@ -54,19 +203,20 @@ class ConnectorManager:
         port: int = 445,
         save_dir: str = "sd_web_ui",
     ) -> None:
-        """Wrapper around SMBConnector class. for creating a SMBConnector object and add it to the connector list."""
-        smb_connector = SMBConector(
-            username,
-            password,
-            local_name,
-            server_name,
-            service_name,
-            domain,
-            ip,
-            port,
-            save_dir,
+        """Wrapper around SMBConnector class. for adding a SMBConnector config to the connector list."""
+        self.connector.append(
+            self.get_smb_key(
+                username,
+                password,
+                local_name,
+                server_name,
+                service_name,
+                domain,
+                ip,
+                port,
+                save_dir,
+            )
         )
-        self.connector.append(smb_connector)
 
     def create_sftp_connector(
         self,
@@ -76,37 +226,316 @@ class ConnectorManager:
         remote_path: str = "/",
         port: int = 22,
     ) -> None:
-        """Wrapper around SFTPConnector class. for creating a SFTPConnector object and add it to the connector list."""
-        sftp_connector = SFTPConnector(
-            host, username, password, remote_path, port)
-        self.connector.append(sftp_connector)
+        """Wrapper around SFTPConnector class. for adding a SFTPConnector config to the connector list."""
+        self.connector.append(
+            self.get_sftp_key(host, username, password, remote_path, port)
+        )
 
     def create_gdrive_connector(
         self,
         client_secret: str,
         save_dir: str = "sd_web_ui",
         authen_only: bool = False,
+        api_url: str = "",
+        chunk_size: int = 8 * 1024 * 1024,
+        session_dir: Optional[str] = None,
     ) -> None:
         """
-        Wrapper around GDriveConnector class. for creating a GDriveConnector object and add it to the connector list.
+        Wrapper around GDriveConnector class. for adding a GDriveConnector config to the connector list.
 
         When Only initiate for authentication only is use for the first time. for geting the access token.
+        The authentication runs on a background thread so it never holds up the webui startup,
+        uploads made before it finishes fail and are kept in the upload spool.
         """
-        gdrive_connector = GDriveConnector(client_secret, save_dir)
         if authen_only:
+            threading.Thread(
+                target=self._authorize_gdrive,
+                args=(client_secret, save_dir, api_url),
+                name="sd-web-ui-connect-gdrive-auth",
+                daemon=True,
+            ).start()
             return
-        self.connector.append(gdrive_connector)
+        self.connector.append(
+            GDriveConfig(client_secret, save_dir, api_url, chunk_size, session_dir).key()
+        )
+
+    def _authorize_gdrive(self, client_secret: str, save_dir: str, api_url: str) -> None:
+        try:
+            self.connector_class("GDrive")(client_secret, save_dir, api_url, interactive=True)
+        except Exception as e:
+            print(f"Google drive authentication failed: {e!r}")
 
     def create_dropbox_connector() -> None:
         """Wrapper around DropboxConnector class. for creating a DropboxConnector object and add it to the connector list."""
         raise NotImplementedError
 
-    def save_image(self, image: Type[Image], name: str, png_info: dict) -> None:
-        """Invoke the store_file method of all the connector objects."""
-        for connector in self.connector:
+    @staticmethod
+    def connector_id(key: Tuple) -> str:
+        """Return a stable id of a config tuple that can be written to disk without exposing its credentials."""
+        return hashlib.sha256(repr(key).encode()).hexdigest()[:16]
+
+    def key_of(self, connector_id: str) -> Optional[Tuple]:
+        """Return the config tuple of a connector id, None when it is not configured."""
+        with self._config_lock:
+            keys = list(self.connector)
+        return next((k for k in keys if self.connector_id(k) == connector_id), None)
+
+    def connection(self, key: Tuple, reserve: int = 0) -> ContextManager[BaseConnector]:
+        """
+        Borrow a pooled connector of a config tuple, it is returned to the pool when the block exits.
+
+        Background work like prefetching passes a `reserve` so it never takes the last connections.
+        """
+        return self.pool.connection(key, self._create_connector, reserve)
+
+    @staticmethod
+    def connector_class(connector_type: str) -> Type[BaseConnector]:
+        """Return the connector class of a connector type, its module (and backend library) is imported on first use."""
+        if connector_type not in CONNECTOR_TYPES:
+            raise ValueError(f"Unknown connector type: {connector_type}")
+        module_name, class_name = CONNECTOR_TYPES[connector_type]
+        return getattr(importlib.import_module(module_name), class_name)
+
+    def _create_connector(self, key: Tuple) -> BaseConnector:
+        """Instantiate the connector object of a config tuple, used as the factory of the pool."""
+        connector = self.connector_class(key[0])(*key[1:])
+        connector.use_manifest = self.use_manifest
+        return connector
+
+    def save_image(
+        self,
+        image: Type[Image],
+        name: str,
+        png_info: dict,
+        keys: Optional[Tuple[Tuple, ...]] = None,
+    ) -> None:
+        """
+        Invoke the store method of all the connector objects.
+
+        The image is encoded to png once by `encoder` and the same bytes are passed to every connector,
+        connectors that do not implement `store_bytes` get the image via `store_file`.
+        The connectors are uploaded to at the same time by `fanout`. A connector that fails is
+        reconnected and retried once, when it still fails the upload is written to the spool and
+        retried in the background. An upload that times out keeps running and is only spooled
+        when it fails in the end. Stored images are added to the index.
+        `keys` are the connectors to upload to, the configured ones when None.
+        """
+        if keys is None:
+            with self._config_lock:
+                keys = tuple(self.connector)
+        if not keys:
+            return
+        with metrics.timer("encode_seconds"):
+            data = self.encoder.encode(image, png_info)
+
+        def upload(key: Tuple) -> None:
+            labels = self.metric_labels(key)
+            with metrics.timer("upload_seconds", **labels):
+                location = self._store_with_reconnect(key, name, data, image, png_info)
+            metrics.inc("upload_bytes_total", len(data), **labels)
+            metrics.inc("uploads_total", result="ok", **labels)
+            self._index_stored(key, location, data)
+
+        def spool_failed(key: Tuple) -> None:
+            metrics.inc("uploads_total", result="failed", **self.metric_labels(key))
+            self._spool(name, data, [key])
+
+        failed = self.fanout.run(list(keys), upload, spool_failed)
+        for key in failed:
+            metrics.inc("uploads_total", result="failed", **self.metric_labels(key))
+        if failed:
+            self._spool(name, data, failed)
+
+    def metric_labels(self, key: Tuple) -> dict:
+        """Return the metric labels of a connector, its type and id (never its credentials)."""
+        return {"type": key[0], "connector": self.connector_id(key)}
+
+    def _store_with_reconnect(
+        self,
+        key: Tuple,
+        name: str,
+        data: bytes,
+        image: Optional[Type[Image]] = None,
+        png_info: Optional[dict] = None,
+    ) -> Optional[Tuple[str, str]]:
+        try:
+            with self.connection(key) as connector:
+                return self._store(connector, name, data, image, png_info)
+        except Exception as e:
+            print(f"Upload to {key[0]} failed ({e!r}), reconnecting")
+            metrics.inc("upload_retries_total", **self.metric_labels(key))
+            with self.connection(key) as connector:
+                return self._store(connector, name, data, image, png_info)
+
+    def _store(
+        self,
+        connector: BaseConnector,
+        name: str,
+        data: bytes,
+        image: Optional[Type[Image]] = None,
+        png_info: Optional[dict] = None,
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Store the encoded bytes, falling back to `store_file` for connectors without `store_bytes`.
+
+        Return the sub directory and path of the stored image, None when the connector can not be browsed.
+        """
+        try:
+            connector.store_bytes(name, data)
+        except NotImplementedError:
+            if image is None:
+                image = ImageModule.open(BytesIO(data))
+                png_info = dict(image.text)
             connector.store_file(name, image, png_info)
+        try:
+            return connector.locate(name)
+        except NotImplementedError:
+            return None
+
+    def _index_stored(
+        self, key: Tuple, location: Optional[Tuple[str, str]], data: bytes
+    ) -> None:
+        """Add a stored image to the index, its metadata is read from the encoded bytes."""
+        if self.index is None or location is None:
+            return
+        try:
+            header = read_png_header(lambda offset, length: data[offset : offset + length])
+        except ValueError as e:
+            print(f"Failed to index {location[1]}: {e!r}")
+            return
+        sub_dir, path = location
+        self.index.add(
+            self.connector_id(key),
+            sub_dir,
+            path,
+            len(data),
+            header.width,
+            header.height,
+            header.text.get("parameters"),
+            hashlib.sha256(data).hexdigest(),
+        )
+
+    def start_spool(
+        self,
+        directory: str,
+        max_bytes: int = 1024 * 1024 * 1024,
+        max_age: float = 3 * 24 * 3600,
+    ) -> None:
+        """Start the spool, uploads left by a previous run are resumed."""
+        if self.spool is not None:
+            return
+        spool = UploadSpool(directory, max_bytes, max_age)
+        spool.start(self._retry_spooled)
+        self.spool = spool
+        metrics.gauge("spool_jobs", spool.__len__)
+
+    def _spool(self, name: str, data: bytes, keys: List[Tuple]) -> None:
+        if self.spool is None:
+            raise RuntimeError(f"Upload of {name} failed and the spool is not started")
+        self.spool.add(name, data, [self.connector_id(key) for key in keys])
+
+    def upload_job(self, job: UploadJob) -> None:
+        """Upload a queued job to the connectors that were configured when it was queued."""
+        try:
+            self.save_image(job.image, job.name, job.png_info, job.keys)
+        finally:
+            self._release(job.keys)
+
+    def _spill_job(self, job: UploadJob) -> None:
+        """Spill a job of a full upload queue to the spool for its connectors."""
+        try:
+            if job.keys:
+                self._spool(
+                    job.name, self.encoder.encode(job.image, job.png_info), list(job.keys)
+                )
+        finally:
+            self._release(job.keys)
+
+    def _retry_spooled(self, connector_id: str, name: str, data: bytes) -> None:
+        """Upload a spooled job, invoked by the spool scheduler."""
+        with self._config_lock:
+            keys = [k for k in self.connector if self.connector_id(k) == connector_id]
+        if not keys:
+            raise SpoolJobDropped(f"the connector {connector_id} is no longer configured")
+        labels = self.metric_labels(keys[0])
+        metrics.inc("spool_retries_total", **labels)
+        with self.fanout.slot(keys[0]), metrics.timer("upload_seconds", **labels):
+            location = self._store_with_reconnect(keys[0], name, data)
+        metrics.inc("upload_bytes_total", len(data), **labels)
+        metrics.inc("uploads_total", result="ok", **labels)
+        self._index_stored(keys[0], location, data)
+
+    def start_upload_queue(
+        self,
+        handler: Callable[[UploadJob], None],
+        maxsize: int = 32,
+        workers: int = 1,
+        policy: str = "block",
+    ) -> None:
+        """Start the background upload queue, `handler` is invoked on worker threads for each job."""
+        if self.upload_queue is not None:
+            return
+        upload_queue = UploadQueue(
+            handler, maxsize, workers, policy, self._spill_job, self._discard_job
+        )
+        upload_queue.start()
+        self.upload_queue = upload_queue
+        metrics.gauge("upload_queue_depth", upload_queue.qsize)
+
+    def enqueue_image(self, image: Type[Image], name: str, png_info: dict) -> None:
+        """Snapshot the image, png_info and the configured connectors and hand them to the background upload queue."""
+        with self._config_lock:
+            keys = tuple(self.connector)
+        self._hold(keys)
+        self.upload_queue.put(UploadJob.snapshot(name, image, png_info, keys))
+
+    def _discard_job(self, job: UploadJob) -> None:
+        self._release(job.keys)
 
-    def _ui_get_smb_connector(
+    def open_index(self, path: str) -> None:
+        """Open the metadata index at `path`, uploads and crawled directories are indexed from then on."""
+        if self.index is not None:
+            return
+        self.index = MetadataIndex(path)
+        self._crawler = IndexCrawler(self.index)
+
+    def request_crawl(self, key: Tuple, sub_dir: str) -> None:
+        """
+        Index the existing files of a remote directory in the background.
+
+        The listing comes from the listing cache, so repeated requests only reach the server once the listing expired.
+        """
+        if self._crawler is None:
+            return
+        connector_id = self.connector_id(key)
+        self._crawler.request(
+            connector_id,
+            sub_dir,
+            lambda: listing_cache.get(connector_id, sub_dir, lambda: self.connection(key)),
+            lambda: self.connection(key),
+        )
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """
+        Drain the background upload queue, stop its workers, the spool and encoder and close the pooled connectors.
+
+        With a `timeout` the whole shutdown never waits longer for uploads, it is shared by the queue,
+        the spool and the fan-out.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining() -> Optional[float]:
+            return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+        if self.upload_queue is not None:
+            self.upload_queue.shutdown(remaining())
+        if self.spool is not None:
+            self.spool.shutdown(remaining())
+        self.fanout.shutdown(remaining())
+        self.encoder.shutdown()
+        self.before_unload()
+
+    def get_smb_key(
         self,
         username: str,
         password: str,
@@ -117,8 +546,9 @@ class ConnectorManager:
         ip: str,
         port: int = 445,
         save_dir: str = "sd_web_ui",
-    ) -> SMBConector:
-        smb = SMBConector(
+    ) -> Tuple:
+        """Return the pool key of a SMBConnector, the browser borrows its connections from the pool."""
+        return SMBConfig(
             username,
             password,
             local_name,
@@ -128,21 +558,19 @@ class ConnectorManager:
             ip,
             port,
             save_dir,
-        )
-        return smb
+        ).key()
 
-    def _ui_get_sftp_connector(
+    def get_sftp_key(
         self,
         host: str,
         username: str,
         password: str,
         remote_path: str = "/",
         port: int = 22,
-    ) -> SFTPConnector:
-        sftp = SFTPConnector(host, username, password, remote_path, port)
-        return sftp
+    ) -> Tuple:
+        """Return the pool key of a SFTPConnector, the browser borrows its connections from the pool."""
+        return SFTPConfig(host, username, password, remote_path, port).key()
 
     def before_unload(self) -> None:
-        """Invoke the before_unload method of all the connector objects."""
-        for connector in self.connector:
-            connector.before_unload()
+        """Close all the pooled connector objects."""
+        self.pool.close()
@@ -0,0 +1,202 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+from BaseConnector import BaseConnector
+
+
+class ConnectorPool:
+
+    """
+    ConnectorPool: A pool of long-lived connectors keyed by their config tuple.
+
+    Connectors are created on first use, returned to the pool after each operation and reused by the next one,
+    so a batch of images costs one handshake per destination instead of one per image.
+
+    Attributes
+    ----------
+    idle_timeout : float
+        Seconds a connector may stay unused in the pool before it is closed.
+    health_check_interval : float
+        Connectors that were idle for longer than this are health checked before they are handed out.
+    max_per_key : int
+        The maximum number of connectors (idle and borrowed) for a single config tuple.
+
+    Methods
+    -------
+    connection(key:Hashable, factory:Callable[[Hashable],BaseConnector], reserve:int) -> ContextManager[BaseConnector]:
+        Borrow a connector for `key`, creating it with `factory` when none is idle.
+        Background work passes a `reserve` to leave connections for uploads and foreground page loads.
+    invalidate(keys:Iterable[Hashable]) -> None:
+        Close the connectors of the given keys (all keys when None), borrowed ones are closed when returned.
+    reap() -> None:
+        Close connectors that were idle for longer than `idle_timeout`.
+    close() -> None:
+        Close every connector and stop the reaper thread.
+    """
+
+    def __init__(
+        self,
+        idle_timeout: float = 300.0,
+        health_check_interval: float = 30.0,
+        max_per_key: int = 4,
+    ) -> None:
+        """
+        Initiate an empty pool, connectors are created when they are first borrowed.
+
+        Parameters
+        ----------
+        idle_timeout : float
+            Seconds a connector may stay unused in the pool before it is closed.
+        health_check_interval : float
+            Connectors that were idle for longer than this are health checked before they are handed out.
+        max_per_key : int
+            The maximum number of connectors (idle and borrowed) for a single config tuple.
+        """
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.max_per_key = max_per_key
+        self._cond = threading.Condition()
+        self._idle: Dict[Hashable, List[Tuple[BaseConnector, float]]] = {}
+        self._borrowed: Dict[Hashable, int] = {}
+        self._generation: Dict[Hashable, int] = {}
+        self._closed = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+
+    @contextmanager
+    def connection(
+        self,
+        key: Hashable,
+        factory: Callable[[Hashable], BaseConnector],
+        reserve: int = 0,
+    ) -> Iterator[BaseConnector]:
+        """
+        Borrow a connector for `key`.
+
+        With a `reserve` the borrow waits until fewer than `max_per_key - reserve` connectors are borrowed,
+        so low priority work never holds the connections other borrowers need.
+        A connector that raises while borrowed is assumed to be broken and is closed instead of
+        being returned, so the next borrow reconnects.
+        """
+        connector, generation = self._acquire(key, factory, reserve)
+        try:
+            yield connector
+        except BaseException:
+            self._release(key, connector, generation, broken=True)
+            raise
+        self._release(key, connector, generation)
+
+    def invalidate(self, keys: Optional[Iterable[Hashable]] = None) -> None:
+        """Close the connectors of `keys`, or of every key when None, e.g. after settings changed."""
+        stale: List[BaseConnector] = []
+        with self._cond:
+            targets = list(self._generation) if keys is None else list(keys)
+            for key in targets:
+                self._generation[key] = self._generation.get(key, 0) + 1
+                stale.extend(c for c, _ in self._idle.pop(key, []))
+            self._cond.notify_all()
+        for connector in stale:
+            self._close(connector)
+
+    def reap(self) -> None:
+        """Close connectors that were idle for longer than `idle_timeout`."""
+        expired: List[BaseConnector] = []
+        now = time.time()
+        with self._cond:
+            for key, idle in self._idle.items():
+                keep = [(c, t) for c, t in idle if now - t < self.idle_timeout]
+                expired.extend(c for c, t in idle if now - t >= self.idle_timeout)
+                self._idle[key] = keep
+            self._cond.notify_all()
+        for connector in expired:
+            self._close(connector)
+
+    def close(self) -> None:
+        """Close every idle connector and stop the reaper thread."""
+        self._closed.set()
+        self.invalidate()
+
+    def _acquire(
+        self,
+        key: Hashable,
+        factory: Callable[[Hashable], BaseConnector],
+        reserve: int = 0,
+    ) -> Tuple[BaseConnector, int]:
+        self._start_reaper()
+        while True:
+            with self._cond:
+                generation = self._generation.setdefault(key, 0)
+                idle = self._idle.setdefault(key, [])
+                while self._must_wait(key, idle, reserve):
+                    self._cond.wait()
+                    generation = self._generation[key]
+                self._borrowed[key] = self._borrowed.get(key, 0) + 1
+                if not idle:
+                    break
+                # most recently used first, the least recently used ones are left to expire.
+                connector, last_used = idle.pop()
+            if time.time() - last_used < self.health_check_interval or self._is_alive(
+                connector
+            ):
+                return connector, generation
+            print(f"Connection to {key[0]} is not alive anymore, reconnecting")
+            self._release(key, connector, generation, broken=True)
+        try:
+            return factory(key), generation
+        except BaseException:
+            with self._cond:
+                self._borrowed[key] -= 1
+                self._cond.notify_all()
+            raise
+
+    def _must_wait(
+        self, key: Hashable, idle: List[Tuple[BaseConnector, float]], reserve: int
+    ) -> bool:
+        borrowed = self._borrowed.get(key, 0)
+        if reserve > 0:
+            return borrowed + reserve >= self.max_per_key
+        return not idle and borrowed >= self.max_per_key
+
+    def _release(
+        self,
+        key: Hashable,
+        connector: BaseConnector,
+        generation: int,
+        broken: bool = False,
+    ) -> None:
+        with self._cond:
+            self._borrowed[key] -= 1
+            keep = not broken and self._generation.get(key) == generation
+            if keep:
+                self._idle.setdefault(key, []).append((connector, time.time()))
+            self._cond.notify_all()
+        if not keep:
+            self._close(connector)
+
+    def _is_alive(self, connector: BaseConnector) -> bool:
+        try:
+            return connector.is_alive()
+        except Exception:
+            return False
+
+    def _close(self, connector: BaseConnector) -> None:
+        try:
+            connector.before_unload()
+        except Exception as e:
+            print(f"Failed to close connector: {e!r}")
+
+    def _start_reaper(self) -> None:
+        if self._reaper is not None:
+            return
+        with self._cond:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(
+                target=self._reap_loop, name="sd-web-ui-connect-pool-reaper", daemon=True
+            )
+            self._reaper.start()
+
+    def _reap_loop(self) -> None:
+        while not self._closed.wait(min(self.idle_timeout, 30.0)):
+            self.reap()
@@ -0,0 +1,164 @@
+import datetime
+import threading
+from typing import Dict, Optional, Tuple
+
+from pydrive2.auth import AuthenticationError, AuthenticationRejected, GoogleAuth
+
+# tokens are refreshed this long before they expire, uploads never wait for a refresh.
+REFRESH_MARGIN = 300.0
+RETRY_INTERVAL = 30.0
+
+
+class DriveTokenManager:
+
+    """
+    DriveTokenManager: The oauth credentials of a Google Drive client, shared by all its connectors.
+
+    The saved credentials are loaded once, a background thread refreshes the access token
+    `REFRESH_MARGIN` seconds before it expires and saves it, so `token` is a plain attribute read.
+    The interactive oauth flow only runs when `authorize` is called.
+
+    Attributes
+    ----------
+    gauth : GoogleAuth
+        The GoogleAuth object holding the credentials.
+    credentials_path : str
+        The file the credentials are saved to.
+
+    Methods
+    -------
+    token() -> str:
+        Return a valid access token.
+    is_authorized() -> bool:
+        Return whether credentials are present.
+    authorize() -> None:
+        Run the interactive oauth flow in a browser when there are no credentials yet.
+    close() -> None:
+        Stop the background refresh.
+    """
+
+    def __init__(self, client_secret_path: str, credentials_path: str) -> None:
+        """
+        Initiate a token manager with the saved credentials, the interactive flow is only run by `authorize`.
+
+        Parameters
+        ----------
+        client_secret_path : str
+            The oauth client secret file of the google cloud project.
+        credentials_path : str
+            The file the credentials are saved to.
+        """
+        self.gauth = GoogleAuth('settings.yaml')
+        self.gauth.DEFAULT_SETTINGS['client_config_backend'] = 'file'
+        self.gauth.DEFAULT_SETTINGS['client_config_file'] = client_secret_path
+        self.credentials_path = credentials_path
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+        with self._lock:
+            self._authenticate(interactive=False)
+
+    def authorize(self) -> None:
+        """Run the interactive oauth flow in a browser, it blocks until the user answers."""
+        with self._lock:
+            if not self.is_authorized():
+                self._authenticate(interactive=True)
+
+    def close(self) -> None:
+        """Stop the background refresh."""
+        self._closed.set()
+        self._wakeup.set()
+
+    def _authenticate(self, interactive: bool) -> None:
+        try:
+            self.gauth.LoadCredentialsFile(self.credentials_path)
+            if self.gauth.credentials is None:
+                if not interactive:
+                    return
+                # Authenticate if they're not there
+                self.gauth.LocalWebserverAuth()
+            elif self.gauth.access_token_expired:
+                # Refresh them if expired
+                self.gauth.Refresh()
+            else:
+                # Initialize the saved creds
+                self.gauth.Authorize()
+            # Save the current credentials to a file
+            self.gauth.SaveCredentialsFile(self.credentials_path)
+        except AuthenticationRejected:
+            print("Authentication rejected")
+        except AuthenticationError:
+            print("Authentication error")
+        if self.is_authorized() and self._refresher is None:
+            self._refresher = threading.Thread(
+                target=self._run, name="sd-web-ui-connect-gdrive-token", daemon=True
+            )
+            self._refresher.start()
+
+    def is_authorized(self) -> bool:
+        """Return whether credentials are present."""
+        return (
+            self.gauth.credentials is not None
+            and self.gauth.credentials.access_token is not None
+        )
+
+    def token(self) -> str:
+        """Return a valid access token, only refreshed here when the background refresh fell behind."""
+        if self._expires_in() <= 0:
+            self._refresh()
+        return self.gauth.credentials.access_token
+
+    def _expires_in(self) -> float:
+        expiry = self.gauth.credentials.token_expiry
+        if expiry is None:
+            return float("inf")
+        return (expiry - datetime.datetime.utcnow()).total_seconds()
+
+    def _refresh(self) -> None:
+        with self._lock:
+            # another thread may have refreshed while this one waited for the lock.
+            if self._expires_in() > REFRESH_MARGIN:
+                return
+            self.gauth.Refresh()
+            self.gauth.SaveCredentialsFile(self.credentials_path)
+
+    def _run(self) -> None:
+        while not self._closed.is_set():
+            delay = self._expires_in() - REFRESH_MARGIN
+            if delay > 0:
+                self._wakeup.wait(min(delay, 3600.0))
+                continue
+            try:
+                self._refresh()
+            except Exception as e:
+                print(f"Failed to refresh the google drive token: {e!r}")
+                self._wakeup.wait(RETRY_INTERVAL)
+
+
+_managers: Dict[Tuple[str, str], DriveTokenManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(
+    client_secret_path: str, credentials_path: str, interactive: bool = False
+) -> DriveTokenManager:
+    """
+    Return the token manager of a client, created from the saved credentials on first use.
+
+    A manager without credentials is cached as well, only `interactive` callers (the authorization
+    at startup) run the oauth flow, uploads and health checks never wait for a browser.
+    """
+    key = (client_secret_path, credentials_path)
+    with _managers_lock:
+        manager: Optional[DriveTokenManager] = _managers.get(key)
+    if manager is None:
+        # loading the credentials may refresh them over the network, it runs outside the lock.
+        created = DriveTokenManager(client_secret_path, credentials_path)
+        with _managers_lock:
+            manager = _managers.setdefault(key, created)
+        if manager is not created:
+            created.close()
+    if interactive:
+        manager.authorize()
+    return manager
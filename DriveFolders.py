@@ -0,0 +1,152 @@
+import json
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from DriveUploader import STATUS_NOT_FOUND, TIMEOUT, http_session
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+
+
+class DriveFolderCache:
+
+    """
+    DriveFolderCache: A persisted cache of Google Drive folder names to their ids.
+
+    A cached id is validated with a single `files.get` the first time a process uses it, after that
+    resolving a folder makes no api call. Folders missing from the cache are looked up by name
+    and created when they do not exist.
+
+    Attributes
+    ----------
+    path : Path
+        The json file the folder ids are persisted in.
+
+    Methods
+    -------
+    resolve(api_url:str, name:str, token:Callable[[],str]) -> str:
+        Return the id of a folder in the drive root, created when it does not exist.
+    create(api_url:str, name:str, token:Callable[[],str]) -> str:
+        Create a folder in the drive root and cache its id.
+    invalidate(api_url:str, name:str) -> None:
+        Forget the id of a folder, E.g. when drive reports it missing.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Initiate a cache persisted in a json file, the file is read by the lookups.
+
+        Parameters
+        ----------
+        path : str
+            The json file the folder ids are persisted in.
+        """
+        self.path = Path(path)
+        self._lock = threading.RLock()
+        # folders validated by this process, keyed by (api url, name).
+        self._validated: Dict[Tuple[str, str], str] = {}
+
+    def resolve(self, api_url: str, name: str, token: Callable[[], str]) -> str:
+        """Return the id of a folder in the drive root, created when it does not exist."""
+        with self._lock:
+            folder_id = self._validated.get((api_url, name))
+            if folder_id is not None:
+                return folder_id
+            folder_id = self._load().get(api_url, {}).get(name)
+            if folder_id is None or not self._is_valid(api_url, folder_id, name, token):
+                folder_id = self._find(api_url, name, token)
+                if folder_id is None:
+                    print("Folder not found, creating new folder")
+                    return self.create(api_url, name, token)
+                self._store(api_url, name, folder_id)
+            self._validated[(api_url, name)] = folder_id
+            return folder_id
+
+    def create(self, api_url: str, name: str, token: Callable[[], str]) -> str:
+        """Create a folder in the drive root and cache its id."""
+        response = http_session.post(
+            f"{api_url}/drive/v3/files",
+            params={"fields": "id"},
+            headers={"Authorization": f"Bearer {token()}"},
+            json={"name": name, "mimeType": FOLDER_MIME_TYPE, "parents": ["root"]},
+            timeout=TIMEOUT,
+        )
+        response.raise_for_status()
+        folder_id = response.json()["id"]
+        with self._lock:
+            self._store(api_url, name, folder_id)
+            self._validated[(api_url, name)] = folder_id
+        return folder_id
+
+    def invalidate(self, api_url: str, name: str) -> None:
+        """Forget the id of a folder, the next `resolve` looks it up again."""
+        with self._lock:
+            self._validated.pop((api_url, name), None)
+            self._store(api_url, name, None)
+
+    def _is_valid(
+        self, api_url: str, folder_id: str, name: str, token: Callable[[], str]
+    ) -> bool:
+        response = http_session.get(
+            f"{api_url}/drive/v3/files/{folder_id}",
+            params={"fields": "id,name,mimeType,trashed"},
+            headers={"Authorization": f"Bearer {token()}"},
+            timeout=TIMEOUT,
+        )
+        if response.status_code == STATUS_NOT_FOUND:
+            return False
+        response.raise_for_status()
+        folder = response.json()
+        return (
+            folder.get("name") == name
+            and folder.get("mimeType") == FOLDER_MIME_TYPE
+            and not folder.get("trashed", False)
+        )
+
+    def _find(self, api_url: str, name: str, token: Callable[[], str]) -> Optional[str]:
+        escaped = name.replace("\\", "\\\\").replace("'", "\\'")
+        response = http_session.get(
+            f"{api_url}/drive/v3/files",
+            params={
+                "q": f"name = '{escaped}' and mimeType = '{FOLDER_MIME_TYPE}' "
+                "and 'root' in parents and trashed = false",
+                "fields": "files(id)",
+                "pageSize": 1,
+            },
+            headers={"Authorization": f"Bearer {token()}"},
+            timeout=TIMEOUT,
+        )
+        response.raise_for_status()
+        files = response.json().get("files", [])
+        if not files:
+            return None
+        print("Folder found")
+        return files[0]["id"]
+
+    def _load(self) -> Dict[str, Dict[str, str]]:
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _store(self, api_url: str, name: str, folder_id: Optional[str]) -> None:
+        folders = self._load()
+        if folder_id is None:
+            folders.get(api_url, {}).pop(name, None)
+        else:
+            folders.setdefault(api_url, {})[name] = folder_id
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        tmp_path.write_text(json.dumps(folders))
+        tmp_path.replace(self.path)
+
+
+_caches: Dict[str, DriveFolderCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_folder_cache(path: str) -> DriveFolderCache:
+    """Return the folder cache persisted at `path`, shared by every connector of the process."""
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = DriveFolderCache(path)
+        return _caches[path]
@@ -0,0 +1,312 @@
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DRIVE_API_URL = "https://www.googleapis.com"
+# the drive api wants every chunk but the last one to be a multiple of 256 KB.
+CHUNK_ALIGNMENT = 256 * 1024
+# drive keeps an upload session for a week, older ones are started over.
+SESSION_MAX_AGE = 6 * 24 * 3600
+TIMEOUT = (10, 120)
+RETRY_STATUS = (429, 500, 502, 503, 504)
+DONE_STATUS = (200, 201)
+# drive answers 308 (Resume Incomplete) while a resumable upload is missing bytes.
+STATUS_RESUME_INCOMPLETE = 308
+STATUS_NOT_FOUND = 404
+# the upload session uri is unknown or expired.
+EXPIRED_STATUS = (STATUS_NOT_FOUND, 410)
+
+# a keep-alive session shared by every upload of this process.
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+http_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+
+class UploadSessionExpired(Exception):
+
+    """The upload session uri is not known to drive anymore, the upload has to start over."""
+
+
+class DriveUploader:
+
+    """
+    DriveUploader: Resumable, chunked uploads to the Google Drive api (`uploadType=resumable`).
+
+    The upload session uri of each file is persisted before the first chunk is sent, an upload
+    that was interrupted (E.g. by a restart or a retry from the upload spool) asks drive how much
+    it received and continues from there. 429 and 5xx answers and connection errors are retried
+    with a full jitter exponential backoff.
+
+    Attributes
+    ----------
+    api_url : str
+        The base url of the drive api, a local stand-in can be used for testing.
+    chunk_size : int
+        The size of each uploaded chunk, rounded down to a multiple of 256 KB.
+    session_dir : Path
+        The directory the upload session uris are persisted in.
+    max_retries : int
+        The number of consecutive failed requests an upload gives up after.
+
+    Methods
+    -------
+    upload(data:bytes, metadata:dict, token:Callable[[],str], content_type:str) -> dict:
+        Upload a file and return the file resource created by drive.
+    """
+
+    def __init__(
+        self,
+        api_url: str = DRIVE_API_URL,
+        chunk_size: int = 8 * 1024 * 1024,
+        session_dir: Optional[str] = None,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 64.0,
+    ) -> None:
+        """
+        Initiate an uploader, the expired sessions of `session_dir` are removed.
+
+        Parameters
+        ----------
+        api_url : str
+            The base url of the drive api, a local stand-in can be used for testing.
+        chunk_size : int
+            The size of each uploaded chunk, rounded down to a multiple of 256 KB.
+        session_dir : Optional[str]
+            The directory the upload session uris are persisted in, None keeps no sessions.
+        max_retries : int
+            The number of consecutive failed requests an upload gives up after.
+        base_delay : float
+            The first retry delay in seconds, the jittered delay doubles on each failure.
+        max_delay : float
+            The upper bound of the retry delay in seconds.
+        """
+        self.api_url = api_url.rstrip("/")
+        self.chunk_size = max(CHUNK_ALIGNMENT, chunk_size // CHUNK_ALIGNMENT * CHUNK_ALIGNMENT)
+        self.session_dir = Path(session_dir) if session_dir is not None else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        if self.session_dir is not None:
+            self.session_dir.mkdir(parents=True, exist_ok=True)
+            self._remove_expired_sessions()
+
+    def upload(
+        self,
+        data: bytes,
+        metadata: dict,
+        token: Callable[[], str],
+        content_type: str = "image/png",
+    ) -> dict:
+        """
+        Upload a file and return the file resource created by drive.
+
+        Parameters
+        ----------
+        data : bytes
+            The content of the file.
+        metadata : dict
+            The drive file metadata, E.g. name and parents.
+        token : Callable[[], str]
+            Returns the current oauth access token, called for each request.
+        content_type : str
+            The mime type of the file.
+
+        Raises
+        ------
+        requests.HTTPError
+            When drive rejects the upload or keeps failing after `max_retries` attempts.
+        """
+        session_key = self._session_key(data, metadata)
+        uri = self._load_session(session_key)
+        resumed = uri is not None
+        if uri is None:
+            uri = self._start_session(data, metadata, token, content_type)
+            self._save_session(session_key, uri)
+        try:
+            return self._send(uri, session_key, data, token, resumed)
+        except UploadSessionExpired:
+            uri = self._start_session(data, metadata, token, content_type)
+            self._save_session(session_key, uri)
+            return self._send(uri, session_key, data, token, resumed=False)
+
+    def _send(
+        self, uri: str, session_key: str, data: bytes, token: Callable[[], str], resumed: bool
+    ) -> dict:
+        """Send the chunks of a file, a resumed session starts at what drive already received."""
+        total = len(data)
+        offset = self._status(uri, session_key, total, token) if resumed else 0
+        failures = 0
+        while True:
+            if isinstance(offset, dict):
+                # the session was already complete, the previous attempt lost the answer.
+                self._drop_session(session_key)
+                return offset
+            end = min(offset + self.chunk_size, total)
+            content_range = f"bytes {offset}-{end - 1}/{total}" if total else "bytes */0"
+            try:
+                response = self._request(
+                    "PUT", uri, token, {"Content-Range": content_range}, data[offset:end]
+                )
+            except requests.RequestException as e:
+                failures = self._backoff(failures, e)
+                offset = self._status(uri, session_key, total, token)
+                continue
+            if response.status_code in DONE_STATUS:
+                self._drop_session(session_key)
+                return response.json()
+            if response.status_code == STATUS_RESUME_INCOMPLETE:
+                offset = self._received(response)
+                failures = 0
+                continue
+            if response.status_code in EXPIRED_STATUS:
+                self._drop_session(session_key)
+                raise UploadSessionExpired(uri)
+            if response.status_code in RETRY_STATUS:
+                failures = self._backoff(failures, self._error(response))
+                offset = self._status(uri, session_key, total, token)
+                continue
+            response.raise_for_status()
+
+    def _start_session(
+        self, data: bytes, metadata: dict, token: Callable[[], str], content_type: str
+    ) -> str:
+        """Create an upload session and return its uri."""
+        failures = 0
+        while True:
+            try:
+                response = self._request(
+                    "POST",
+                    f"{self.api_url}/upload/drive/v3/files?uploadType=resumable",
+                    token,
+                    {
+                        "Content-Type": "application/json; charset=UTF-8",
+                        "X-Upload-Content-Type": content_type,
+                        "X-Upload-Content-Length": str(len(data)),
+                    },
+                    json.dumps(metadata).encode("utf-8"),
+                )
+            except requests.RequestException as e:
+                failures = self._backoff(failures, e)
+                continue
+            if response.status_code in RETRY_STATUS:
+                failures = self._backoff(failures, self._error(response))
+                continue
+            response.raise_for_status()
+            return response.headers["Location"]
+
+    def _status(
+        self, uri: str, session_key: str, total: int, token: Callable[[], str]
+    ) -> Union[int, dict]:
+        """Ask drive how many bytes of a session it received, the file resource when the upload is complete."""
+        failures = 0
+        while True:
+            try:
+                response = self._request(
+                    "PUT", uri, token, {"Content-Range": f"bytes */{total}"}
+                )
+            except requests.RequestException as e:
+                failures = self._backoff(failures, e)
+                continue
+            if response.status_code == STATUS_RESUME_INCOMPLETE:
+                return self._received(response)
+            if response.status_code in DONE_STATUS:
+                return response.json()
+            if response.status_code in EXPIRED_STATUS:
+                self._drop_session(session_key)
+                raise UploadSessionExpired(uri)
+            if response.status_code in RETRY_STATUS:
+                failures = self._backoff(failures, self._error(response))
+                continue
+            response.raise_for_status()
+
+    def _request(
+        self,
+        method: str,
+        url: str,
+        token: Callable[[], str],
+        headers: dict,
+        body: bytes = b"",
+    ) -> requests.Response:
+        headers = {"Authorization": f"Bearer {token()}", **headers}
+        return http_session.request(method, url, headers=headers, data=body, timeout=TIMEOUT)
+
+    @staticmethod
+    def _error(response: requests.Response) -> requests.HTTPError:
+        return requests.HTTPError(
+            f"{response.status_code} {response.reason}", response=response
+        )
+
+    @staticmethod
+    def _received(response: requests.Response) -> int:
+        """Return the offset after the last byte drive confirmed in a 308 answer."""
+        match = re.match(r"bytes=0-(\d+)", response.headers.get("Range", ""))
+        return int(match.group(1)) + 1 if match else 0
+
+    def _backoff(self, failures: int, error: Exception) -> int:
+        """Sleep before the next attempt and return the new number of consecutive failures."""
+        failures += 1
+        if failures > self.max_retries:
+            raise error
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**failures))
+        print(f"Google drive upload failed ({error}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+        return failures
+
+    def _session_key(self, data: bytes, metadata: dict) -> str:
+        digest = hashlib.sha256(data)
+        digest.update(json.dumps(metadata, sort_keys=True).encode("utf-8"))
+        digest.update(self.api_url.encode("utf-8"))
+        return digest.hexdigest()[:32]
+
+    def _session_path(self, session_key: str) -> Path:
+        return self.session_dir / f"{session_key}.json"
+
+    def _load_session(self, session_key: str) -> Optional[str]:
+        if self.session_dir is None:
+            return None
+        try:
+            session = json.loads(self._session_path(session_key).read_text())
+        except (OSError, ValueError):
+            return None
+        if time.time() - session.get("created", 0) > SESSION_MAX_AGE:
+            return None
+        print("Resuming google drive upload")
+        return session.get("uri")
+
+    def _save_session(self, session_key: str, uri: str) -> None:
+        """Persist a session uri atomically, it is the only way to resume the upload after a restart."""
+        if self.session_dir is None:
+            return
+        path = self._session_path(session_key)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with tmp_path.open("w") as f:
+            json.dump({"uri": uri, "created": time.time()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp_path.replace(path)
+
+    def _drop_session(self, session_key: str) -> None:
+        if self.session_dir is None:
+            return
+        try:
+            self._session_path(session_key).unlink()
+        except OSError:
+            pass
+
+    def _remove_expired_sessions(self) -> None:
+        now = time.time()
+        for path in self.session_dir.iterdir():
+            try:
+                if now - path.stat().st_mtime > SESSION_MAX_AGE:
+                    path.unlink()
+            except OSError:
+                continue
@@ -1,14 +1,15 @@
-import json
 import os
-from io import BytesIO
+from typing import Dict, List, Optional, Tuple
 
 import requests
-from PIL import PngImagePlugin
+from numpy import ndarray
 from PIL.Image import Image
-from pydrive2.auth import AuthenticationError, AuthenticationRejected, GoogleAuth
-from pydrive2.drive import GoogleDrive
 
 from BaseConnector import BaseConnector
+from DriveAuth import get_token_manager
+from DriveFolders import get_folder_cache
+from DriveUploader import DRIVE_API_URL, STATUS_NOT_FOUND, DriveUploader
+from PngEncoder import encode_png
 
 
 class GDriveConnector(BaseConnector):
@@ -18,119 +19,144 @@ class GDriveConnector(BaseConnector):
 
     Attributes
     ----------
+    auth : DriveTokenManager
+        The credentials shared by all connectors of the client, refreshed in the background.
     gauth : GoogleAuth
         The GoogleAuth object.
     extension_path : str
         The path to the extension folder.
-    drive : GoogleDrive
-        The GoogleDrive object.
+    folders : DriveFolderCache
+        The persisted cache of folder ids.
     dir_name : str
         The name of the folder in google drive.
     dir_id : str
         The id of the folder in google drive.
+    uploader : DriveUploader
+        Sends files as resumable, chunked uploads over the shared keep-alive http session.
 
     Methods
     -------
     store_file(name:str, image:Image, png_info:dict) -> None:
-        try to upload image to google drive.
+        try to upload image to google drive, raises PermissionError when it is not authorized.
+
+    store_bytes(name:str, data:bytes) -> None:
+        try to upload an encoded png file to google drive, raises PermissionError when it is not authorized.
 
     _save_image_request(image_bytes:bytes, filename:str) -> None:
-        Performs http request to google drive api for upload image.
+        Performs a resumable upload of an image to google drive api.
     """
 
-    def __init__(self,client_secret_path:str, dir_name:str='sd_web_ui') -> None:
+    def __init__(
+        self,
+        client_secret_path:str,
+        dir_name:str='sd_web_ui',
+        api_url:str=DRIVE_API_URL,
+        chunk_size:int=8 * 1024 * 1024,
+        session_dir:Optional[str]=None,
+        interactive:bool=False,
+    ) -> None:
         """
         Initiate a GDriveConnector object. using pydrive2. and create a folder in google drive if it doesn't exist.
 
+        Credentials and the folder id are shared by every connector of the process, constructing
+        a connector after the first one makes no api call.
+
         Parameters
         ----------
         client_secret_path : str
             The path to the client_secret.json file.
         dir_name : str
             The name of the folder in google drive.
+        api_url : str
+            The base url uploads are sent to, a local stand-in of the drive api can be used for testing.
+            Empty for the google api.
+        chunk_size : int
+            The size of each uploaded chunk in bytes.
+        session_dir : str
+            The directory upload session uris are persisted in, interrupted uploads resume from it.
+        interactive : bool
+            Run the oauth flow in a browser when there are no saved credentials, only done at startup.
         """
-        self.gauth = GoogleAuth('settings.yaml')
-        self.gauth.DEFAULT_SETTINGS['client_config_backend'] = 'file'
-        self.gauth.DEFAULT_SETTINGS['client_config_file'] = client_secret_path
         self.extension_path = os.path.dirname(os.path.realpath(__file__))
-        try:
-            self.gauth.LoadCredentialsFile(self.extension_path+"/credentials.json")
-            if self.gauth.credentials is None:
-                # Authenticate if they're not there
-                self.gauth.LocalWebserverAuth()
-            elif self.gauth.access_token_expired:
-                # Refresh them if expired
-                self.gauth.Refresh()
-            else:
-                # Initialize the saved creds
-                self.gauth.Authorize()
-            # Save the current credentials to a file
-            self.gauth.SaveCredentialsFile(self.extension_path+"/credentials.json")
-        except AuthenticationRejected :
-            print("Authentication rejected")
-        except AuthenticationError:
-            print("Authentication error")
-
-        self.drive = GoogleDrive(self.gauth)
+        self.auth = get_token_manager(
+            client_secret_path, self.extension_path+"/credentials.json", interactive
+        )
+        self.gauth = self.auth.gauth
+        self.folders = get_folder_cache(self.extension_path+"/gdrive-folders.json")
+        self.api_url = (api_url or DRIVE_API_URL).rstrip('/')
         self.dir_name = dir_name
         self.dir_id = self.get_gdrive_folder_id()
+        self.uploader = DriveUploader(self.api_url, chunk_size, session_dir)
 
     def store_file(self, name:str, image:Image,png_info:dict)->None:
         """Upload a file to google drive."""
-        if self.gauth.credentials.access_token is None:
-            return
-        with BytesIO() as output:
-            pnginfo_data = PngImagePlugin.PngInfo()
-            for k, v in png_info.items():
-                pnginfo_data.add_text(k, str(v))
-            image.save(output, format='png',quality=100,pnginfo=pnginfo_data)
-            image_bytes = output.getvalue()
-            self._save_image_request(image_bytes,name)
+        self._require_authorized()
+        self.store_bytes(name, encode_png(image, png_info))
 
+    def store_bytes(self, name:str, data:bytes)->None:
+        """Upload an encoded png file to google drive."""
+        self._require_authorized()
+        self._save_image_request(data,name)
+
+    def _require_authorized(self)->None:
+        """Raise when there are no credentials, so the upload is counted as failed and kept in the spool."""
+        if not self.auth.is_authorized():
+            raise PermissionError("Google Drive is not authorized")
 
     def _save_image_request(self,image_bytes:bytes,filename:str)->None:
         """
-        sent api request to google drive api fir upload image.
+        sent a resumable upload of an image to google drive api.
 
         PyDrive seem to have issues with uploading bytes image, so we use api requests instead.
+        Failures raise so the upload is retried from the spool, which resumes the same upload session.
+        """
+        if self.dir_id is None:
+            self.dir_id = self.folders.resolve(self.api_url, self.dir_name, self.auth.token)
+        metadata = {"name": filename.split('/')[-1] + '.png', "parents": [self.dir_id]}
+        try:
+            self.uploader.upload(image_bytes, metadata, self.auth.token)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != STATUS_NOT_FOUND:
+                raise
+            # the folder was deleted since its id was cached.
+            self.folders.invalidate(self.api_url, self.dir_name)
+            self.dir_id = self.folders.resolve(self.api_url, self.dir_name, self.auth.token)
+            metadata["parents"] = [self.dir_id]
+            self.uploader.upload(image_bytes, metadata, self.auth.token)
+
+    def get_gdrive_folder_id(self)->Optional[str]:
         """
-        metadata = {
-            "name": filename.split('/')[-1] + '.png',
-            "parents": [self.dir_id]
-            }
-        files = {
-                'data': ('metadata', json.dumps(metadata), 'application/json'),
-                'file': image_bytes
-            }
-        _ = requests.post(
-            "https://www.googleapis.com/upload/drive/v3/files?uploadType=multipart",
-            headers={"Authorization": "Bearer " + self.gauth.credentials.access_token},
-            files=files
-            )
-
-    def get_gdrive_folder_id(self)->None:
-        """Get the folder id of the folder in google drive."""
-        folder_list = self.drive.ListFile({'q': "'root' in parents and trashed=false"}).GetList()
-        for folder in folder_list:
-            if folder['title'] == self.dir_name:
-                print("Folder found")
-                return folder['id']
-        print("Folder not found, creating new folder")
-        self.create_folder()
-        return None
-
-    def create_folder(self)->None:
-        """Create a folder in google drive."""
-        file_metadata = {
-            'title': self.dir_name,
-            'mimeType': 'application/vnd.google-apps.folder'
-        }
-
-        folder = self.drive.CreateFile(file_metadata)
-        folder.Upload()
+        Get the folder id of the folder in google drive, from the folder cache after the first lookup.
 
+        None when it can't be looked up yet, the first upload resolves it again.
+        """
+        if not self.auth.is_authorized():
+            return None
+        try:
+            return self.folders.resolve(self.api_url, self.dir_name, self.auth.token)
+        except requests.RequestException as e:
+            print(f"Failed to find the google drive folder {self.dir_name}: {e!r}")
+            return None
+
+    def create_folder(self)->str:
+        """Create a folder in google drive and return its id."""
+        self._require_authorized()
+        self.dir_id = self.folders.create(self.api_url, self.dir_name, self.auth.token)
+        return self.dir_id
 
     def before_unload(self)->None:
         pass
 
+    def traverse(self, sub_dir:str)->List[str]:
+        """Browsing google drive is not supported."""
+        raise NotImplementedError("The remote browser does not support google drive")
+
+    def download(self, name:str)->Tuple[ndarray, Dict[str, str]]:
+        """Browsing google drive is not supported."""
+        raise NotImplementedError("The remote browser does not support google drive")
+
+    def is_alive(self)->bool:
+        """Google drive uploads are plain https requests, only the credentials need to be present (never prompts for them)."""
+        return self.auth.is_authorized()
+
 
@@ -0,0 +1,122 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Union
+
+import numpy as np
+
+# what the cache holds, E.g. raw files as bytes and thumbnails or png headers as named tuples.
+CacheValue = Union[np.ndarray, bytes, bytearray, str, dict, list, tuple]
+
+
+def _sizeof(value: object) -> int:
+    """Estimate the memory used by a cached value (ndarrays, bytes, strings and containers of them)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_sizeof(v) for v in value)
+    return 64
+
+
+class ImageCache:
+
+    """
+    ImageCache: A thread safe LRU cache of downloaded images and metadata bounded by a byte budget.
+
+    Keys should identify the remote file and its version, E.g.
+    (connector id, path, size, mtime, variant) so a file that changed on the server is fetched again.
+
+    Attributes
+    ----------
+    max_bytes : int
+        The memory budget, the least recently used entries are evicted above it.
+    hits : int
+        The number of lookups served from the cache.
+    misses : int
+        The number of lookups that were not cached.
+
+    Methods
+    -------
+    get(key:Hashable) -> Optional[CacheValue]:
+        Return a cached value (None when missing) and mark it as recently used.
+    put(key:Hashable, value:CacheValue) -> None:
+        Cache a value, evicting the least recently used ones above the budget.
+    clear() -> None:
+        Remove every entry.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024) -> None:
+        """
+        Initiate an empty cache.
+
+        Parameters
+        ----------
+        max_bytes : int
+            The memory budget, the least recently used entries are evicted above it.
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, CacheValue] = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of cached values."""
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        """Return the estimated memory used by the cached values."""
+        return self._total
+
+    def get(self, key: Hashable) -> Optional[CacheValue]:
+        """Return a cached value (None when missing) and mark it as recently used."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: CacheValue) -> None:
+        """Cache a value, evicting the least recently used ones above the budget."""
+        nbytes = _sizeof(value)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._total -= self._sizes.pop(key)
+                del self._entries[key]
+            self._entries[key] = value
+            self._sizes[key] = nbytes
+            self._total += nbytes
+            self._evict()
+
+    def resize(self, max_bytes: int) -> None:
+        """Change the memory budget, evicting entries when it shrinks."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._total = 0
+
+    def _evict(self) -> None:
+        while self._total > self.max_bytes and self._entries:
+            key, _ = self._entries.popitem(last=False)
+            self._total -= self._sizes.pop(key)
+
+
+# shared by every connector, browser tab and session of this process.
+image_cache = ImageCache()
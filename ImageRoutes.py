@@ -0,0 +1,218 @@
+import hashlib
+import hmac
+import mimetypes
+import os
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+from urllib.parse import urlencode
+
+from fastapi import FastAPI, Request, Response
+
+from BaseConnector import RemoteFile
+from Thumbnail import EncodedImage
+
+ROUTE_PREFIX = "/sd-web-ui-connect"
+# urls carry the size and mtime of the file, a changed file gets a new url.
+CACHE_CONTROL = "private, max-age=31536000, immutable"
+SECRET_BYTES = 32
+
+
+def load_secret(path: str) -> bytes:
+    """Return the key that signs image urls, created on first use so urls stay valid across restarts."""
+    try:
+        secret = Path(path).read_bytes()
+        if len(secret) >= SECRET_BYTES:
+            return secret
+    except OSError:
+        pass
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    secret = os.urandom(SECRET_BYTES)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(secret)
+    return secret
+
+
+def parse_range(header: str, length: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single `bytes=` range header into inclusive (start, end) offsets.
+
+    Return None when the range can not be satisfied, multiple ranges are served as the whole file.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return 0, length - 1
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            start, end = max(0, length - int(last)), length - 1
+        else:
+            start = int(first)
+            end = min(int(last), length - 1) if last else length - 1
+    except ValueError:
+        return 0, length - 1
+    if start > end or start >= length:
+        return None
+    return start, end
+
+
+class ImageRoutes:
+
+    """
+    ImageRoutes: FastAPI routes that serve remote images to the gallery of the remote browser.
+
+    Thumbnails are encoded once and served from the image cache, full images are served as the
+    raw remote file. Urls are signed, versioned by the size and mtime of the file and sent with
+    an `ETag` and an immutable `Cache-Control` so the web browser keeps them across sessions.
+
+    Attributes
+    ----------
+    secret : bytes
+        The key that signs image urls, only urls handed out by the extension are served.
+
+    Methods
+    -------
+    register(app:FastAPI) -> None:
+        Add the routes to the webui app.
+    thumbnail_url(base_url:str, connector_id:str, remote_file:RemoteFile, size:int) -> str:
+        Return the url of a thumbnail.
+    image_url(base_url:str, connector_id:str, remote_file:RemoteFile) -> str:
+        Return the url of a full resolution image.
+    """
+
+    def __init__(
+        self,
+        secret: bytes,
+        resolve: Callable[[str], Optional[Tuple]],
+        thumbnail: Callable[[Tuple, RemoteFile, int], EncodedImage],
+        original: Callable[[Tuple, RemoteFile], bytes],
+    ) -> None:
+        """
+        Initiate the routes.
+
+        Parameters
+        ----------
+        secret : bytes
+            The key that signs image urls.
+        resolve : Callable[[str], Optional[Tuple]]
+            Returns the pool key of a connector id, None when it is not configured.
+        thumbnail : Callable[[Tuple, RemoteFile, int], EncodedImage]
+            Returns an encoded thumbnail through the image cache.
+        original : Callable[[Tuple, RemoteFile], bytes]
+            Returns the raw remote file through the image cache.
+        """
+        self.secret = secret
+        self._resolve = resolve
+        self._thumbnail = thumbnail
+        self._original = original
+
+    def register(self, app: FastAPI) -> None:
+        """Add the routes to the webui app."""
+        app.add_api_route(
+            f"{ROUTE_PREFIX}/thumbnail", self.thumbnail, methods=["GET", "HEAD"]
+        )
+        app.add_api_route(f"{ROUTE_PREFIX}/image", self.image, methods=["GET", "HEAD"])
+
+    def thumbnail_url(
+        self, base_url: str, connector_id: str, remote_file: RemoteFile, size: int
+    ) -> str:
+        """Return the absolute url of a thumbnail."""
+        return self._url(base_url, "thumbnail", connector_id, remote_file, size)
+
+    def image_url(self, base_url: str, connector_id: str, remote_file: RemoteFile) -> str:
+        """Return the absolute url of a full resolution image."""
+        return self._url(base_url, "image", connector_id, remote_file, 0)
+
+    def thumbnail(
+        self, request: Request, c: str, p: str, b: int, m: float, s: int, sig: str
+    ) -> Response:
+        """Serve a thumbnail, the query holds connector id, path, bytes, mtime, size and signature."""
+        key = self._verify("thumbnail", c, p, b, m, s, sig)
+        if key is None:
+            return Response(status_code=404)
+        etag = f'"{sig}"'
+        if self._not_modified(request, etag):
+            return Response(status_code=304, headers=self._headers(etag))
+        encoded = self._thumbnail(key, RemoteFile(p, b, m), s)
+        return self._respond(request, encoded.data, encoded.content_type, etag)
+
+    def image(
+        self, request: Request, c: str, p: str, b: int, m: float, sig: str
+    ) -> Response:
+        """Serve the raw remote file, the query holds connector id, path, bytes, mtime and signature."""
+        key = self._verify("image", c, p, b, m, 0, sig)
+        if key is None:
+            return Response(status_code=404)
+        etag = f'"{sig}"'
+        if self._not_modified(request, etag):
+            return Response(status_code=304, headers=self._headers(etag))
+        data = self._original(key, RemoteFile(p, b, m))
+        content_type = mimetypes.guess_type(p)[0] or "application/octet-stream"
+        return self._respond(request, data, content_type, etag)
+
+    def _sign(
+        self, kind: str, connector_id: str, path: str, size: int, mtime: float, thumbnail_size: int
+    ) -> str:
+        message = repr((kind, connector_id, path, size, mtime, thumbnail_size)).encode()
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()[:32]
+
+    def _url(
+        self,
+        base_url: str,
+        kind: str,
+        connector_id: str,
+        remote_file: RemoteFile,
+        thumbnail_size: int,
+    ) -> str:
+        query = {
+            "c": connector_id,
+            "p": remote_file.name,
+            "b": remote_file.size,
+            "m": remote_file.mtime,
+        }
+        if kind == "thumbnail":
+            query["s"] = thumbnail_size
+        query["sig"] = self._sign(
+            kind,
+            connector_id,
+            remote_file.name,
+            remote_file.size,
+            float(remote_file.mtime),
+            thumbnail_size,
+        )
+        return f"{base_url}{ROUTE_PREFIX}/{kind}?{urlencode(query)}"
+
+    def _verify(
+        self, kind: str, c: str, p: str, b: int, m: float, s: int, sig: str
+    ) -> Optional[Tuple]:
+        if not hmac.compare_digest(sig, self._sign(kind, c, p, b, float(m), s)):
+            return None
+        return self._resolve(c)
+
+    def _headers(self, etag: str) -> dict:
+        return {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Accept-Ranges": "bytes"}
+
+    def _not_modified(self, request: Request, etag: str) -> bool:
+        if_none_match = request.headers.get("if-none-match", "")
+        tags = (tag.strip() for tag in if_none_match.split(","))
+        return any(
+            (tag[2:] if tag.startswith("W/") else tag) in (etag, "*") for tag in tags
+        )
+
+    def _respond(
+        self, request: Request, data: bytes, content_type: str, etag: str
+    ) -> Response:
+        headers = self._headers(etag)
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if range_header is None or (if_range is not None and if_range != etag):
+            return Response(data, media_type=content_type, headers=headers)
+        byte_range = parse_range(range_header, len(data))
+        if byte_range is None:
+            headers["Content-Range"] = f"bytes */{len(data)}"
+            return Response(status_code=416, headers=headers)
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        return Response(
+            data[start : end + 1], status_code=206, media_type=content_type, headers=headers
+        )
@@ -0,0 +1,104 @@
+import threading
+import time
+from typing import Callable, ContextManager, Dict, List, NamedTuple, Optional, Tuple
+
+from BaseConnector import BaseConnector, RemoteFile
+from Metrics import metrics
+
+
+class Listing(NamedTuple):
+
+    """
+    Listing: A cached directory listing.
+
+    Attributes
+    ----------
+    files : List[RemoteFile]
+        The files of the directory.
+    checked_at : float
+        When the listing was last fetched or confirmed to be up to date.
+    dir_mtime : float
+        The modification time of the directory when it was listed, None when the protocol does not report it.
+    """
+
+    files: List[RemoteFile]
+    checked_at: float
+    dir_mtime: Optional[float]
+
+
+class ListingCache:
+
+    """
+    ListingCache: A thread safe cache of directory listings per (connector id, sub directory).
+
+    Within `ttl` seconds listings are served from memory. After that the directory modification time
+    is compared first, when it did not change the cached listing is kept and only a full re-list
+    happens when the directory changed (or the protocol does not report it).
+
+    Attributes
+    ----------
+    ttl : float
+        Seconds a listing is served without contacting the remote host.
+
+    Methods
+    -------
+    get(connector_id:str, sub_dir:str, connect:Callable[[],ContextManager[BaseConnector]], refresh:bool) -> List[RemoteFile]:
+        Return the listing of a directory, `connect` borrows a connector only when the remote host must be asked.
+    invalidate(connector_id:str, sub_dir:str) -> None:
+        Drop cached listings of a connector (of every sub directory when `sub_dir` is None).
+    """
+
+    def __init__(self, ttl: float = 60.0) -> None:
+        """
+        Initiate an empty cache.
+
+        Parameters
+        ----------
+        ttl : float
+            Seconds a listing is served without contacting the remote host.
+        """
+        self.ttl = ttl
+        self._listings: Dict[Tuple[str, str], Listing] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        connector_id: str,
+        sub_dir: str,
+        connect: Callable[[], ContextManager[BaseConnector]],
+        refresh: bool = False,
+    ) -> List[RemoteFile]:
+        """Return the listing of a directory, `refresh` forces a full re-list."""
+        key = (connector_id, sub_dir)
+        with self._lock:
+            listing = self._listings.get(key)
+        now = time.time()
+        if listing is not None and not refresh and now - listing.checked_at < self.ttl:
+            metrics.inc("listing_cache_requests_total", result="hit")
+            return listing.files
+        metrics.inc("listing_cache_requests_total", result="miss")
+        with connect() as connector, metrics.timer("list_seconds", connector=connector_id):
+            dir_mtime = connector.dir_mtime(sub_dir)
+            if (
+                listing is not None
+                and not refresh
+                and dir_mtime is not None
+                and dir_mtime == listing.dir_mtime
+            ):
+                listing = listing._replace(checked_at=now)
+            else:
+                listing = Listing(connector.list_files(sub_dir), now, dir_mtime)
+        with self._lock:
+            self._listings[key] = listing
+        return listing.files
+
+    def invalidate(self, connector_id: str, sub_dir: Optional[str] = None) -> None:
+        """Drop cached listings of a connector (of every sub directory when `sub_dir` is None)."""
+        with self._lock:
+            for key in list(self._listings):
+                if key[0] == connector_id and (sub_dir is None or key[1] == sub_dir):
+                    del self._listings[key]
+
+
+# shared by every browser tab and session of this process.
+listing_cache = ListingCache()
@@ -0,0 +1,69 @@
+import json
+import zlib
+from typing import List, NamedTuple, Tuple
+
+MANIFEST_NAME = ".sdconnect-manifest.jsonl"
+# a directory modified this long after its manifest has files the manifest does not know.
+MANIFEST_SLACK = 2.0
+
+
+class ManifestEntry(NamedTuple):
+
+    """
+    ManifestEntry: A line of the remote manifest of a directory.
+
+    Attributes
+    ----------
+    name : str
+        The path of the file, as returned by `list_files`.
+    size : int
+        The size of the file in bytes.
+    mtime : float
+        The modification time of the file reported by the server.
+    data_offset : int
+        The offset of the first IDAT chunk (the thumbnail offset), -1 when unknown.
+    prompt : str
+        The prompt of the image, empty when unknown.
+    """
+
+    name: str
+    size: int
+    mtime: float
+    data_offset: int = -1
+    prompt: str = ""
+
+
+def _dumps(fields: dict) -> str:
+    return json.dumps(fields, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def encode_entry(entry: ManifestEntry) -> bytes:
+    """
+    Encode an entry to a manifest line.
+
+    The line carries a crc32 of its fields, lines torn or interleaved by concurrent writers fail it and are skipped.
+    """
+    fields = entry._asdict()
+    fields["crc"] = zlib.crc32(_dumps(fields).encode("utf-8"))
+    return (_dumps(fields) + "\n").encode("utf-8")
+
+
+def parse_manifest(data: bytes) -> Tuple[List[ManifestEntry], int]:
+    """
+    Parse the complete lines of a manifest (or of its tail).
+
+    Return the valid entries and the number of bytes consumed, a last line without
+    its newline is still being written and is left for the next read.
+    """
+    consumed = data.rfind(b"\n") + 1
+    entries = []
+    for line in data[:consumed].splitlines():
+        try:
+            fields = json.loads(line)
+            crc = fields.pop("crc")
+            if crc != zlib.crc32(_dumps(fields).encode("utf-8")):
+                continue
+            entries.append(ManifestEntry(**fields))
+        except (ValueError, TypeError, KeyError, AttributeError):
+            continue
+    return entries, consumed
@@ -0,0 +1,341 @@
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, ContextManager, Dict, Hashable, List, Optional, Tuple
+
+from BaseConnector import BaseConnector, RemoteFile
+from PngMetadata import PngHeader, parse_parameters
+
+SORT_ORDERS = {
+    "Newest": "mtime DESC, path DESC",
+    "Oldest": "mtime ASC, path ASC",
+    "Name": "path ASC",
+    "Size": "size DESC, path DESC",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    connector TEXT NOT NULL,
+    sub_dir TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    width INTEGER,
+    height INTEGER,
+    hash TEXT,
+    parameters TEXT,
+    prompt TEXT,
+    seed TEXT,
+    model TEXT,
+    PRIMARY KEY (connector, path)
+);
+CREATE INDEX IF NOT EXISTS images_by_mtime ON images (connector, sub_dir, mtime);
+CREATE INDEX IF NOT EXISTS images_by_seed ON images (connector, sub_dir, seed);
+CREATE INDEX IF NOT EXISTS images_by_model ON images (connector, sub_dir, model);
+CREATE TABLE IF NOT EXISTS directories (
+    connector TEXT NOT NULL,
+    sub_dir TEXT NOT NULL,
+    crawled_at REAL,
+    PRIMARY KEY (connector, sub_dir)
+);
+"""
+
+
+def _like_pattern(text: str) -> str:
+    """Return a LIKE pattern matching `text` anywhere, its `%` and `_` match only themselves."""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def parse_query(query: str) -> Tuple[str, List[str]]:
+    """
+    Turn a search box query into a sql condition and its arguments.
+
+    `seed:123` and `model:name` filter on the generation info, other words must all appear in the prompt.
+    """
+    conditions: List[str] = []
+    args: List[str] = []
+    for token in query.split():
+        field, _, value = token.partition(":")
+        if field.lower() == "seed" and value:
+            conditions.append("seed = ?")
+            args.append(value)
+        elif field.lower() == "model" and value:
+            conditions.append("model LIKE ? ESCAPE '\\'")
+            args.append(_like_pattern(value))
+        else:
+            conditions.append("prompt LIKE ? ESCAPE '\\'")
+            args.append(_like_pattern(token))
+    return " AND ".join(conditions), args
+
+
+class MetadataIndex:
+
+    """
+    MetadataIndex: A local SQLite index of the images of remote directories.
+
+    It holds path, size, mtime, dimensions, content hash and the parsed `parameters` chunk of every image
+    a connector uploads or discovers, so the remote browser can page, sort and search without network calls.
+
+    Attributes
+    ----------
+    path : str
+        The path of the sqlite database.
+
+    Methods
+    -------
+    add(connector_id:str, sub_dir:str, path:str, size:int, width:int, height:int, parameters:str, content_hash:str) -> None:
+        Index an image that was just uploaded.
+    sync(connector_id:str, sub_dir:str, files:List[RemoteFile], fetch:Callable[[str],PngHeader]) -> int:
+        Bring a directory in line with its listing, only new or changed files are fetched.
+    is_indexed(connector_id:str, sub_dir:str) -> bool:
+        Return whether a directory was crawled at least once.
+    count(connector_id:str, sub_dir:str, query:str) -> int:
+        Count the images of a directory matching a search query.
+    page(connector_id:str, sub_dir:str, offset:int, limit:int, sort:str, query:str) -> List[RemoteFile]:
+        Return a page of images matching a search query.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Open the index database, it is created with its directory when missing.
+
+        Parameters
+        ----------
+        path : str
+            The SQLite database file.
+        """
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        connector_id: str,
+        sub_dir: str,
+        path: str,
+        size: int,
+        width: int,
+        height: int,
+        parameters: Optional[str],
+        content_hash: Optional[str] = None,
+    ) -> None:
+        """
+        Index an image that was just uploaded.
+
+        Its mtime is the upload time so it sorts first by "Newest", the next crawl replaces it with
+        the mtime reported by the server without fetching the header again.
+        """
+        prompt, seed, model = parse_parameters(parameters)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    connector_id,
+                    sub_dir,
+                    path,
+                    size,
+                    time.time(),
+                    width,
+                    height,
+                    content_hash,
+                    parameters,
+                    prompt,
+                    seed,
+                    model,
+                ),
+            )
+
+    def sync(
+        self,
+        connector_id: str,
+        sub_dir: str,
+        files: List[RemoteFile],
+        fetch: Callable[[str], PngHeader],
+    ) -> int:
+        """
+        Bring a directory in line with its listing and return the number of fetched headers.
+
+        Files that are new or whose size changed get their header fetched with `fetch`,
+        files uploaded by this process only get the mtime of the server and missing files are removed.
+        """
+        with self._lock:
+            known: Dict[str, Tuple[int, Optional[float], bool]] = {
+                path: (size, mtime, content_hash is not None)
+                for path, size, mtime, content_hash in self._db.execute(
+                    "SELECT path, size, mtime, hash FROM images WHERE connector = ? AND sub_dir = ?",
+                    (connector_id, sub_dir),
+                )
+            }
+        fetched = 0
+        for remote_file in files:
+            size, mtime, uploaded = known.pop(remote_file.name, (None, None, False))
+            if size == remote_file.size and mtime == remote_file.mtime:
+                continue
+            # only images uploaded by this process have a content hash, their header is already indexed.
+            if size == remote_file.size and (mtime is None or uploaded):
+                with self._lock, self._db:
+                    self._db.execute(
+                        "UPDATE images SET mtime = ? WHERE connector = ? AND path = ?",
+                        (remote_file.mtime, connector_id, remote_file.name),
+                    )
+                continue
+            try:
+                header = fetch(remote_file.name)
+            except Exception as e:
+                print(f"Failed to index {remote_file.name}: {e!r}")
+                continue
+            fetched += 1
+            parameters = header.text.get("parameters")
+            prompt, seed, model = parse_parameters(parameters)
+            with self._lock, self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, NULL, ?, ?, ?, ?)",
+                    (
+                        connector_id,
+                        sub_dir,
+                        remote_file.name,
+                        remote_file.size,
+                        remote_file.mtime,
+                        header.width,
+                        header.height,
+                        parameters,
+                        prompt,
+                        seed,
+                        model,
+                    ),
+                )
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM images WHERE connector = ? AND path = ?",
+                [(connector_id, path) for path in known],
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO directories VALUES (?, ?, ?)",
+                (connector_id, sub_dir, time.time()),
+            )
+        return fetched
+
+    def is_indexed(self, connector_id: str, sub_dir: str) -> bool:
+        """Return whether a directory was crawled at least once."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM directories WHERE connector = ? AND sub_dir = ?",
+                (connector_id, sub_dir),
+            ).fetchone()
+        return row is not None
+
+    def count(self, connector_id: str, sub_dir: str, query: str = "") -> int:
+        """Count the images of a directory matching a search query."""
+        condition, args = self._where(connector_id, sub_dir, query)
+        with self._lock:
+            return self._db.execute(
+                f"SELECT COUNT(*) FROM images WHERE {condition}", args
+            ).fetchone()[0]
+
+    def page(
+        self,
+        connector_id: str,
+        sub_dir: str,
+        offset: int,
+        limit: int,
+        sort: str = "Newest",
+        query: str = "",
+    ) -> List[RemoteFile]:
+        """Return a page of images of a directory matching a search query."""
+        condition, args = self._where(connector_id, sub_dir, query)
+        order = SORT_ORDERS.get(sort, SORT_ORDERS["Newest"])
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT path, size, COALESCE(mtime, 0) FROM images WHERE {condition} "
+                f"ORDER BY {order} LIMIT ? OFFSET ?",
+                [*args, limit, offset],
+            ).fetchall()
+        return [RemoteFile(*row) for row in rows]
+
+    def _where(
+        self, connector_id: str, sub_dir: str, query: str
+    ) -> Tuple[str, List]:
+        condition = "connector = ? AND sub_dir = ?"
+        args: List = [connector_id, sub_dir]
+        query_condition, query_args = parse_query(query)
+        if query_condition:
+            condition += f" AND {query_condition}"
+            args += query_args
+        return condition, args
+
+
+class IndexCrawler:
+
+    """
+    IndexCrawler: A background thread that fills the metadata index of remote directories.
+
+    Attributes
+    ----------
+    index : MetadataIndex
+        The index to fill.
+
+    Methods
+    -------
+    request(connector_id:str, sub_dir:str, list_files:Callable[[],List[RemoteFile]], connect:Callable[[],ContextManager[BaseConnector]]) -> None:
+        Schedule a crawl of a directory, requests for a directory that is already scheduled are ignored.
+    """
+
+    def __init__(self, index: MetadataIndex) -> None:
+        """
+        Initiate a crawler of an index, its thread is started by the first request.
+
+        Parameters
+        ----------
+        index : MetadataIndex
+            The index to fill.
+        """
+        self.index = index
+        self._requests: queue.Queue[tuple] = queue.Queue()
+        self._pending: set = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def request(
+        self,
+        connector_id: str,
+        sub_dir: str,
+        list_files: Callable[[], List[RemoteFile]],
+        connect: Callable[[], ContextManager[BaseConnector]],
+    ) -> None:
+        """Schedule a crawl of a directory, `list_files` returns its (possibly cached) listing."""
+        key: Hashable = (connector_id, sub_dir)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="sd-web-ui-connect-indexer", daemon=True
+                )
+                self._thread.start()
+        self._requests.put((key, list_files, connect))
+
+    def _run(self) -> None:
+        while True:
+            key, list_files, connect = self._requests.get()
+            with self._lock:
+                self._pending.discard(key)
+            connector_id, sub_dir = key
+            try:
+                files = list_files()
+
+                def fetch(path: str, connect: Callable = connect) -> PngHeader:
+                    with connect() as connector:
+                        return connector.fetch_metadata(path)
+
+                fetched = self.index.sync(connector_id, sub_dir, files, fetch)
+                if fetched:
+                    print(f"Indexed {fetched} images of {sub_dir}")
+            except Exception as e:
+                print(f"Failed to crawl {sub_dir}: {e!r}")
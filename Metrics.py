@@ -0,0 +1,227 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+# upper bounds in seconds of the latency histogram buckets, the last bucket is +Inf.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PREFIX = "sd_web_ui_connect_"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+
+    """
+    Histogram: Latency observations counted in fixed buckets.
+
+    Attributes
+    ----------
+    counts : List[int]
+        The number of observations per bucket of `LATENCY_BUCKETS`, plus one for +Inf.
+    total : float
+        The sum of all observations.
+    count : int
+        The number of observations.
+    max : float
+        The largest observation.
+    """
+
+    def __init__(self) -> None:
+        """Initiate a histogram without observations."""
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        """Count an observation in its bucket."""
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Return the upper bound of the bucket holding the `q` quantile, an estimate good enough for a stats panel."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+
+    """
+    Metrics: An in-process registry of counters, gauges and latency histograms.
+
+    Recording is a dict lookup and an addition under a lock, so it can be called on every upload.
+    Gauges are callbacks evaluated only when the metrics are read, E.g. the depth of the upload queue.
+
+    Methods
+    -------
+    inc(name:str, amount:float, **labels:str) -> None:
+        Add to a counter.
+    observe(name:str, seconds:float, **labels:str) -> None:
+        Record a latency.
+    timer(name:str, **labels:str) -> ContextManager[None]:
+        Record the latency of a block, also when it raises.
+    gauge(name:str, read:Callable[[],float]) -> None:
+        Register (or replace) a gauge.
+    snapshot() -> dict:
+        Return all metrics as a json serializable dict.
+    prometheus() -> str:
+        Return all metrics in the prometheus text format.
+    register(app:FastAPI, path:str) -> None:
+        Serve the metrics as json, or as prometheus text with `?format=prometheus`.
+    """
+
+    def __init__(self) -> None:
+        """Initiate an empty registry."""
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        """Add `amount` to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        """Record a latency in a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        """Record the latency of a block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def gauge(self, name: str, read: Callable[[], float]) -> None:
+        """Register a gauge, `read` is called whenever the metrics are read."""
+        with self._lock:
+            self._gauges[name] = read
+
+    def counter(self, name: str, **labels: str) -> float:
+        """Return the value of a counter, 0 when it was never incremented."""
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def snapshot(self) -> dict:
+        """
+        Return all metrics as a json serializable dict.
+
+        Histograms are summarized by count, sum, mean and bucket estimates of the median and 95th percentile.
+        """
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = [
+                (key, histogram.count, histogram.total, histogram.quantile(0.5), histogram.quantile(0.95))
+                for key, histogram in self._histograms.items()
+            ]
+            gauges = list(self._gauges.items())
+        return {
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in counters
+            ],
+            "histograms": [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": count,
+                    "sum": total,
+                    "mean": total / count if count else 0.0,
+                    "p50": p50,
+                    "p95": p95,
+                }
+                for (name, labels), count, total, p50, p95 in histograms
+            ],
+            "gauges": {name: self._read(read) for name, read in gauges},
+        }
+
+    def prometheus(self) -> str:
+        """Return all metrics in the prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, list(histogram.counts), histogram.total, histogram.count)
+                for key, histogram in self._histograms.items()
+            )
+            gauges = sorted(self._gauges.items())
+        lines: List[str] = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                typed.add(name)
+            lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+        for (name, labels), counts, total, count in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket in zip((*LATENCY_BUCKETS, "+Inf"), counts):
+                cumulative += bucket
+                lines.append(
+                    f"{PREFIX}{name}_bucket{_labels((*labels, ('le', str(bound))))} {cumulative}"
+                )
+            lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{PREFIX}{name}_count{_labels(labels)} {count}")
+        for name, read in gauges:
+            lines.append(f"# TYPE {PREFIX}{name} gauge")
+            lines.append(f"{PREFIX}{name} {self._read(read)}")
+        return "\n".join(lines) + "\n"
+
+    def register(self, app: FastAPI, path: str) -> None:
+        """Serve the metrics as json, or as prometheus text with `?format=prometheus` (or an `Accept: text/plain`)."""
+
+        def endpoint(request: Request, format: str = "") -> Response:
+            if format == "prometheus" or (
+                not format and "text/plain" in request.headers.get("accept", "")
+            ):
+                return Response(
+                    self.prometheus(), media_type="text/plain; version=0.0.4"
+                )
+            return JSONResponse(self.snapshot())
+
+        app.add_api_route(path, endpoint, methods=["GET"])
+
+    @staticmethod
+    def _read(read: Callable[[], float]) -> float:
+        try:
+            return float(read())
+        except Exception:
+            return 0.0
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+# shared by the uploads, the remote browser and the metrics route of this process.
+metrics = Metrics()
@@ -0,0 +1,139 @@
+import multiprocessing
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from PIL import Image as ImageModule
+from PIL import PngImagePlugin
+from PIL.Image import Image
+
+# modes whose raw buffer can be rebuilt with Image.frombuffer without extra state (e.g. a palette).
+SHARED_MEMORY_MODES = ("1", "L", "LA", "RGB", "RGBA", "I", "I;16", "F")
+
+
+def encode_png(image: Image, png_info: dict, compress_level: int = 6) -> bytes:
+    """
+    Encode an image to png bytes with the png_info as text chunks.
+
+    Parameters
+    ----------
+    image : Image
+        An instance of the PIL Image class.
+    png_info : dict[str, str]
+        A dictionary containing the png_info of the image file.
+    compress_level : int
+        zlib compression level from 0 (none) to 9 (smallest).
+    """
+    pnginfo_data = PngImagePlugin.PngInfo()
+    for k, v in (png_info or {}).items():
+        pnginfo_data.add_text(k, str(v))
+    with BytesIO() as output:
+        image.save(
+            output, format="png", compress_level=compress_level, pnginfo=pnginfo_data
+        )
+        return output.getvalue()
+
+
+def _encode_shared(
+    shm_name: str,
+    mode: str,
+    size: Tuple[int, int],
+    png_info: Dict[str, str],
+    compress_level: int,
+) -> bytes:
+    """Encode the raw pixels of a shared memory block, runs in the encoder processes."""
+    # the spawned processes share the resource tracker of the webui process which owns and unlinks the block.
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        image = ImageModule.frombuffer(mode, size, shm.buf, "raw", mode, 0, 1)
+        data = encode_png(image, png_info, compress_level)
+        del image
+        return data
+    finally:
+        shm.close()
+
+
+class PngEncoder:
+
+    """
+    PngEncoder: Encodes images to png, optionally on a pool of processes so zlib does not hold the webui GIL.
+
+    The raw pixels are handed to the worker processes through shared memory,
+    only the png_info and the encoded bytes are pickled.
+
+    Attributes
+    ----------
+    workers : int
+        The number of encoder processes, 0 encodes on the calling thread.
+    compress_level : int
+        zlib compression level from 0 (none) to 9 (smallest).
+
+    Methods
+    -------
+    encode(image:Image, png_info:dict) -> bytes:
+        Encode an image to png bytes with the png_info as text chunks.
+    shutdown() -> None:
+        Stop the encoder processes.
+    """
+
+    def __init__(self, workers: int = 0, compress_level: int = 6) -> None:
+        """
+        Initiate a PngEncoder object, the encoder processes are started by the first encode.
+
+        Parameters
+        ----------
+        workers : int
+            The number of encoder processes, 0 encodes on the calling thread.
+        compress_level : int
+            zlib compression level from 0 (none) to 9 (smallest), clamped to that range.
+        """
+        self.workers = max(0, workers)
+        self.compress_level = min(9, max(0, compress_level))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def encode(self, image: Image, png_info: dict) -> bytes:
+        """Encode an image to png bytes with the png_info as text chunks."""
+        if self.workers == 0 or image.mode not in SHARED_MEMORY_MODES:
+            return encode_png(image, png_info, self.compress_level)
+        raw = image.tobytes()
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(raw)))
+        try:
+            shm.buf[: len(raw)] = raw
+            del raw
+            info = {k: str(v) for k, v in (png_info or {}).items()}
+            future = self._get_executor().submit(
+                _encode_shared,
+                shm.name,
+                image.mode,
+                image.size,
+                info,
+                self.compress_level,
+            )
+            return future.result()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def shutdown(self) -> None:
+        """Stop the encoder processes."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawned processes import this module by name, they inherit sys.path at spawn time.
+                extension_path = str(Path(__file__).resolve().parent)
+                if extension_path not in sys.path:
+                    sys.path.append(extension_path)
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
@@ -0,0 +1,136 @@
+import re
+import struct
+import zlib
+from typing import Callable, Dict, Iterator, NamedTuple, Optional, Tuple
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+TEXT_CHUNKS = (b"tEXt", b"zTXt", b"iTXt")
+
+
+class PngHeader(NamedTuple):
+
+    """
+    PngHeader: The metadata of a png file, read from the chunks before the image data.
+
+    Attributes
+    ----------
+    width : int
+        The width of the image.
+    height : int
+        The height of the image.
+    text : Dict[str, str]
+        The text chunks, E.g. `parameters` holds the generation info of the webui.
+    data_offset : int
+        The offset of the first IDAT chunk, everything before it is metadata.
+    """
+
+    width: int
+    height: int
+    text: Dict[str, str]
+    data_offset: int
+
+
+def _decode_text_chunk(chunk_type: bytes, data: bytes) -> Tuple[str, str]:
+    key, _, rest = data.partition(b"\x00")
+    if chunk_type == b"tEXt":
+        return key.decode("latin-1"), rest.decode("latin-1")
+    if chunk_type == b"zTXt":
+        return key.decode("latin-1"), zlib.decompress(rest[1:]).decode("latin-1")
+    # iTXt: compression flag, compression method, language tag, translated keyword, text
+    compressed = rest[0:1] == b"\x01"
+    _, _, rest = rest[2:].partition(b"\x00")
+    _, _, text = rest.partition(b"\x00")
+    if compressed:
+        text = zlib.decompress(text)
+    return key.decode("latin-1"), text.decode("utf-8")
+
+
+def parse_parameters(parameters: Optional[str]) -> Tuple[str, str, str]:
+    """Split the webui `parameters` text into (prompt, seed, model)."""
+    if not parameters:
+        return "", "", ""
+    prompt = re.split(r"\nNegative prompt:|\nSteps: ", parameters, maxsplit=1)[0]
+    seed = re.search(r"\bSeed: (-?\d+)", parameters)
+    model = re.search(r"\bModel: ([^,\n]+)", parameters)
+    return (
+        prompt.strip(),
+        seed.group(1) if seed else "",
+        model.group(1).strip() if model else "",
+    )
+
+
+class _RangeBuffer:
+
+    """The bytes of a remote file read so far, extended with reads of at least `block_size` bytes."""
+
+    def __init__(self, read_range: Callable[[int, int], bytes], block_size: int) -> None:
+        self.read_range = read_range
+        self.block_size = block_size
+        self.buf = read_range(0, block_size)
+        self.start = 0
+
+    def read(self, offset: int, length: int) -> bytes:
+        """Return `length` bytes at `offset`, reading the missing ones."""
+        end = offset + length
+        if offset < self.start or end > self.start + len(self.buf):
+            if offset < self.start or offset > self.start + len(self.buf):
+                self.buf, self.start = b"", offset
+            while self.start + len(self.buf) < end:
+                more = self.read_range(
+                    self.start + len(self.buf),
+                    max(self.block_size, end - self.start - len(self.buf)),
+                )
+                if not more:
+                    raise ValueError("truncated png file")
+                self.buf += more
+        return self.buf[offset - self.start : end - self.start]
+
+
+def _chunks(buffer: _RangeBuffer) -> Iterator[Tuple[int, int, bytes]]:
+    """Yield the offset, data length and type of each chunk, up to the first IDAT or IEND chunk."""
+    pos = 8
+    while True:
+        length, chunk_type = struct.unpack(">I4s", buffer.read(pos, 8))
+        yield pos, length, chunk_type
+        if chunk_type in (b"IDAT", b"IEND"):
+            return
+        # skip the data and the crc of the chunk
+        pos += 8 + length + 4
+
+
+def read_png_header(
+    read_range: Callable[[int, int], bytes], block_size: int = 16 * 1024
+) -> PngHeader:
+    """
+    Read the metadata of a png file without fetching its image data.
+
+    Parameters
+    ----------
+    read_range : Callable[[int, int], bytes]
+        Returns up to `length` bytes of the file starting at `offset`, called as `read_range(offset, length)`.
+    block_size : int
+        The size of each read, most webui images need a single read.
+
+    Raises
+    ------
+    ValueError
+        When the file is not a png file or is truncated.
+    """
+    buffer = _RangeBuffer(read_range, block_size)
+    if buffer.buf[:8] != PNG_SIGNATURE:
+        raise ValueError("not a png file")
+
+    width = height = 0
+    text: Dict[str, str] = {}
+    for pos, length, chunk_type in _chunks(buffer):
+        if chunk_type in (b"IDAT", b"IEND"):
+            break
+        if chunk_type == b"IHDR":
+            width, height = struct.unpack(">II", buffer.read(pos + 8, 8))
+        elif chunk_type in TEXT_CHUNKS:
+            try:
+                key, value = _decode_text_chunk(chunk_type, buffer.read(pos + 8, length))
+                text[key] = value
+            except (zlib.error, UnicodeDecodeError):
+                pass
+    return PngHeader(width, height, text, pos)
@@ -1,10 +1,16 @@
+import posixpath
+import stat
 from io import BytesIO
+from typing import Dict, List, Tuple
 
+import numpy as np
 import paramiko
-from PIL import PngImagePlugin
 from PIL.Image import Image
 
-from BaseConnector import BaseConnector
+from BaseConnector import BaseConnector, RemoteFile
+from Manifest import MANIFEST_NAME
+from PngEncoder import encode_png
+from Thumbnail import decode_image
 
 
 class SFTPConnector(BaseConnector):
@@ -35,9 +41,33 @@ class SFTPConnector(BaseConnector):
         try to upload image to remote host.
         via SFTP protocol.
 
+    store_bytes(name:str, data:bytes) -> None:
+        try to upload an encoded png file to remote host.
+
     before_unload() -> None:
         close the connection to the remote host.
 
+    is_alive() -> bool:
+        check the ssh transport and the remote path.
+
+    traverse(sub_dir:str) -> List[str]:
+        list the files of a directory in the remote path.
+
+    list_files(sub_dir:str) -> List[RemoteFile]:
+        list the files of a directory with their size and modification time in one round trip.
+
+    download(name:str) -> Tuple[np.ndarray,Dict[str,str]]:
+        download and decode a remote image file.
+
+    retrieve(name:str) -> bytes:
+        fetch the raw bytes of a remote file with pipelined reads.
+
+    read_range(name:str, offset:int, length:int) -> bytes:
+        fetch a byte range of a remote file, used for header-only metadata reads.
+
+    locate(name:str) -> Tuple[str,str]:
+        return the sub directory and the remote path of a stored image.
+
     _dir_exist_or_create_dir() -> None:
         A private method that does not take in any parameters and does not return any value.
         This method is invoked when the SFTPConnector object is instantiated.
@@ -68,30 +98,43 @@ class SFTPConnector(BaseConnector):
         self.remote_path = remote_path
         self.ssh = paramiko.SSHClient()
         self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        print(host, username, password, remote_path, port)
         self.ssh.connect(self.host, self.port, self.username, self.password)
         self.sftp = self.ssh.open_sftp()
         self._dir_exist_or_create_dir()
 
     def store_file(self, name:str, image:Image, png_info:dict)->None:
         """Performs store the image file with the given name and png_info via sftp."""
-        with BytesIO() as output:
-            pnginfo_data = PngImagePlugin.PngInfo()
-            for k, v in png_info.items():
-                pnginfo_data.add_text(k, str(v))
-            image.save(output, format='png',quality=100,pnginfo=pnginfo_data)
-            image_bytes = output.getvalue()
-            name_splited = name.split('/')[-1]
-            sub_dir = name.split('/')[1]
-            print(f'Uploading {name_splited} to {self.remote_path}/{sub_dir}')
-
-            self.sftp.putfo(BytesIO(image_bytes), f'{sub_dir}/{name_splited}')
+        self.store_bytes(name, encode_png(image, png_info))
+
+    def store_bytes(self, name:str, data:bytes)->None:
+        """Performs store an encoded png file with the given name via sftp."""
+        name_splited = name.split('/')[-1]
+        sub_dir = name.split('/')[1]
+        self.sftp.putfo(BytesIO(data), f'{sub_dir}/{name_splited}')
+        if self.use_manifest:
+            try:
+                self.append_manifest(name, data)
+            except Exception as e:
+                print(f'Failed to update the manifest of {sub_dir}: {e!r}')
+
+    def locate(self, name:str)->Tuple[str, str]:
+        """Return the sub directory and the absolute remote path of an image stored as `name`."""
+        sub_dir = name.split('/')[1]
+        return sub_dir, posixpath.join(self.remote_path, sub_dir, name.split('/')[-1])
 
     def before_unload(self)->None:
         """Performs close the connection to the remote host."""
         self.sftp.close()
         self.ssh.close()
 
+    def is_alive(self)->bool:
+        """Check that the ssh transport is active and the remote path is still reachable."""
+        transport = self.ssh.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        self.sftp.stat('.')
+        return True
+
     def _dir_exist_or_create_dir(self)->None:
         try:
             self.sftp.chdir(self.remote_path)
@@ -104,3 +147,61 @@ class SFTPConnector(BaseConnector):
             self.sftp.mkdir(f'{self.remote_path}/extras-images')
             self.sftp.chdir(self.remote_path)
 
+    def traverse(self, sub_dir:str)->List[str]:
+        return [f.name for f in self.list_files(sub_dir)]
+
+    def list_files(self, sub_dir:str)->List[RemoteFile]:
+        """List the files of a directory, from its manifest when it is kept."""
+        files = self.read_manifest(sub_dir) if self.use_manifest else None
+        return self._list_dir(sub_dir) if files is None else files
+
+    def _list_dir(self, sub_dir:str)->List[RemoteFile]:
+        """List the files of a directory, listdir_attr returns sizes and mtimes with the names in one round trip."""
+        dir_path = posixpath.join(self.remote_path, sub_dir)
+        return [
+            RemoteFile(posixpath.join(dir_path, attr.filename), attr.st_size, attr.st_mtime)
+            for attr in self.sftp.listdir_attr(dir_path)
+            if not stat.S_ISDIR(attr.st_mode or 0) and attr.filename != MANIFEST_NAME
+        ]
+
+    def dir_mtime(self, sub_dir:str)->float:
+        """Return the modification time of a directory, it changes when files are added or removed."""
+        return self.sftp.stat(posixpath.join(self.remote_path, sub_dir)).st_mtime
+
+    def download(self, name:str)->Tuple[np.ndarray, Dict[str, str]]:
+        return decode_image(self.retrieve(name))
+
+    def retrieve(self, name:str)->bytes:
+        """
+        Fetch the raw bytes of a remote file.
+
+        prefetch() queues the read requests of the whole file up front so the transfer
+        does not wait one round trip per 32 KB block.
+        """
+        with self.sftp.open(name, 'rb') as f:
+            f.prefetch()
+            return f.read()
+
+    def read_range(self, name:str, offset:int, length:int)->bytes:
+        """Fetch a byte range of a remote file."""
+        with self.sftp.open(name, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def stat_file(self, name:str)->RemoteFile:
+        """Return the size and modification time of a remote file."""
+        attr = self.sftp.stat(name)
+        return RemoteFile(name, attr.st_size, attr.st_mtime)
+
+    def manifest_path(self, sub_dir:str)->str:
+        return posixpath.join(self.remote_path, sub_dir, MANIFEST_NAME)
+
+    def append_bytes(self, name:str, data:bytes)->None:
+        """
+        Append to a remote file in append mode.
+
+        The server opens the file with O_APPEND, so each write request (up to 32 KB) lands at the end
+        even with other hosts appending. A single manifest line is always one request.
+        """
+        with self.sftp.open(name, 'ab') as f:
+            f.write(data)
@@ -1,13 +1,26 @@
+import random
 import time
-from functools import lru_cache
+from contextlib import contextmanager
 from io import BytesIO
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Tuple
 
 import numpy as np
-from PIL import Image, PngImagePlugin
+from PIL import Image
+from smb.smb_structs import OperationFailure
 from smb.SMBConnection import SMBConnection
 
-from BaseConnector import BaseConnector
+from BaseConnector import BaseConnector, RemoteFile
+from Manifest import MANIFEST_NAME
+from PngEncoder import encode_png
+from Thumbnail import decode_image
+
+# how long a writer waits for the append lock of a file.
+LOCK_TIMEOUT = 30.0
+# a lock held this long (seen from the waiting host) was left behind by a crashed writer, an append
+# holds it for a single small write so it is well below the timeout.
+LOCK_EXPIRY = 10.0
+# a lock that can not be created while no other host holds it fails for another reason, E.g. permissions.
+LOCK_ATTEMPTS = 3
 
 
 class SMBConector(BaseConnector):
@@ -40,8 +53,24 @@ class SMBConector(BaseConnector):
     store_file(name:str, image:Image, png_info:dict) -> None:
         try to upload image to remote host.
         via Samba protocol.
+    store_bytes(name:str, data:bytes) -> None:
+        try to upload an encoded png file to remote host.
     before_unload() -> None:
         close the connection to the remote host.
+    list_files(sub_dir:str) -> List[RemoteFile]:
+        list the files of a directory with their size and modification time.
+    dir_mtime(sub_dir:str) -> float:
+        return the last write time of a directory.
+    retrieve(name:str) -> bytes:
+        fetch the raw bytes of a remote file.
+    read_range(name:str, offset:int, length:int) -> bytes:
+        fetch a byte range of a remote file, used for header-only metadata reads.
+    locate(name:str) -> Tuple[str,str]:
+        return the sub directory and the share path of a stored image.
+    is_alive() -> bool:
+        send an SMB echo to check the connection.
+    append_bytes(name:str, data:bytes) -> None:
+        append to a remote file under a lock shared by every host.
     _dir_exist_or_create_dir() -> None:
         A private method that does not take in any parameters and does not return any value.
 
@@ -108,25 +137,31 @@ class SMBConector(BaseConnector):
 
         via Samba protocol.
         """
-        with BytesIO() as output:
-            pnginfo_data = PngImagePlugin.PngInfo()
-            for k, v in png_info.items():
-                pnginfo_data.add_text(k, str(v))
-            image.save(output, format="png", quality=100, pnginfo=pnginfo_data)
-            image_bytes = output.getvalue()
-            name_splited = name.split("/")[-1]
-            sub_dir = name.split("/")[1]
-            print(f"Uploading {name_splited} to {self.save_dir}/{sub_dir}")
-            self.smb.storeFile(
-                self.service_name,
-                f"{self.save_dir}/{sub_dir}/{name_splited}",
-                BytesIO(image_bytes),
-            )
+        self.store_bytes(name, encode_png(image, png_info))
+
+    def store_bytes(self, name: str, data: bytes) -> None:
+        """Upload an encoded png file to remote host via Samba protocol."""
+        sub_dir, path = self.locate(name)
+        self.smb.storeFile(self.service_name, path, BytesIO(data))
+        if self.use_manifest:
+            try:
+                self.append_manifest(name, data)
+            except Exception as e:
+                print(f"Failed to update the manifest of {sub_dir}: {e!r}")
+
+    def locate(self, name: str) -> Tuple[str, str]:
+        """Return the sub directory and the share path of an image stored as `name`."""
+        sub_dir = name.split("/")[1]
+        return sub_dir, f"{self.save_dir}/{sub_dir}/{name.split('/')[-1]}"
 
     def before_unload(self) -> None:
         """Close the connection to the remote host."""
         self.smb.close()
 
+    def is_alive(self) -> bool:
+        """Send an SMB echo to check that the connection is still usable."""
+        return self.smb.echo(b"ping", timeout=5) == b"ping"
+
     def _dir_exist_or_create_dir(self) -> None:
         """Create a folder in remote host if it doesn't exist."""
         for i in self.smb.listPath(self.service_name, "/"):
@@ -145,25 +180,111 @@ class SMBConector(BaseConnector):
             self.service_name, f"{self.save_dir}/extras-images")
 
     def traverse(self, sub_dir: str) -> List[str]:
-        print(f"Listing {self.save_dir}/{sub_dir}")
-        file_names = []
-        for i in self.smb.listPath(self.service_name, f"{self.save_dir}/{sub_dir}"):
-            file_names.append(f"{self.save_dir}/{sub_dir}/{i.filename}")
-        print(f"Found {len(file_names)} files")
-        # print(file_names)
-        return file_names[2:]
+        return [f.name for f in self.list_files(sub_dir)]
 
-    lru_cache(maxsize=512)
+    def list_files(self, sub_dir: str) -> List[RemoteFile]:
+        """List the files of a directory with their size and modification time, from its manifest when it is kept."""
+        files = self.read_manifest(sub_dir) if self.use_manifest else None
+        return self._list_dir(sub_dir) if files is None else files
+
+    def _list_dir(self, sub_dir: str) -> List[RemoteFile]:
+        return [
+            RemoteFile(
+                f"{self.save_dir}/{sub_dir}/{i.filename}", i.file_size, i.last_write_time
+            )
+            for i in self.smb.listPath(self.service_name, f"{self.save_dir}/{sub_dir}")
+            if not i.isDirectory and i.filename != MANIFEST_NAME
+        ]
+
+    def dir_mtime(self, sub_dir: str) -> float:
+        """Return the last write time of a directory, it changes when files are added or removed."""
+        return self.smb.getAttributes(
+            self.service_name, f"{self.save_dir}/{sub_dir}"
+        ).last_write_time
 
     def download(self, name: str) -> Tuple[np.ndarray, Dict[str, str]]:
-        time.time()
-        images = None
-        info = None
+        return decode_image(self.retrieve(name))
+
+    def retrieve(self, name: str) -> bytes:
+        """Fetch the raw bytes of a remote file."""
         with BytesIO() as output:
             self.smb.retrieveFile(self.service_name, name, output)
-            output.seek(0)
-            temp = Image.open(output)
-            info = temp.info
-            images = np.array(temp)
-        # print(f'Downloaded {name} in {time.time()-time1}')
-        return images, info
+            return output.getvalue()
+
+    def read_range(self, name: str, offset: int, length: int) -> bytes:
+        """Fetch a byte range of a remote file."""
+        with BytesIO() as output:
+            self.smb.retrieveFileFromOffset(
+                self.service_name, name, output, offset, length
+            )
+            return output.getvalue()
+
+    def stat_file(self, name: str) -> RemoteFile:
+        """Return the size and last write time of a remote file."""
+        attributes = self.smb.getAttributes(self.service_name, name)
+        return RemoteFile(name, attributes.file_size, attributes.last_write_time)
+
+    def manifest_path(self, sub_dir: str) -> str:
+        return f"{self.save_dir}/{sub_dir}/{MANIFEST_NAME}"
+
+    def append_bytes(self, name: str, data: bytes) -> None:
+        """
+        Append to a remote file at its current end.
+
+        SMB has no append mode, two hosts that read the same end of file would overwrite each other,
+        and each would still read its own line back. Writers hold the `{name}.lock` lock from reading
+        the end of file until their write is done.
+        """
+        with self._lock(f"{name}.lock"):
+            try:
+                offset = self.smb.getAttributes(self.service_name, name).file_size
+            except OperationFailure:
+                offset = 0
+            self.smb.storeFileFromOffset(self.service_name, name, BytesIO(data), offset)
+
+    @contextmanager
+    def _lock(self, path: str) -> Iterator[None]:
+        """
+        Hold a lock shared by every host writing to the share.
+
+        The lock is a directory, creating one is atomic and fails when it exists. A lock that stays
+        the same for `LOCK_EXPIRY` seconds is removed, the server clock is never compared to ours.
+        Creating the lock is given up after `LOCK_ATTEMPTS` failures while no host holds it.
+        """
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        held: Tuple[float, float] = (-1.0, time.monotonic())
+        unheld = 0
+        while True:
+            try:
+                self.smb.createDirectory(self.service_name, path)
+                break
+            except OperationFailure as e:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"{path} is held by another host") from None
+                create_error = e
+                try:
+                    created = self.smb.getAttributes(self.service_name, path).create_time
+                except OperationFailure:
+                    # released meanwhile, unless creating it keeps failing without a holder.
+                    unheld += 1
+                    if unheld >= LOCK_ATTEMPTS:
+                        raise create_error from None
+                    continue
+            unheld = 0
+            if created != held[0]:
+                held = (created, time.monotonic())
+            elif time.monotonic() - held[1] > LOCK_EXPIRY:
+                print(f"Removing the stale lock {path}")
+                self._unlock(path)
+                continue
+            time.sleep(random.uniform(0.01, 0.1))
+        try:
+            yield
+        finally:
+            self._unlock(path)
+
+    def _unlock(self, path: str) -> None:
+        try:
+            self.smb.deleteDirectory(self.service_name, path)
+        except OperationFailure:
+            pass
@@ -0,0 +1,73 @@
+from io import BytesIO
+from typing import Dict, NamedTuple, Tuple
+
+import numpy as np
+from PIL import Image
+
+# modes supported by Image.reduce, others (e.g. palette images) are converted first.
+REDUCIBLE_MODES = ("L", "LA", "La", "RGB", "RGBA", "RGBa", "RGBX", "CMYK", "I", "F")
+
+
+class EncodedImage(NamedTuple):
+
+    """
+    EncodedImage: An encoded thumbnail, ready to be served over http.
+
+    Attributes
+    ----------
+    data : bytes
+        The encoded image file.
+    content_type : str
+        The mime type of `data`.
+    info : Dict[str, str]
+        The png_info of the original image file.
+    """
+
+    data: bytes
+    content_type: str
+    info: Dict[str, str]
+
+
+def decode_image(data: bytes) -> Tuple[np.ndarray, Dict[str, str]]:
+    """Decode a full resolution image file to an ndarray and its png_info."""
+    with Image.open(BytesIO(data)) as image:
+        info = image.info
+        return np.array(image), info
+
+
+def _shrink(image: Image.Image, size: int) -> Image.Image:
+    """
+    Shrink an opened image so its longest side is at most `size`.
+
+    JPEG files are downsampled by the decoder itself (`Image.draft`), other formats are
+    reduced by an integer factor first (`Image.reduce`) which is much cheaper than a full
+    resample of the original, the final resize only touches the reduced image.
+    """
+    image.draft("RGB", (size, size))
+    if image.mode not in REDUCIBLE_MODES:
+        image = image.convert("RGBA")
+    # the reduced image keeps its longest side >= size so the final resize only shrinks.
+    factor = max(image.size) // size
+    if factor > 1:
+        image = image.reduce(factor)
+    image.thumbnail((size, size))
+    return image
+
+
+def encode_image(image: Image.Image, info: Dict[str, str], quality: int = 85) -> EncodedImage:
+    """Encode a thumbnail, opaque images as JPEG and the ones with transparency as png."""
+    output = BytesIO()
+    if image.mode in ("RGB", "L"):
+        image.save(output, "JPEG", quality=quality)
+        return EncodedImage(output.getvalue(), "image/jpeg", info)
+    if image.mode not in ("RGBA", "LA"):
+        image = image.convert("RGBA")
+    image.save(output, "PNG", compress_level=1)
+    return EncodedImage(output.getvalue(), "image/png", info)
+
+
+def encode_thumbnail(data: bytes, size: int) -> EncodedImage:
+    """Decode an image file to a thumbnail whose longest side is at most `size` and encode it once for serving."""
+    with Image.open(BytesIO(data)) as image:
+        info = image.info
+        return encode_image(_shrink(image, size), info)
@@ -1,12 +1,39 @@
+import threading
 import time as time_lib
-from typing import Any, Dict, List, Tuple, Union
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import gradio as gr
 import numpy as np
+from fastapi import FastAPI
 from modules.shared import opts
 
+from BaseConnector import BaseConnector, RemoteFile
 from ConfigObject import ConfigObject
 from ConnectorManager import ConnectorManager
+from ImageCache import CacheValue, image_cache
+from ImageRoutes import ImageRoutes
+from ListingCache import listing_cache
+from MetadataIndex import SORT_ORDERS
+from Metrics import metrics
+from PngMetadata import PngHeader
+from Thumbnail import EncodedImage, decode_image
+
+# a gallery item, the url of a thumbnail or its pixels when the image routes are not available.
+Gallery = Union[str, np.ndarray]
+# a value fetched into the image cache, E.g. raw bytes or an encoded thumbnail.
+T = TypeVar("T", bound=CacheValue)
 
 
 class UI:
@@ -25,16 +52,25 @@ class UI:
         A list of the tabs that are used in the UI.
     num_images_per_page : int
         The number of images that are displayed per page.
+    stream_batch : int
+        The number of newly downloaded images that triggers a partial gallery update.
+    stream_interval : float
+        Seconds after which downloaded images are shown even when the batch is not full.
     image_ext_list : List[str]
         A list of the image extensions that are supported.
     config : ConfigObject
         The config object that is used to get the config data.
-    selected_type : str
-        The selected connector type.
-    selected_index : int
-        The selected connector index.
     img_lst : List[str]
         A list of the images that are displayed in the UI.
+    The selected connector is kept per session and per tab in a `gr.State` holding its pool key,
+    every operation borrows a connection from the manager pool, so sessions never share or leak one.
+    Once a directory is indexed, pages are sorted and searched in the manager `index` instead of the listing.
+    After a page is served the pages around it are prefetched in the background, a newer request
+    for the same directory cancels the prefetching of the previous one.
+    Thumbnails and full resolution images are kept in the process-wide `image_cache`,
+    keyed by connector, path, size and modification time of the remote file.
+    image_routes : ImageRoutes
+        The http routes the gallery images are served from, None until `register_routes` is called.
     """
 
     def __init__(self, manager: ConnectorManager) -> None:
@@ -52,6 +88,9 @@ class UI:
             "Extras",
         ]
         self.num_images_per_page = 60
+        # a partial page is shown every `stream_batch` images or `stream_interval` seconds.
+        self.stream_batch = 12
+        self.stream_interval = 0.25
         self.image_ext_list = [
             ".png",
             ".jpg",
@@ -61,64 +100,99 @@ class UI:
             ".webp",
         ]
         self.config = ConfigObject()
-        self.selected_type = "SMB"
-        self.selected_index = 0
-        self.connector = None
         self.img_lst = []
+        # guards replacing the worker pools below and submitting to them, a replaced pool is shut down.
+        self._executor_lock = threading.Lock()
+        self._download_executor: Optional[ThreadPoolExecutor] = None
+        self._download_workers = 0
+        self._prefetch_executor: Optional[ThreadPoolExecutor] = None
+        self._prefetch_workers = 0
+        self._prefetch_tokens: Dict[Hashable, int] = {}
+        self._prefetch_futures: Dict[Hashable, List[Future]] = {}
+        self._prefetch_lock = threading.Lock()
+        self._inflight: Dict[Hashable, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self.image_routes: Optional[ImageRoutes] = None
 
-    def on_load(self):
-        self.get_connetor("SMB", 1)
+    def stats_markdown(self) -> str:
+        """Render the upload, browsing and cache metrics of this process as a markdown table."""
+        snapshot = metrics.snapshot()
+        counters = {
+            (counter["name"], tuple(sorted(counter["labels"].items())))
+            for counter in snapshot["counters"]
+        }
+        histograms = {
+            (histogram["name"], tuple(sorted(histogram["labels"].items()))): histogram
+            for histogram in snapshot["histograms"]
+        }
+        connectors = set()
+        for _, items in (*counters, *histograms):
+            labels = dict(items)
+            if "connector" in labels and "type" in labels:
+                connectors.add((labels["type"], labels["connector"]))
+        lines = [
+            "| Connector | Uploads | Failed | Retries | MB | MB/s | Upload p50 | Upload p95 | Download p50 |",
+            "|---|---|---|---|---|---|---|---|---|",
+        ]
+        for type_, connector_id in sorted(connectors):
+            labels = (("connector", connector_id), ("type", type_))
+            ok = metrics.counter("uploads_total", result="ok", **dict(labels))
+            failed = metrics.counter("uploads_total", result="failed", **dict(labels))
+            retries = metrics.counter("upload_retries_total", **dict(labels))
+            sent = metrics.counter("upload_bytes_total", **dict(labels)) / 2**20
+            upload = histograms.get(("upload_seconds", labels))
+            seconds = upload["sum"] if upload else 0.0
+            downloads = [
+                histogram
+                for (name, items), histogram in histograms.items()
+                if name == "download_seconds" and set(labels) <= set(items)
+            ]
+            lines.append(
+                f"| {type_} {connector_id} | {ok:.0f} | {failed:.0f} | {retries:.0f} "
+                f"| {sent:.1f} | {sent / seconds if seconds else 0:.1f} "
+                f"| {_ms(upload, 'p50')} | {_ms(upload, 'p95')} "
+                f"| {_ms(max(downloads, key=lambda h: h['count'], default=None), 'p50')} |"
+            )
+        hits = metrics.counter("listing_cache_requests_total", result="hit")
+        misses = metrics.counter("listing_cache_requests_total", result="miss")
+        gauges = snapshot["gauges"]
+        page = histograms.get(("page_load_seconds", ()))
+        lines += [
+            "",
+            f"Upload queue: {gauges.get('upload_queue_depth', 0):.0f}, "
+            f"spooled: {gauges.get('spool_jobs', 0):.0f}, "
+            f"encode p50: {_ms(histograms.get(('encode_seconds', ())), 'p50')}",
+            "",
+            f"Page load p50: {_ms(page, 'p50')}, p95: {_ms(page, 'p95')}",
+            "",
+            f"Listing cache hit rate: {hits / (hits + misses) if hits + misses else 0:.0%}, "
+            f"image cache hit rate: {gauges.get('image_cache_hit_ratio', 0):.0%}, "
+            f"image cache: {gauges.get('image_cache_bytes', 0) / 2**20:.0f} MB",
+        ]
+        return "\n".join(lines)
 
-    def get_connetor(self, v: str, s: int, init: str = False) -> int:
+    def get_connetor(self, v: str, selected_index: str) -> Optional[Tuple]:
         """
-        Perform the connection to the remote host to selected connector.
+        Return the pool key of the selected connector, None when it is not configured.
 
         Parameters
         ----------
         v : str
             The connector type.
-        s : int
-            state for trigger gradio update.
+        selected_index : str
+            The index of the connector config (from the gradio radio).
         """
-        print("get_connetor")
-        if init:
-            self.connector = None
         if v == "SMB":
             config = self.config.get_smb_config()
-            selected_config = config[self.selected_index]
-            if config is None:
-                self.connector = None
-                return -s
-            self.connector = self.manager._ui_get_smb_connector(
-                selected_config[0],
-                selected_config[1],
-                selected_config[2],
-                selected_config[3],
-                selected_config[4],
-                selected_config[5],
-                selected_config[6],
-                selected_config[7],
-                selected_config[8],
-            )
         elif v == "SFTP":
             config = self.config.get_sftp_config()
-            if config is None:
-                self.connector = None
-                return -s
-            selected_config = config[self.selected_index]
-            self.connector = self.manager._ui_get_sftp_connector(
-                selected_config[0],
-                selected_config[1],
-                selected_config[2],
-                selected_config[3],
-                selected_config[4],
-            )
         else:
-            self.connector = None
+            return None
+        if config is None or not 0 <= int(selected_index) < len(config):
+            return None
+        return config[int(selected_index)].key()
 
-        return -s
-
-    def get_connector_no(self, connector_type: str) -> Union[Dict[str, Any], None]:
+    def get_connector_no(self, connector_type: str) -> Dict[str, Any]:
         """
         Update the gradio radio element with the size of config.
 
@@ -129,19 +203,33 @@ class UI:
         """
         if connector_type == "SMB":
             config = self.config.get_smb_config()
-            return gr.Radio.update(choices=[str(i) for i in range(len(config))])
-
-        if connector_type == "SFTP":
+        else:
             config = self.config.get_sftp_config()
-            if config is None:
-                self.connector = None
-                return gr.Radio.update(choices=[])
-            return gr.Radio.update(choices=[str(i) for i in range(len(config))])
+        if config is None:
+            return gr.Radio.update(choices=[], value=None)
+        return gr.Radio.update(choices=[str(i) for i in range(len(config))], value="0")
+
+    def change_connector_type(
+        self, connector_type: str, turn_page: int
+    ) -> Tuple[Dict[str, Any], Optional[Tuple], int]:
+        """Select the first connector of a type and reload the page."""
+        return (
+            self.get_connector_no(connector_type),
+            self.get_connetor(connector_type, "0"),
+            -turn_page,
+        )
 
-    def change_connector(self, connector_no: int, renew: int) -> int:
-        """Change the connector(Get from gradio radio)."""
-        self.selected_index = connector_no
-        return -renew
+    def load_connector(self, connector_type: str) -> Tuple[Dict[str, Any], Optional[Tuple]]:
+        """Select the first connector of a type when a session opens, with the settings of that moment."""
+        return self.get_connector_no(connector_type), self.get_connetor(connector_type, "0")
+
+    def change_connector(
+        self, connector_type: str, connector_no: Optional[str], turn_page: int
+    ) -> Tuple[Optional[Tuple], int]:
+        """Change the connector(Get from gradio radio) and reload the page."""
+        if connector_no is None:
+            return None, -turn_page
+        return self.get_connetor(connector_type, connector_no), -turn_page
 
     def on_ui_tabs(self) -> Tuple[gr.Blocks, str, str]:
         """
@@ -154,7 +242,7 @@ class UI:
                 for tab in self.tab_lst:
                     with gr.Tab(tab):
                         with gr.Blocks(analytics_enabled=False):
-                            self.create_tab(tab)
+                            self.create_tab(tab, images_browser)
             gr.Textbox(
                 ",".join(self.tab_lst),
                 elem_id="connect_browser_tabnames_list",
@@ -163,7 +251,7 @@ class UI:
 
         return ((images_browser, "Connect Image Browser", "connect_image_browser"),)
 
-    def create_tab(self, tab: str) -> None:
+    def create_tab(self, tab: str, demo: gr.Blocks) -> None:
         """
         Create specific tab elements of remote browser.
 
@@ -215,6 +303,27 @@ class UI:
                                 label="Connection Type",
                             )
                             refetch = gr.Button("Refetch")
+                        with gr.Row():
+                            search = gr.Textbox(
+                                value="",
+                                label="Search",
+                                placeholder="prompt words, seed:123, model:name",
+                            )
+                            sort = gr.Dropdown(
+                                value="Newest",
+                                choices=list(SORT_ORDERS),
+                                label="Sort",
+                                interactive=True,
+                            )
+                        with gr.Row():
+                            thumbnail_size = gr.Slider(
+                                minimum=64,
+                                maximum=1024,
+                                step=32,
+                                value=256,
+                                label="Thumbnail Size",
+                                interactive=True,
+                            )
 
                         with gr.Row():
                             with gr.Column():
@@ -228,6 +337,10 @@ class UI:
                                     label="File Name",
                                     interactive=False,
                                 )
+                                img_full = gr.Image(
+                                    label="Full Resolution",
+                                    interactive=False,
+                                )
                                 # img_file_time= gr.HTML()
 
                         # with gr.Row():
@@ -251,16 +364,105 @@ class UI:
                             dirname_box = gr.Textbox(
                                 value=dir_name, label="dirname_box"
                             )
-                            connector_selector_state = gr.Number(
-                                value=1, label="connector_selector_state"
-                            )  # use as dispatcher for pages change
-                            renew_connect = gr.Number(value=1, label="renew_connect")
+                            # the pool key of the connector selected in this session and tab.
+                            connector_state = gr.State(None)
                             max_page_index_num = gr.Number(
                                 value=1, label="max_page_index_box"
                             )
 
         with gr.Row():
             warning_box = gr.HTML()
+        with gr.Accordion("Stats", open=False):
+            stats = gr.Markdown()
+            refresh_stats = gr.Button("Refresh stats")
+        refresh_stats.click(self.stats_markdown, outputs=[stats])
+
+        # streaming handlers need the gradio queue, without it pages are shown once complete.
+        # the request gives the host the gallery urls are served from.
+        if self.config.get_stream_pages():
+
+            def load_page(
+                key: Optional[Tuple],
+                img_path: str,
+                page_index: str,
+                thumbnail_size: int,
+                search: str,
+                sort: str,
+                request: gr.Request,
+            ) -> Iterator[Tuple]:
+                yield from self.stream_image_page(
+                    key,
+                    img_path,
+                    page_index,
+                    thumbnail_size,
+                    search,
+                    sort,
+                    base_url=self.base_url(request),
+                    session=self.session_id(request),
+                )
+
+            def refetch_page(
+                key: Optional[Tuple],
+                img_path: str,
+                page_index: str,
+                thumbnail_size: int,
+                search: str,
+                sort: str,
+                request: gr.Request,
+            ) -> Iterator[Tuple]:
+                yield from self.refetch_image_page(
+                    key,
+                    img_path,
+                    page_index,
+                    thumbnail_size,
+                    search,
+                    sort,
+                    base_url=self.base_url(request),
+                    session=self.session_id(request),
+                )
+
+        else:
+
+            def load_page(
+                key: Optional[Tuple],
+                img_path: str,
+                page_index: str,
+                thumbnail_size: int,
+                search: str,
+                sort: str,
+                request: gr.Request,
+            ) -> Tuple:
+                return self.get_image_page(
+                    key,
+                    img_path,
+                    page_index,
+                    thumbnail_size,
+                    search,
+                    sort,
+                    base_url=self.base_url(request),
+                    session=self.session_id(request),
+                )
+
+            def refetch_page(
+                key: Optional[Tuple],
+                img_path: str,
+                page_index: str,
+                thumbnail_size: int,
+                search: str,
+                sort: str,
+                request: gr.Request,
+            ) -> Tuple:
+                return self.get_image_page(
+                    key,
+                    img_path,
+                    page_index,
+                    thumbnail_size,
+                    search,
+                    sort,
+                    refresh=True,
+                    base_url=self.base_url(request),
+                    session=self.session_id(request),
+                )
 
         # turn page
         first_page.click(
@@ -286,44 +488,44 @@ class UI:
         page_index.submit(
             lambda s: -s, inputs=[turn_page_switch], outputs=[turn_page_switch]
         )
+        search.submit(
+            lambda s: (1, -s),
+            inputs=[turn_page_switch],
+            outputs=[page_index, turn_page_switch],
+        )
+        sort.change(
+            lambda s: (1, -s),
+            inputs=[turn_page_switch],
+            outputs=[page_index, turn_page_switch],
+        )
 
         # Select Connector
-        connection_type.change(
-            lambda s, v: self.get_connetor(s, v),
-            inputs=[connection_type, connector_selector_state],
-            outputs=[connector_selector_state],
-        )
-        connector_selector_state.change(
-            lambda s: self.get_connector_no(s),
+        demo.load(
+            self.load_connector,
             inputs=[connection_type],
-            outputs=[connection_selector],
+            outputs=[connection_selector, connector_state],
         )
-        connection_selector.change(
-            lambda s, v: self.change_connector(s, v),
-            inputs=[connection_selector, renew_connect],
-            outputs=[renew_connect],
+        connection_type.change(
+            self.change_connector_type,
+            inputs=[connection_type, turn_page_switch],
+            outputs=[connection_selector, connector_state, turn_page_switch],
         )
-        renew_connect.change(
-            lambda s, v: self.get_connetor(s, v),
-            inputs=[connection_type, connector_selector_state],
-            outputs=[connector_selector_state],
+        connection_selector.change(
+            self.change_connector,
+            inputs=[connection_type, connection_selector, turn_page_switch],
+            outputs=[connector_state, turn_page_switch],
         )
 
-        connection_selector.change(
-            fn=self.get_image_page,
-            inputs=[dirname_box, page_index],
-            outputs=[
-                history_gallery,
+        refetch.click(
+            fn=refetch_page,
+            inputs=[
+                connector_state,
+                dirname_box,
                 page_index,
-                warning_box,
-                max_page_index_num,
-                images_info,
-                filenames,
+                thumbnail_size,
+                search,
+                sort,
             ],
-        )
-        refetch.click(
-            fn=self.get_image_page,
-            inputs=[dirname_box, page_index],
             outputs=[
                 history_gallery,
                 page_index,
@@ -333,11 +535,17 @@ class UI:
                 filenames,
             ],
         )
-        refetch.click(lambda: print("Refecth"))
 
         turn_page_switch.change(
-            fn=self.get_image_page,
-            inputs=[dirname_box, page_index],
+            fn=load_page,
+            inputs=[
+                connector_state,
+                dirname_box,
+                page_index,
+                thumbnail_size,
+                search,
+                sort,
+            ],
             outputs=[
                 history_gallery,
                 page_index,
@@ -355,74 +563,559 @@ class UI:
         )
         clicked_image_state.change(
             fn=self.set_image_info,
-            inputs=[image_index, images_info, filenames],
+            inputs=[connector_state, image_index, images_info, filenames],
             outputs=[img_file_info, img_file_name],
         )
+        clicked_image_state.change(
+            fn=self.set_full_image,
+            inputs=[connector_state, image_index, filenames],
+            outputs=[img_full],
+        )
 
     def set_image_info(
         self,
+        key: Optional[Tuple],
         image_index: str,
         imgs_info_arr: List[Dict[str, str]],
-        file_names_arr: List[str],
+        file_names_arr: List[RemoteFile],
     ) -> Tuple[str, str]:
-        """Set image info to to gradio elements."""
-        img: str = imgs_info_arr[int(image_index)]["parameters"]
-        file_name = file_names_arr[int(image_index)]
-        return img, file_name
+        """
+        Set image info to to gradio elements.
+
+        When the info is not known from the gallery download, only the png header of the file is fetched.
+        """
+        info = imgs_info_arr[int(image_index)]
+        remote_file = RemoteFile(*file_names_arr[int(image_index)])
+        if "parameters" not in info and key is not None:
+            info = self._fetch_metadata(key, remote_file).text
+        return info.get("parameters", ""), remote_file.name
+
+    def set_full_image(
+        self, key: Optional[Tuple], image_index: str, file_names_arr: List[RemoteFile]
+    ) -> Optional[np.ndarray]:
+        """Download the full resolution image of the clicked gallery image."""
+        if key is None:
+            return None
+        remote_file = RemoteFile(*file_names_arr[int(image_index)])
+        full_image, _ = self._download(key, remote_file)
+        return full_image
+
+    @staticmethod
+    def session_id(request: Optional[gr.Request]) -> str:
+        """Return the id of the gradio session of a request, empty when unknown."""
+        return getattr(request, "session_hash", None) or ""
+
+    @staticmethod
+    def base_url(request: Optional[gr.Request]) -> str:
+        """Return the scheme and host the web browser reached the webui at, empty when unknown."""
+        if request is None or request.headers is None:
+            return ""
+        host = request.headers.get("host")
+        if not host:
+            return ""
+        return f"{request.headers.get('x-forwarded-proto', 'http')}://{host}"
+
+    def register_routes(self, app: FastAPI, secret: bytes) -> None:
+        """Serve gallery images over http, pages hold urls instead of pixel arrays from then on."""
+        self.image_routes = ImageRoutes(
+            secret, self.manager.key_of, self._thumbnail, self._original
+        )
+        self.image_routes.register(app)
+
+    def refetch_image_page(
+        self,
+        key: Optional[Tuple],
+        img_path: str,
+        page_index_param: str,
+        thumbnail_size: int = 256,
+        search: str = "",
+        sort: str = "Newest",
+        base_url: str = "",
+        session: str = "",
+    ) -> Iterator[
+        Tuple[List[Gallery], str, str, int, List[Dict[str, str]], List[RemoteFile]]
+    ]:
+        """Update the current image page with a fresh directory listing, images are shown as they arrive."""
+        yield from self.stream_image_page(
+            key,
+            img_path,
+            page_index_param,
+            thumbnail_size,
+            search,
+            sort,
+            refresh=True,
+            base_url=base_url,
+            session=session,
+        )
 
     def get_image_page(
-        self, img_path: str, page_index_param: str
-    ) -> Tuple[List[np.ndarray], str, str, int, List[Dict[str, str]], List[str]]:
-        """Update the current image page."""
+        self,
+        key: Optional[Tuple],
+        img_path: str,
+        page_index_param: str,
+        thumbnail_size: int = 256,
+        search: str = "",
+        sort: str = "Newest",
+        refresh: bool = False,
+        base_url: str = "",
+        session: str = "",
+    ) -> Tuple[
+        List[Gallery], str, str, int, List[Dict[str, str]], List[RemoteFile]
+    ]:
+        """Update the current image page once all its images are downloaded, see `stream_image_page`."""
+        # without streaming only the complete page is yielded.
+        (page,) = self.stream_image_page(
+            key,
+            img_path,
+            page_index_param,
+            thumbnail_size,
+            search,
+            sort,
+            refresh,
+            stream=False,
+            base_url=base_url,
+            session=session,
+        )
+        return page
+
+    def stream_image_page(
+        self,
+        key: Optional[Tuple],
+        img_path: str,
+        page_index_param: str,
+        thumbnail_size: int = 256,
+        search: str = "",
+        sort: str = "Newest",
+        refresh: bool = False,
+        stream: bool = True,
+        base_url: str = "",
+        session: str = "",
+    ) -> Iterator[
+        Tuple[List[Gallery], str, str, int, List[Dict[str, str]], List[RemoteFile]]
+    ]:
+        """
+        Update the current image page, yielding partial pages while the images are downloaded.
+
+        Indexed directories are paged, sorted and searched with index queries, others are paged
+        from the listing cache while the directory gets indexed in the background.
+        A partial page is the downloaded prefix of the page (every `stream_batch` images or
+        `stream_interval` seconds), so gallery indexes stay stable and always match the
+        `images_info` and `filenames` states yielded with them.
+        Once the image routes are registered and `base_url` is known the gallery gets thumbnail
+        urls, the web browser caches them and the server never re-encodes a thumbnail.
+        """
         time = time_lib.time()
         load_info = "<div style='color:#999' align='center'>"
         load_info += "No connection found"
         load_info += "</div>"
-        if self.connector is None:
+        if key is None:
             print("No connector found")
-            return [], "1", load_info, 1, [], []
+            yield [], "1", load_info, 1, [], []
+            return
         # off set
-        filenames = self.connector.traverse(img_path)[::-1]
-        page_index: int = int(page_index_param)  # Force Castiong
-        length = len(filenames)
-        max_page_index = length // self.num_images_per_page + 1
+        key = tuple(key)
+        connector_id = self.manager.connector_id(key)
+        token_key = (connector_id, img_path, session)
+        prefetch_token = self.cancel_prefetch(token_key)
+        try:
+            length, indexed, page_files = self._page_source(
+                key, connector_id, img_path, search, sort, refresh
+            )
+            max_page_index = length // self.num_images_per_page + 1
+
+            """
+            boudary check for index
+            """
+            page_index = int(page_index_param)  # Force Castiong
+            page_index = max_page_index if page_index == -1 else page_index
+            page_index = max(1, min(page_index, max_page_index))
+
+            def page_update(
+                paths: List[RemoteFile],
+                images: List[Optional[EncodedImage]],
+                status: str,
+            ) -> Tuple[
+                List[Gallery], str, str, int, List[Dict[str, str]], List[RemoteFile]
+            ]:
+                loaded = [(path, img) for path, img in zip(paths, images) if img is not None]
+                load_info = "<div style='color:#999' align='center'>"
+                load_info += f"{length} images in this directory, divided into {int((length + 1) // self.num_images_per_page  + 1)} pages"
+                if search and not indexed:
+                    load_info += ", search is available once the directory is indexed"
+                load_info += status
+                load_info += "</div>"
+                if self.image_routes is not None and base_url:
+                    gallery = [
+                        self.image_routes.thumbnail_url(
+                            base_url, connector_id, path, int(thumbnail_size)
+                        )
+                        for path, _ in loaded
+                    ]
+                else:
+                    gallery = [decode_image(img.data)[0] for _, img in loaded]
+                return (
+                    gallery,
+                    str(page_index),
+                    load_info,
+                    max_page_index,
+                    [img.info for _, img in loaded],
+                    [path for path, _ in loaded],
+                )
+
+            # actual images to show
+            image_list_path = page_files(page_index)
+            futures = self._submit_page(key, image_list_path, int(thumbnail_size))
+            _, timeout = self.config.get_browser_config()
+            for prefix, images in self._wait_for_page(
+                image_list_path, futures, time + timeout, stream
+            ):
+                yield page_update(
+                    image_list_path[:prefix],
+                    images,
+                    f", loading {prefix}/{len(futures)} images",
+                )
+            for future in futures:
+                future.cancel()
+            image_list = self._collect(image_list_path, futures, report=True)
+
+            depth, _, _ = self.config.get_prefetch_config()
+            neighbours = [
+                page
+                for distance in range(1, depth + 1)
+                for page in (page_index + distance, page_index - distance)
+                if 1 <= page <= max_page_index
+            ]
+            self.prefetch_pages(
+                key,
+                token_key,
+                prefetch_token,
+                [page_files(page) for page in neighbours],
+                int(thumbnail_size),
+            )
+            missing = image_list.count(None)
+            status = f", {missing} images could not be loaded in time" if missing else ""
+            metrics.observe("page_load_seconds", time_lib.time() - time)
+            yield page_update(image_list_path, image_list, status)
+        finally:
+            # a failed or abandoned page load never prefetches, its token is dropped right away.
+            self._finish_prefetch(token_key, prefetch_token)
+
+    def _page_source(
+        self,
+        key: Tuple,
+        connector_id: str,
+        img_path: str,
+        search: str,
+        sort: str,
+        refresh: bool,
+    ) -> Tuple[int, bool, Callable[[int], List[RemoteFile]]]:
+        """
+        Return the number of images of a directory, whether they come from the index and a function returning the files of a page.
+
+        Directories that are not indexed are listed (through the listing cache) and get crawled in the background.
+        """
+        index = self.manager.index
+        # a refetch shows the fresh listing, the index catches up in the background.
+        indexed = (
+            not refresh
+            and index is not None
+            and index.is_indexed(connector_id, img_path)
+        )
+        filenames: List[RemoteFile] = []
+        if not indexed:
+            filenames = listing_cache.get(
+                connector_id,
+                img_path,
+                lambda: self.manager.connection(key),
+                refresh,
+            )
+        self.manager.request_crawl(key, img_path)
+        if indexed:
+            length = index.count(connector_id, img_path, search)
+        else:
+            filenames = self.sort_files(filenames, sort)
+            length = len(filenames)
+
+        def page_files(page: int) -> List[RemoteFile]:
+            start = (page - 1) * self.num_images_per_page
+            if indexed:
+                return index.page(
+                    connector_id, img_path, start, self.num_images_per_page, sort, search
+                )
+            return filenames[start : start + self.num_images_per_page]
 
+        return length, indexed, page_files
+
+    def _wait_for_page(
+        self,
+        paths: List[RemoteFile],
+        futures: List[Future],
+        deadline: float,
+        stream: bool,
+    ) -> Iterator[Tuple[int, List[Optional[EncodedImage]]]]:
         """
-        boudary check for index
+        Wait for the downloads of a page until they are done or the deadline passes.
+
+        When streaming, the downloaded prefix of the page is yielded with its length every
+        `stream_batch` images or `stream_interval` seconds.
         """
-        page_index = max_page_index if page_index == -1 else page_index
-        page_index = 1 if page_index < 1 else page_index
-        page_index = max_page_index if page_index > max_page_index else page_index
-        idx_frm = (page_index - 1) * self.num_images_per_page
+        emitted = 0
+        last_yield = time_lib.time()
+        while True:
+            prefix = next(
+                (i for i, future in enumerate(futures) if not future.done()),
+                len(futures),
+            )
+            now = time_lib.time()
+            if prefix == len(futures) or now >= deadline:
+                return
+            if stream and prefix > emitted and (
+                prefix - emitted >= self.stream_batch
+                or now - last_yield >= self.stream_interval
+            ):
+                yield prefix, self._collect(paths[:prefix], futures[:prefix])
+                emitted, last_yield = prefix, time_lib.time()
+            wait(
+                futures[prefix:],
+                timeout=min(self.stream_interval, deadline - now),
+                return_when=FIRST_COMPLETED,
+            )
+
+    @staticmethod
+    def sort_files(files: List[RemoteFile], sort: str) -> List[RemoteFile]:
+        """Sort a directory listing like the index does, for directories that are not indexed yet."""
+        if sort == "Oldest":
+            return sorted(files, key=lambda f: (f.mtime, f.name))
+        if sort == "Name":
+            return sorted(files, key=lambda f: f.name)
+        if sort == "Size":
+            return sorted(files, key=lambda f: (f.size, f.name), reverse=True)
+        return sorted(files, key=lambda f: (f.mtime, f.name), reverse=True)
+
+    def _submit_page(
+        self, key: Tuple, paths: List[RemoteFile], thumbnail_size: int = 256
+    ) -> List[Future]:
+        """Queue the thumbnail downloads of a page on the download workers."""
+        workers, _ = self.config.get_browser_config()
+        with self._executor_lock:
+            if self._download_executor is None or self._download_workers != workers:
+                if self._download_executor is not None:
+                    self._download_executor.shutdown(wait=False)
+                self._download_executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix="sd-web-ui-connect-download"
+                )
+                self._download_workers = workers
+            return [
+                self._download_executor.submit(self._thumbnail, key, path, thumbnail_size)
+                for path in paths
+            ]
+
+    def _collect(
+        self, paths: List[RemoteFile], futures: List[Future], report: bool = False
+    ) -> List[Optional[EncodedImage]]:
+        """Return the results of page downloads in order, None for the ones that failed or are not done."""
+        results = []
+        for path, future in zip(paths, futures):
+            if not future.done() or future.cancelled():
+                results.append(None)
+            elif future.exception() is not None:
+                if report:
+                    print(f"Failed to download {path.name}: {future.exception()!r}")
+                results.append(None)
+            else:
+                results.append(future.result())
+        return results
 
-        print("page_index: ", page_index)
-        print("length: ", length)
-        print("max_page_index: ", max_page_index)
+    def cancel_prefetch(self, token_key: Hashable) -> int:
+        """Cancel the queued prefetching of a directory and return the token of the new request."""
+        with self._prefetch_lock:
+            token = self._prefetch_tokens.get(token_key, 0) + 1
+            self._prefetch_tokens[token_key] = token
+            futures = self._prefetch_futures.pop(token_key, [])
+        for future in futures:
+            future.cancel()
+        return token
 
-        # actual images to show
-        image_list_path = filenames[idx_frm : idx_frm + self.num_images_per_page]
+    def _finish_prefetch(self, token_key: Hashable, token: int) -> None:
+        """Forget the token of a directory once its latest prefetching is done, so closed sessions leave nothing behind."""
+        with self._prefetch_lock:
+            if self._prefetch_tokens.get(token_key) != token:
+                return
+            if any(not future.done() for future in self._prefetch_futures.get(token_key, [])):
+                return
+            del self._prefetch_tokens[token_key]
+            self._prefetch_futures.pop(token_key, None)
+
+    def prefetch_pages(
+        self,
+        key: Tuple,
+        token_key: Hashable,
+        token: int,
+        pages: List[List[RemoteFile]],
+        thumbnail_size: int = 256,
+    ) -> None:
+        """
+        Download the thumbnails (and with them the png info) of `pages` into the image cache in the background.
+
+        Prefetching runs on its own workers and leaves the reserved connections of each remote drive to
+        page loads and uploads. Work still queued when the token of the directory changes is skipped.
+        """
+        _, workers, reserve = self.config.get_prefetch_config()
+        if workers == 0 or not pages:
+            return
+        with self._executor_lock:
+            if self._prefetch_executor is None or self._prefetch_workers != workers:
+                if self._prefetch_executor is not None:
+                    self._prefetch_executor.shutdown(wait=False)
+                self._prefetch_executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix="sd-web-ui-connect-prefetch"
+                )
+                self._prefetch_workers = workers
+            futures = [
+                self._prefetch_executor.submit(
+                    self._prefetch, key, token_key, token, remote_file, thumbnail_size, reserve
+                )
+                for files in pages
+                for remote_file in files
+            ]
+        with self._prefetch_lock:
+            if self._prefetch_tokens.get(token_key) == token:
+                self._prefetch_futures[token_key] = futures
+        for future in futures:
+            future.add_done_callback(lambda _: self._finish_prefetch(token_key, token))
+
+    def _prefetch(
+        self,
+        key: Tuple,
+        token_key: Hashable,
+        token: int,
+        remote_file: RemoteFile,
+        thumbnail_size: int,
+        reserve: int,
+    ) -> None:
+        if self._prefetch_tokens.get(token_key) != token:
+            return
+        try:
+            self._thumbnail(key, remote_file, thumbnail_size, reserve)
+        except Exception as e:
+            print(f"Failed to prefetch {remote_file.name}: {e!r}")
 
-        image_list = [self.connector.download(img) for img in image_list_path]
-        img_data = [img[0] for img in image_list]
+    def _download(
+        self, key: Tuple, remote_file: RemoteFile
+    ) -> Tuple[np.ndarray, Dict[str, str]]:
+        """Return the decoded full resolution image, the raw file comes through the image cache."""
+        return decode_image(self._original(key, remote_file))
 
-        img_info = [img[1] for img in image_list]
+    def _original(self, key: Tuple, remote_file: RemoteFile) -> bytes:
+        """Return the raw remote file through the image cache."""
+        cache_key = (
+            self.manager.connector_id(key),
+            remote_file.name,
+            remote_file.size,
+            remote_file.mtime,
+            "original",
+        )
+        data = image_cache.get(cache_key)
+        if data is None:
+            data = self._fetch_once(
+                key,
+                cache_key,
+                lambda connector: connector.retrieve(remote_file.name),
+                operation="image",
+            )
+        return data
 
-        visible_num = (
-            self.num_images_per_page
-            if idx_frm + self.num_images_per_page < length
-            else length % self.num_images_per_page
+    def _thumbnail(
+        self,
+        key: Tuple,
+        remote_file: RemoteFile,
+        thumbnail_size: int,
+        reserve: int = 0,
+    ) -> EncodedImage:
+        """Return an encoded thumbnail through the image cache, it is encoded once and served as is."""
+        cache_key = (
+            self.manager.connector_id(key),
+            remote_file.name,
+            remote_file.size,
+            remote_file.mtime,
+            thumbnail_size,
         )
-        visible_num = self.num_images_per_page if visible_num == 0 else visible_num
+        thumbnail = image_cache.get(cache_key)
+        if thumbnail is None:
+            thumbnail = self._fetch_once(
+                key,
+                cache_key,
+                lambda connector: connector.fetch_thumbnail(
+                    remote_file.name, thumbnail_size
+                ),
+                reserve,
+                "thumbnail",
+            )
+        return thumbnail
 
-        load_info = "<div style='color:#999' align='center'>"
-        load_info += f"{length} images in this directory, divided into {int((length + 1) // self.num_images_per_page  + 1)} pages"
-        load_info += "</div>"
-        print("time: ", time_lib.time() - time)
-        return (
-            img_data,
-            str(page_index),
-            load_info,
-            max_page_index,
-            img_info,
-            image_list_path,
+    def _fetch_once(
+        self,
+        key: Tuple,
+        cache_key: Hashable,
+        fetch: Callable[[BaseConnector], T],
+        reserve: int = 0,
+        operation: str = "thumbnail",
+    ) -> T:
+        """
+        Fetch a value missing from the image cache, concurrent requests for it share one download.
+
+        A download is only shared once it holds a connection, so a page load never waits
+        behind a prefetch that is still queued for the pool. Its latency is recorded per `operation`.
+        """
+        pending = self._inflight.get(cache_key)
+        if pending is None:
+            with self.manager.connection(key, reserve) as connector:
+                with self._inflight_lock:
+                    pending = self._inflight.get(cache_key)
+                    if pending is None:
+                        future: Future = Future()
+                        self._inflight[cache_key] = future
+                if pending is None:
+                    try:
+                        with metrics.timer(
+                            "download_seconds",
+                            operation=operation,
+                            **self.manager.metric_labels(key),
+                        ):
+                            value = fetch(connector)
+                        image_cache.put(cache_key, value)
+                        future.set_result(value)
+                        return value
+                    except BaseException as e:
+                        future.set_exception(e)
+                        raise
+                    finally:
+                        with self._inflight_lock:
+                            del self._inflight[cache_key]
+        return pending.result()
+
+    def _fetch_metadata(self, key: Tuple, remote_file: RemoteFile) -> PngHeader:
+        """Return the header-only metadata of a remote file through the image cache."""
+        cache_key = (
+            self.manager.connector_id(key),
+            remote_file.name,
+            remote_file.size,
+            remote_file.mtime,
+            "metadata",
         )
+        header = image_cache.get(cache_key)
+        if header is None:
+            header = self._fetch_once(
+                key,
+                cache_key,
+                lambda connector: connector.fetch_metadata(remote_file.name),
+                operation="metadata",
+            )
+        return header
+
+
+def _ms(histogram: Optional[dict], quantile: str) -> str:
+    """Format a latency quantile of a metrics snapshot histogram in milliseconds."""
+    if not histogram or not histogram["count"]:
+        return "-"
+    return f"{histogram[quantile] * 1000:.0f} ms"
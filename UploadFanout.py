@@ -0,0 +1,158 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable, Dict, Hashable, Iterator, List, Optional, Set
+
+
+class UploadFanout:
+
+    """
+    UploadFanout: Uploads an image to every destination at the same time.
+
+    Each destination runs on its own thread, so the latency of an upload is the one of the slowest
+    destination instead of their sum, and a destination that fails or hangs does not hold back the others.
+
+    Attributes
+    ----------
+    timeout : float
+        Seconds an upload to a single destination may take before it counts as failed, 0 waits forever.
+    per_destination : int
+        The maximum number of uploads running at the same time for a single destination.
+
+    Methods
+    -------
+    run(keys:List[Hashable], upload:Callable[[Hashable],None], late_failure:Callable[[Hashable],None]) -> List[Hashable]:
+        Upload to every destination and return the ones that failed.
+    slot(key:Hashable, timeout:float) -> ContextManager[None]:
+        Take one of the upload slots of a destination.
+    shutdown(timeout:float) -> None:
+        Stop the worker threads.
+    """
+
+    def __init__(
+        self, timeout: float = 120.0, per_destination: int = 2, workers: int = 32
+    ) -> None:
+        """
+        Initiate a fan-out, its worker threads are started when uploads overlap.
+
+        Parameters
+        ----------
+        timeout : float
+            Seconds an upload to a single destination may take before it counts as timed out, 0 waits forever.
+        per_destination : int
+            The maximum number of uploads running at the same time for a single destination.
+        workers : int
+            The maximum number of worker threads of all destinations.
+        """
+        self.timeout = timeout
+        self.per_destination = per_destination
+        # threads are only started when uploads overlap, the limit is per destination.
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="sd-web-ui-connect-fanout")
+        self._cond = threading.Condition()
+        self._active: Dict[Hashable, int] = {}
+        self._futures: Set[Future] = set()
+
+    def run(
+        self,
+        keys: List[Hashable],
+        upload: Callable[[Hashable], None],
+        late_failure: Optional[Callable[[Hashable], None]] = None,
+    ) -> List[Hashable]:
+        """
+        Upload to every destination with `upload` and return the keys that failed within the timeout.
+
+        An upload that timed out is not returned, it keeps running in the background and reports
+        its own outcome: when it fails (or is cancelled by `shutdown` before it started)
+        `late_failure` is invoked with its key, so a retry never runs next to the upload it repeats.
+        A destination that hangs holds at most `per_destination` workers, later uploads to it give
+        up waiting for a slot at their deadline. Each failure is printed.
+        """
+        deadline = time.monotonic() + self.timeout if self.timeout > 0 else None
+        futures: Dict[Future, Hashable] = {
+            self._executor.submit(self._upload, key, upload, deadline): key for key in keys
+        }
+        with self._cond:
+            self._futures.update(futures)
+        for future in futures:
+            future.add_done_callback(self._forget)
+        done, pending = wait(
+            futures, None if deadline is None else max(0.0, deadline - time.monotonic())
+        )
+        failed = []
+        for future in done:
+            error = future.exception()
+            if error is not None:
+                print(f"Upload to {futures[future][0]} failed: {error!r}")
+                failed.append(futures[future])
+        for future in pending:
+            key = futures[future]
+            print(f"Upload to {key[0]} timed out after {self.timeout}s, it keeps running in the background")
+            future.add_done_callback(lambda f, key=key: self._finish_late(f, key, late_failure))
+        return failed
+
+    @contextmanager
+    def slot(self, key: Hashable, timeout: Optional[float] = None) -> Iterator[None]:
+        """Take one of the `per_destination` upload slots of a destination, raise TimeoutError when none frees up in time."""
+        with self._cond:
+            if not self._cond.wait_for(
+                lambda: self._active.get(key, 0) < max(1, self.per_destination), timeout
+            ):
+                raise TimeoutError(f"no upload slot of {key[0]} was free")
+            self._active[key] = self._active.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[key] -= 1
+                if self._active[key] == 0:
+                    del self._active[key]
+                self._cond.notify_all()
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop the worker threads, running uploads are finished first.
+
+        With a `timeout` the uploads are waited for at most that long, the ones that did not start
+        yet are cancelled and the running ones finish in the background.
+        """
+        if timeout is None:
+            self._executor.shutdown(wait=True)
+            return
+        with self._cond:
+            futures = list(self._futures)
+        _, pending = wait(futures, timeout)
+        self._executor.shutdown(wait=False)
+        for future in pending:
+            future.cancel()
+        if pending:
+            print(f"{len(pending)} uploads did not finish in {timeout}s")
+
+    @staticmethod
+    def _finish_late(
+        future: Future, key: Hashable, late_failure: Optional[Callable[[Hashable], None]]
+    ) -> None:
+        """Report the outcome of an upload that finished after its timeout."""
+        if not future.cancelled() and future.exception() is None:
+            print(f"Upload to {key[0]} finished after its timeout")
+            return
+        error = "cancelled" if future.cancelled() else repr(future.exception())
+        print(f"Upload to {key[0]} failed after its timeout: {error}")
+        if late_failure is None:
+            return
+        try:
+            late_failure(key)
+        except Exception as e:
+            print(f"Failed to handle the failed upload to {key[0]}: {e!r}")
+
+    def _forget(self, future: Future) -> None:
+        with self._cond:
+            self._futures.discard(future)
+
+    def _upload(
+        self, key: Hashable, upload: Callable[[Hashable], None], deadline: Optional[float]
+    ) -> None:
+        # a thread waiting for a slot gives up at the deadline instead of piling up behind a hung destination.
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        with self.slot(key, timeout):
+            upload(key)
@@ -0,0 +1,216 @@
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Type
+
+from PIL.Image import Image
+
+BACKPRESSURE_POLICIES = ("block", "drop-oldest", "spill")
+
+
+class UploadJob(NamedTuple):
+
+    """
+    UploadJob: An immutable snapshot of an image waiting to be uploaded.
+
+    Attributes
+    ----------
+    name : str
+        raw path of the original image file.
+    image : Image
+        A private copy of the PIL image, the webui is free to mutate the original.
+    png_info : Dict[str, str]
+        A private copy of the png_info of the image file.
+    keys : Tuple[Tuple, ...]
+        The config tuples of the connectors configured when the job was queued, it is uploaded to those.
+    """
+
+    name: str
+    image: Image
+    png_info: Dict[str, str]
+    keys: Tuple[Tuple, ...] = ()
+
+    @classmethod
+    def snapshot(
+        cls: Type["UploadJob"],
+        name: str,
+        image: Image,
+        png_info: dict,
+        keys: Tuple[Tuple, ...] = (),
+    ) -> "UploadJob":
+        """Copy the image and png_info so the job does not share state with the webui."""
+        info = {} if png_info is None else {k: str(v) for k, v in png_info.items()}
+        return cls(name, image.copy(), info, keys)
+
+
+class UploadQueue:
+
+    """
+    UploadQueue: A bounded in-process queue of upload jobs served by background worker threads.
+
+    Attributes
+    ----------
+    handler : Callable[[UploadJob], None]
+        The function that performs the upload of a single job.
+    maxsize : int
+        The maximum number of jobs waiting in memory.
+    workers : int
+        The number of worker threads.
+    policy : str
+        What to do when the queue is full, one of `BACKPRESSURE_POLICIES`.
+        `block` waits for a free slot, `drop-oldest` discards the oldest waiting job
+        and `spill` hands the job to `spill` which persists it to disk (the upload spool).
+    spill : Callable[[UploadJob], None]
+        The function used by the `spill` policy.
+    discard : Callable[[UploadJob], None]
+        Called with jobs that are dropped without being uploaded.
+
+    Methods
+    -------
+    start() -> None:
+        Start the worker threads.
+    put(job:UploadJob) -> None:
+        Enqueue a job applying the backpressure policy.
+    shutdown(timeout:float) -> None:
+        Stop accepting jobs, drain the queue and stop the worker threads.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[UploadJob], None],
+        maxsize: int = 32,
+        workers: int = 1,
+        policy: str = "block",
+        spill: Optional[Callable[[UploadJob], None]] = None,
+        discard: Optional[Callable[[UploadJob], None]] = None,
+    ) -> None:
+        """
+        Initiate the queue, the worker threads are started by `start`.
+
+        Parameters
+        ----------
+        handler : Callable[[UploadJob], None]
+            The function that performs the upload of a single job.
+        maxsize : int
+            The maximum number of jobs waiting in memory.
+        workers : int
+            The number of worker threads.
+        policy : str
+            What to do when the queue is full, one of `BACKPRESSURE_POLICIES`.
+        spill : Optional[Callable[[UploadJob], None]]
+            The function used by the `spill` policy.
+        discard : Optional[Callable[[UploadJob], None]]
+            Called with jobs that are dropped without being uploaded.
+
+        Raises
+        ------
+        ValueError
+            When the policy is unknown or `spill` is missing for the `spill` policy.
+        """
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        if policy == "spill" and spill is None:
+            raise ValueError("spill policy needs a spill function")
+        self.handler = handler
+        self.maxsize = max(1, maxsize)
+        self.workers = max(1, workers)
+        self.policy = policy
+        self.spill = spill
+        self.discard = discard
+        self._queue: "queue.Queue[Optional[UploadJob]]" = queue.Queue(self.maxsize)
+        self._threads: List[threading.Thread] = []
+        self._closing = False
+
+    def start(self) -> None:
+        """Start the worker threads."""
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker, name=f"sd-web-ui-connect-upload-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def qsize(self) -> int:
+        """Return the number of jobs waiting in memory."""
+        return self._queue.qsize()
+
+    def put(self, job: UploadJob) -> None:
+        """Enqueue a job, applying the backpressure policy when the queue is full."""
+        if self._closing:
+            print(f"Upload queue is shutting down, {job.name} is not uploaded")
+            self._discard(job)
+            return
+        if self.policy == "block":
+            self._queue.put(job)
+            return
+        try:
+            self._queue.put_nowait(job)
+            return
+        except queue.Full:
+            pass
+        if self.policy == "spill":
+            print(f"Upload queue is full, spilling {job.name} to disk")
+            self.spill(job)
+            return
+        # drop-oldest
+        while True:
+            try:
+                dropped = self._queue.get_nowait()
+                self._queue.task_done()
+                if dropped is not None:
+                    print(f"Upload queue is full, dropping {dropped.name}")
+                    self._discard(dropped)
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(job)
+                return
+            except queue.Full:
+                continue
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop accepting jobs and wait for the queued jobs to be uploaded.
+
+        With a `timeout` it never waits longer, also when the queue is full and the workers are stuck.
+        The (daemon) workers then finish the remaining jobs in the background or are stopped with the process.
+        """
+        if self._closing:
+            return
+        self._closing = True
+        deadline = None if timeout is None else time.time() + timeout
+        for _ in self._threads:
+            # sentinels are queued after the pending jobs so those get drained first.
+            try:
+                self._queue.put(None, timeout=self._remaining(deadline))
+            except queue.Full:
+                print(f"Upload queue did not drain in {timeout}s, {self.qsize()} jobs are left")
+                break
+        for thread in self._threads:
+            thread.join(self._remaining(deadline))
+        self._threads = []
+
+    @staticmethod
+    def _remaining(deadline: Optional[float]) -> Optional[float]:
+        return None if deadline is None else max(0.0, deadline - time.time())
+
+    def _worker(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _discard(self, job: UploadJob) -> None:
+        if self.discard is not None:
+            self.discard(job)
+
+    def _run(self, job: UploadJob) -> None:
+        try:
+            self.handler(job)
+        except Exception as e:
+            # a failed upload must not kill the worker thread.
+            print(f"Failed to upload {job.name}: {e!r}")
@@ -0,0 +1,286 @@
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+SpoolHandler = Callable[[str, str, bytes], None]
+
+# files younger than this may belong to a concurrent add and are never treated as orphans.
+ORPHAN_GRACE_SECONDS = 60.0
+# seconds between two compactions of the scheduler thread.
+COMPACTION_INTERVAL = 600.0
+# the longest the scheduler sleeps before it checks for due jobs again.
+MAX_IDLE_WAIT = 60.0
+
+
+class SpoolJobDropped(Exception):
+
+    """Raised by a spool handler when a job can never succeed, the job is removed instead of retried."""
+
+
+class UploadSpool:
+
+    """
+    UploadSpool: A write-ahead spool directory of uploads that still have to reach a connector.
+
+    Each encoded image is written once to `images/` and each (image, connector) job gets its own
+    json file in `jobs/`, the job file is written last and marks the entry as complete.
+    A scheduler thread retries due jobs with exponential backoff and jitter, pending jobs
+    are picked up again when the webui restarts.
+
+    Attributes
+    ----------
+    directory : Path
+        The spool directory.
+    max_bytes : int
+        The maximum size of the spooled images, the oldest jobs are dropped above it.
+    max_age : float
+        Seconds after which a job that still fails is dropped.
+    max_entries : int
+        The maximum number of jobs kept in the spool.
+    base_delay : float
+        The first retry delay in seconds, doubled on each failed attempt.
+    max_delay : float
+        The upper bound of the retry delay in seconds.
+
+    Methods
+    -------
+    start(handler:Callable[[str,str,bytes],None]) -> None:
+        Load the pending jobs and start the retry scheduler, `handler(connector_id, name, data)` raises on failure,
+        `SpoolJobDropped` drops the job.
+    add(name:str, data:bytes, connector_ids:Iterable[str]) -> None:
+        Spool an encoded image for the given connectors.
+    compact() -> None:
+        Drop expired jobs, enforce the size limits and remove orphan files.
+    shutdown() -> None:
+        Stop the retry scheduler, pending jobs stay on disk.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        max_bytes: int = 1024 * 1024 * 1024,
+        max_age: float = 3 * 24 * 3600,
+        max_entries: int = 10000,
+        base_delay: float = 5.0,
+        max_delay: float = 600.0,
+    ) -> None:
+        """
+        Initiate a spool in a directory, the jobs on disk are loaded by `start`.
+
+        Parameters
+        ----------
+        directory : Union[str, Path]
+            The spool directory.
+        max_bytes : int
+            The maximum size of the spooled images, the oldest jobs are dropped above it.
+        max_age : float
+            Seconds after which a job that still fails is dropped.
+        max_entries : int
+            The maximum number of jobs kept in the spool.
+        base_delay : float
+            The first retry delay in seconds, doubled on each failed attempt.
+        max_delay : float
+            The upper bound of the retry delay in seconds.
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.images_dir = self.directory / "images"
+        self.jobs_dir = self.directory / "jobs"
+        self._jobs: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._handler: Optional[SpoolHandler] = None
+
+    def start(self, handler: SpoolHandler) -> None:
+        """Load the jobs left by a previous run and start the retry scheduler."""
+        if self._thread is not None:
+            return
+        self._handler = handler
+        self._makedirs()
+        with self._lock:
+            for path in self.jobs_dir.glob("*.json"):
+                try:
+                    self._jobs[path.name] = json.loads(path.read_text())
+                except (OSError, ValueError) as e:
+                    print(f"Discarding broken spool entry {path.name}: {e!r}")
+                    self._remove(path)
+        if self._jobs:
+            print(f"Resuming {len(self._jobs)} spooled uploads")
+        self.compact()
+        self._thread = threading.Thread(
+            target=self._run, name="sd-web-ui-connect-spool", daemon=True
+        )
+        self._thread.start()
+
+    def __len__(self) -> int:
+        """The number of pending jobs."""
+        return len(self._jobs)
+
+    def add(self, name: str, data: bytes, connector_ids: Iterable[str]) -> None:
+        """Spool an encoded image, one job per connector."""
+        connector_ids = list(connector_ids)
+        if not connector_ids:
+            return
+        self._makedirs()
+        image_id = f"{time.time_ns()}-{uuid.uuid4().hex}"
+        self._write(self.images_dir / f"{image_id}.png", data)
+        now = time.time()
+        for connector_id in connector_ids:
+            job = {
+                "name": name,
+                "image": image_id,
+                "size": len(data),
+                "connector": connector_id,
+                "attempts": 0,
+                "created": now,
+                "next_attempt": now + self._delay(0),
+            }
+            entry = f"{image_id}.{connector_id}.json"
+            self._write(self.jobs_dir / entry, json.dumps(job).encode())
+            with self._lock:
+                self._jobs[entry] = job
+        print(f"Spooled {name} for {len(connector_ids)} connector(s)")
+        self._wakeup.set()
+
+    def compact(self) -> None:
+        """Drop expired jobs and the oldest jobs above the size limits, then remove orphan files."""
+        now = time.time()
+        dropped: List[str] = []
+        with self._lock:
+            by_age = sorted(self._jobs.items(), key=lambda item: item[1]["created"])
+            total_bytes = sum(
+                job["size"] for job in {j["image"]: j for _, j in by_age}.values()
+            )
+            count = len(by_age)
+            for entry, job in by_age:
+                expired = now - job["created"] > self.max_age
+                if not expired and count <= self.max_entries and total_bytes <= self.max_bytes:
+                    break
+                del self._jobs[entry]
+                dropped.append(entry)
+                count -= 1
+                if not any(j["image"] == job["image"] for j in self._jobs.values()):
+                    total_bytes -= job["size"]
+            live_images = {job["image"] for job in self._jobs.values()}
+            live_jobs = set(self._jobs)
+        for entry in dropped:
+            self._remove(self.jobs_dir / entry)
+        if dropped:
+            print(f"Spool compaction dropped {len(dropped)} upload(s)")
+        orphans = [
+            *(path for path in self.jobs_dir.iterdir() if path.name not in live_jobs),
+            *(
+                path
+                for path in self.images_dir.iterdir()
+                if path.name.split(".")[0] not in live_images
+            ),
+        ]
+        for path in orphans:
+            # a concurrent add may not have registered its files yet, leave fresh files alone.
+            try:
+                if now - path.stat().st_mtime > ORPHAN_GRACE_SECONDS:
+                    self._remove(path)
+            except FileNotFoundError:
+                pass
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """Stop the retry scheduler, pending jobs stay on disk for the next start. A running retry is waited for at most `timeout` seconds."""
+        self._closed.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        last_compaction = time.time()
+        while not self._closed.is_set():
+            now = time.time()
+            with self._lock:
+                due = [e for e, j in self._jobs.items() if j["next_attempt"] <= now]
+                upcoming = [j["next_attempt"] for j in self._jobs.values()]
+            for entry in sorted(due):
+                if self._closed.is_set():
+                    return
+                self._attempt(entry)
+            if time.time() - last_compaction > COMPACTION_INTERVAL:
+                self.compact()
+                last_compaction = time.time()
+            if not due:
+                timeout = min(upcoming) - now if upcoming else MAX_IDLE_WAIT
+                self._wakeup.wait(max(0.5, min(timeout, MAX_IDLE_WAIT)))
+                self._wakeup.clear()
+
+    def _attempt(self, entry: str) -> None:
+        with self._lock:
+            job = self._jobs.get(entry)
+        if job is None:
+            return
+        try:
+            data = (self.images_dir / f"{job['image']}.png").read_bytes()
+        except OSError as e:
+            print(f"Spooled image of {job['name']} is missing: {e!r}")
+            self._finish(entry, job)
+            return
+        try:
+            self._handler(job["connector"], job["name"], data)
+        except SpoolJobDropped as e:
+            print(f"Dropping spooled upload of {job['name']}: {e}")
+            self._finish(entry, job)
+            return
+        except Exception as e:
+            job = dict(job)
+            job["attempts"] += 1
+            job["next_attempt"] = time.time() + self._delay(job["attempts"])
+            print(
+                f"Retry {job['attempts']} of {job['name']} failed ({e!r}), "
+                f"next attempt in {job['next_attempt'] - time.time():.0f}s"
+            )
+            with self._lock:
+                if entry not in self._jobs:
+                    return
+                self._jobs[entry] = job
+            self._write(self.jobs_dir / entry, json.dumps(job).encode())
+            return
+        self._finish(entry, job)
+
+    def _finish(self, entry: str, job: dict) -> None:
+        with self._lock:
+            self._jobs.pop(entry, None)
+            orphan = not any(j["image"] == job["image"] for j in self._jobs.values())
+        self._remove(self.jobs_dir / entry)
+        if orphan:
+            self._remove(self.images_dir / f"{job['image']}.png")
+
+    def _delay(self, attempts: int) -> float:
+        """Exponential backoff with full jitter."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempts))
+
+    def _makedirs(self) -> None:
+        self.images_dir.mkdir(parents=True, exist_ok=True)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+
+    def _write(self, path: Path, data: bytes) -> None:
+        """Write a file atomically, a crash never leaves a partially written entry behind."""
+        tmp = path.with_name(f"{path.name}.tmp")
+        with tmp.open("wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp.replace(path)
+
+    def _remove(self, path: Path) -> None:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
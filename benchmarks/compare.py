@@ -0,0 +1,82 @@
+"""
+Compare two benchmark results written by `benchmarks/run.py`, E.g. of two commits.
+
+    python benchmarks/compare.py before.json after.json --threshold 10
+
+Every measurement of both files is printed with its change, the exit status is 1 when one
+got worse by more than `--threshold` percent.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# the fields identifying a measurement and its metrics, with whether higher is better.
+SECTIONS = {
+    "uploads": (("backend", "resolution", "batch"), {"images_per_sec": True, "mb_per_sec": True}),
+    "page_loads": (
+        ("backend", "files"),
+        {"cold_seconds": False, "warm_seconds": False, "last_page_seconds": False, "refresh_seconds": False},
+    ),
+}
+
+
+def index(results: List[dict], fields: Tuple[str, ...]) -> Dict[Tuple, dict]:
+    """Return the measurements of a section by the values of their identifying fields."""
+    return {tuple(result[field] for field in fields): result for result in results}
+
+
+def compare(before: dict, after: dict, threshold: float) -> List[str]:
+    """Print the change of every measurement found in both results and return the regressions."""
+    regressions = []
+    for section, (fields, metrics) in SECTIONS.items():
+        old = index(before.get(section, []), fields)
+        new = index(after.get(section, []), fields)
+        for identity in sorted(old.keys() & new.keys(), key=str):
+            label = f"{section} " + " ".join(f"{field}={value}" for field, value in zip(fields, identity))
+            for metric, higher_is_better in metrics.items():
+                change = _change(old[identity][metric], new[identity][metric])
+                if change is None:
+                    continue
+                worse = -change if higher_is_better else change
+                flag = " REGRESSION" if worse > threshold else ""
+                print(
+                    f"{label} {metric}: {old[identity][metric]:.4g} -> {new[identity][metric]:.4g} "
+                    f"({change:+.1f}%){flag}"
+                )
+                if flag:
+                    regressions.append(f"{label} {metric}")
+        for identity in sorted(old.keys() ^ new.keys(), key=str):
+            print(f"{section} {dict(zip(fields, identity))} is only in one of the results")
+    return regressions
+
+
+def _change(old: float, new: float) -> Optional[float]:
+    if not old:
+        return None
+    return (new - old) / old * 100
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Compare the two result files of the command line, 1 when a metric regressed."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent a metric may get worse")
+    args = parser.parse_args(argv)
+    before = json.loads(Path(args.before).read_text())
+    after = json.loads(Path(args.after).read_text())
+    print(f"before: {before.get('commit')}{' (dirty)' if before.get('dirty') else ''}")
+    print(f"after:  {after.get('commit')}{' (dirty)' if after.get('dirty') else ''}")
+    if before.get("arguments") != after.get("arguments"):
+        print("warning: the results were measured with different arguments")
+    regressions = compare(before, after, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {args.threshold}%")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
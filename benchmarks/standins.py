@@ -0,0 +1,592 @@
+"""
+Local stand-ins of the remote drives, the benchmarks run against these instead of real servers.
+
+- `SFTPStandIn` is an in-process paramiko SFTP server serving a local directory over loopback tcp.
+- `FakeSMBConnection` is a drop-in for `smb.SMBConnection.SMBConnection` backed by a local directory.
+- `DriveStandIn` is a local http server speaking the folder and resumable upload endpoints of the drive api.
+
+Each one can add a fixed `latency` to every request to model a remote host.
+"""
+import json
+import logging
+import os
+import posixpath
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from stat import S_ISDIR
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlparse
+
+import paramiko
+from smb.base import SharedFile
+from smb.smb_constants import ATTR_DIRECTORY, ATTR_NORMAL
+from smb.smb_structs import OperationFailure
+
+from DriveFolders import FOLDER_MIME_TYPE, DriveFolderCache
+from DriveUploader import DriveUploader
+from GDriveConnector import GDriveConnector
+
+
+def _local_path(root: Path, path: str) -> Path:
+    """Map a remote path to a path inside `root`, remote paths can not escape it."""
+    return root / posixpath.normpath("/" + path).lstrip("/")
+
+
+class _SSHServer(paramiko.ServerInterface):
+    def __init__(self, root: Path, username: str, password: str, latency: float) -> None:
+        self.root = root
+        self.username = username
+        self.password = password
+        self.latency = latency
+
+    def check_auth_password(self, username: str, password: str) -> int:
+        if (username, password) == (self.username, self.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username: str) -> str:
+        return "password"
+
+    def check_channel_request(self, kind: str, chanid: int) -> int:
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class _SFTPHandle(paramiko.SFTPHandle):
+    latency = 0.0
+
+    def read(self, offset: int, length: int) -> bytes:
+        time.sleep(self.latency)
+        return super().read(offset, length)
+
+    def write(self, offset: int, data: bytes) -> int:
+        time.sleep(self.latency)
+        return super().write(offset, data)
+
+    def stat(self) -> object:
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+
+class _LocalSFTPServer(paramiko.SFTPServerInterface):
+    def __init__(self, server: _SSHServer, *args: object, **kwargs: object) -> None:
+        super().__init__(server, *args, **kwargs)
+        self.root = server.root
+        self.latency = server.latency
+
+    def _path(self, path: str) -> Path:
+        time.sleep(self.latency)
+        return _local_path(self.root, path)
+
+    def list_folder(self, path: str) -> object:
+        local = self._path(path)
+        try:
+            return [
+                paramiko.SFTPAttributes.from_stat(entry.stat(), entry.name)
+                for entry in os.scandir(local)
+            ]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path: str) -> object:
+        try:
+            return paramiko.SFTPAttributes.from_stat(self._path(path).stat())
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path: str, flags: int, attr: paramiko.SFTPAttributes) -> object:
+        local = self._path(path)
+        try:
+            fd = os.open(local, flags | getattr(os, "O_BINARY", 0), 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        f = os.fdopen(fd, mode)
+        handle = _SFTPHandle(flags)
+        handle.latency = self.latency
+        handle.filename = str(local)
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path: str) -> int:
+        try:
+            self._path(path).unlink()
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath: str, newpath: str) -> int:
+        try:
+            self._path(oldpath).replace(self._path(newpath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path: str, attr: paramiko.SFTPAttributes) -> int:
+        try:
+            self._path(path).mkdir()
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rmdir(self, path: str) -> int:
+        try:
+            self._path(path).rmdir()
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def chattr(self, path: str, attr: paramiko.SFTPAttributes) -> int:
+        return paramiko.SFTP_OK
+
+
+logging.getLogger("benchmarks.sftp").setLevel(logging.CRITICAL)
+
+
+class SFTPStandIn:
+
+    """
+    SFTPStandIn: An in-process SFTP server on 127.0.0.1 that serves a local directory.
+
+    Every connection gets its own paramiko transport thread, so concurrent connectors behave like
+    they would against a real server. Use it as a context manager, the server stops on exit.
+
+    Attributes
+    ----------
+    root : Path
+        The directory served as `/`.
+    host : str
+    port : int
+        The port the server listens on, picked by the os.
+    username : str
+    password : str
+    latency : float
+        Seconds added to every request.
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path],
+        username: str = "bench",
+        password: str = "bench",
+        latency: float = 0.0,
+    ) -> None:
+        """
+        Initiate the server and bind it to a free port, it accepts connections once entered.
+
+        Parameters
+        ----------
+        root : Union[str, Path]
+            The directory served as `/`.
+        username : str
+            The username clients authenticate with.
+        password : str
+            The password clients authenticate with.
+        latency : float
+            Seconds added to every request.
+        """
+        self.root = Path(root)
+        self.host = "127.0.0.1"
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, 0))
+        self._socket.listen(64)
+        self.port = self._socket.getsockname()[1]
+        self._transports: List[paramiko.Transport] = []
+        self._closed = False
+
+    def __enter__(self) -> "SFTPStandIn":
+        """Start accepting connections."""
+        threading.Thread(target=self._accept, name="bench-sftp-accept", daemon=True).start()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        """Stop the server and close every connection."""
+        self._closed = True
+        self._socket.close()
+        for transport in self._transports:
+            transport.close()
+
+    def _accept(self) -> None:
+        while not self._closed:
+            try:
+                conn, _ = self._socket.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(conn)
+            # the server side logs every client disconnect as a socket error.
+            transport.set_log_channel("benchmarks.sftp")
+            transport.add_server_key(self._host_key)
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, _LocalSFTPServer)
+            transport.start_server(
+                server=_SSHServer(self.root, self.username, self.password, self.latency)
+            )
+            self._transports.append(transport)
+
+
+class FakeSMBConnection:
+
+    """
+    FakeSMBConnection: A pysmb compatible `SMBConnection` that reads and writes a local directory.
+
+    It implements the calls `SMBConector` makes with the same arguments, return values and
+    `OperationFailure` errors, each share is a sub directory of `root`.
+    Patch it in with `SMBConnector.SMBConnection = FakeSMBConnection`.
+
+    Attributes
+    ----------
+    root : Path
+        The directory holding one sub directory per share, set on the class.
+    latency : float
+        Seconds added to every request, set on the class.
+    """
+
+    root = Path()
+    latency = 0.0
+
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        my_name: str,
+        remote_name: str,
+        domain: str = "",
+        use_ntlm_v2: bool = True,
+        **kwargs: object,
+    ) -> None:
+        """
+        Initiate a connection, it takes the arguments of `SMBConnection` and ignores the credentials.
+
+        Parameters
+        ----------
+        username : str
+            The username, kept for the connector.
+        password : str
+            Ignored, every connection is accepted.
+        my_name : str
+            Ignored.
+        remote_name : str
+            The server name, kept for the connector.
+        domain : str
+            Ignored.
+        use_ntlm_v2 : bool
+            Ignored.
+        **kwargs : object
+            The other options of `SMBConnection`, ignored.
+        """
+        self.username = username
+        self.remote_name = remote_name
+
+    def connect(self, ip: str, port: int = 139, **kwargs: object) -> bool:
+        time.sleep(self.latency)
+        return True
+
+    def close(self) -> None:
+        pass
+
+    def echo(self, data: bytes, timeout: int = 10) -> bytes:
+        time.sleep(self.latency)
+        return data
+
+    def listPath(self, service_name: str, path: str, *args: object, **kwargs: object) -> List[SharedFile]:
+        local = self._path(service_name, path)
+        try:
+            entries = list(os.scandir(local))
+        except OSError as e:
+            raise OperationFailure(f"Failed to list {path} on {service_name}: {e}", []) from e
+        return [
+            self._shared_file(".", local.stat()),
+            self._shared_file("..", local.stat()),
+        ] + [self._shared_file(entry.name, entry.stat()) for entry in entries]
+
+    def getAttributes(self, service_name: str, path: str, timeout: int = 30) -> SharedFile:
+        try:
+            stat = self._path(service_name, path).stat()
+        except OSError as e:
+            raise OperationFailure(f"Failed to get attributes of {path} on {service_name}: {e}", []) from e
+        return self._shared_file(posixpath.basename(path), stat)
+
+    def createDirectory(self, service_name: str, path: str, timeout: int = 30) -> None:
+        try:
+            self._path(service_name, path).mkdir()
+        except OSError as e:
+            raise OperationFailure(f"Failed to create directory {path} on {service_name}: {e}", []) from e
+
+    def deleteDirectory(self, service_name: str, path: str, timeout: int = 30) -> None:
+        try:
+            self._path(service_name, path).rmdir()
+        except OSError as e:
+            raise OperationFailure(f"Failed to delete directory {path} on {service_name}: {e}", []) from e
+
+    def storeFile(self, service_name: str, path: str, file_obj: BinaryIO, timeout: int = 30, **kwargs: object) -> int:
+        return self.storeFileFromOffset(service_name, path, file_obj, 0, truncate=True)
+
+    def storeFileFromOffset(
+        self,
+        service_name: str,
+        path: str,
+        file_obj: BinaryIO,
+        offset: int = 0,
+        truncate: bool = False,
+        timeout: int = 30,
+        **kwargs: object,
+    ) -> int:
+        local = self._path(service_name, path)
+        try:
+            with local.open("r+b" if local.exists() and not truncate else "wb") as f:
+                f.seek(offset)
+                return offset + f.write(file_obj.read())
+        except OSError as e:
+            raise OperationFailure(f"Failed to store {path} on {service_name}: {e}", []) from e
+
+    def retrieveFile(self, service_name: str, path: str, file_obj: BinaryIO, timeout: int = 30, **kwargs: object) -> Tuple[int, int]:
+        return self.retrieveFileFromOffset(service_name, path, file_obj)
+
+    def retrieveFileFromOffset(
+        self,
+        service_name: str,
+        path: str,
+        file_obj: BinaryIO,
+        offset: int = 0,
+        max_length: int = -1,
+        timeout: int = 30,
+        **kwargs: object,
+    ) -> Tuple[int, int]:
+        local = self._path(service_name, path)
+        try:
+            with local.open("rb") as f:
+                f.seek(offset)
+                data = f.read(max_length if max_length >= 0 else -1)
+        except OSError as e:
+            raise OperationFailure(f"Failed to retrieve {path} on {service_name}: {e}", []) from e
+        file_obj.write(data)
+        return ATTR_NORMAL, len(data)
+
+    def _path(self, service_name: str, path: str) -> Path:
+        time.sleep(self.latency)
+        return _local_path(Path(self.root, service_name), path)
+
+    @staticmethod
+    def _shared_file(name: str, stat: os.stat_result) -> SharedFile:
+        attributes = ATTR_DIRECTORY if S_ISDIR(stat.st_mode) else ATTR_NORMAL
+        return SharedFile(
+            stat.st_ctime,
+            stat.st_atime,
+            stat.st_mtime,
+            stat.st_ctime,
+            stat.st_size,
+            stat.st_size,
+            attributes,
+            name,
+            name,
+        )
+
+
+class _DriveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "DriveStandIn"
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        if url.path == "/drive/v3/files":
+            query = parse_qs(url.query).get("q", [""])[0]
+            with self.server.lock:
+                files = [
+                    {"id": folder_id}
+                    for folder_id, name in self.server.folders.items()
+                    if f"name = '{name}'" in query
+                ]
+            self._json(200, {"files": files[:1]})
+            return
+        folder_id = url.path.rsplit("/", 1)[-1]
+        with self.server.lock:
+            name = self.server.folders.get(folder_id)
+        if name is None:
+            self._json(404, {"error": "not found"})
+            return
+        self._json(200, {"id": folder_id, "name": name, "mimeType": FOLDER_MIME_TYPE, "trashed": False})
+
+    def do_POST(self) -> None:
+        time.sleep(self.server.latency)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        url = urlparse(self.path)
+        metadata = json.loads(body or b"{}")
+        session_id = uuid.uuid4().hex
+        if url.path == "/drive/v3/files":
+            with self.server.lock:
+                self.server.folders[session_id] = metadata["name"]
+            self._json(200, {"id": session_id})
+            return
+        with self.server.lock:
+            self.server.sessions[session_id] = (
+                metadata,
+                int(self.headers.get("X-Upload-Content-Length", 0)),
+                bytearray(),
+            )
+        self.send_response(200)
+        self.send_header("Location", f"{self.server.url}/upload/session/{session_id}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_PUT(self) -> None:
+        time.sleep(self.server.latency)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        session_id = urlparse(self.path).path.rsplit("/", 1)[-1]
+        with self.server.lock:
+            session = self.server.sessions.get(session_id)
+        if session is None:
+            self._json(404, {"error": "unknown upload session"})
+            return
+        metadata, total, received = session
+        if body:
+            start = int(self.headers["Content-Range"].split()[1].split("-")[0])
+            del received[start:]
+            received.extend(body)
+        if len(received) < total:
+            self.send_response(308)
+            if received:
+                self.send_header("Range", f"bytes=0-{len(received) - 1}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        with self.server.lock:
+            self.server.sessions.pop(session_id, None)
+        if self.server.root is not None:
+            (self.server.root / Path(metadata["name"]).name).write_bytes(received)
+        self._json(200, {"id": session_id, "name": metadata["name"]})
+
+    def _json(self, status: int, value: dict) -> None:
+        body = json.dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DriveStandIn(ThreadingHTTPServer):
+
+    """
+    DriveStandIn: A local http server speaking the parts of the drive api the extension uses.
+
+    Folders are looked up, validated and created with `/drive/v3/files`, images are sent as
+    resumable uploads. Use it as a context manager, the server stops on exit.
+
+    Attributes
+    ----------
+    url : str
+        The base url to configure as the drive api url.
+    root : Path
+        The directory completed uploads are written to, None to discard them.
+    latency : float
+        Seconds added to every request.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, root: Union[str, Path, None] = None, latency: float = 0.0) -> None:
+        """
+        Initiate the server and bind it to a free port, it serves requests once entered.
+
+        Parameters
+        ----------
+        root : Union[str, Path, None]
+            The directory completed uploads are written to, None to discard them.
+        latency : float
+            Seconds added to every request.
+        """
+        super().__init__(("127.0.0.1", 0), _DriveHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.root = Path(root) if root is not None else None
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.folders: Dict[str, str] = {}
+        self.sessions: Dict[str, Tuple[dict, int, bytearray]] = {}
+
+    def __enter__(self) -> "DriveStandIn":
+        """Start serving requests on a background thread."""
+        threading.Thread(target=self.serve_forever, name="bench-drive", daemon=True).start()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        """Stop the server."""
+        self.shutdown()
+        self.server_close()
+
+
+class _StaticToken:
+    def token(self) -> str:
+        return "benchmark-token"
+
+    def is_authorized(self) -> bool:
+        return True
+
+
+class DriveStandInConnector(GDriveConnector):
+
+    """
+    DriveStandInConnector: A `GDriveConnector` that skips the oauth flow, for uploads to a `DriveStandIn`.
+
+    It takes the arguments of `GDriveConnector` so it can replace it in `ConnectorManager.CONNECTOR_TYPES`,
+    everything but the credentials (folder cache, resumable uploads) is the code of `GDriveConnector`.
+    """
+
+    def __init__(
+        self,
+        client_secret_path: str,
+        dir_name: str = "sd_web_ui",
+        api_url: str = "",
+        chunk_size: int = 8 * 1024 * 1024,
+        session_dir: Optional[str] = None,
+        interactive: bool = False,
+    ) -> None:
+        """
+        Initiate a connector of a `DriveStandIn`, the arguments are the ones of `GDriveConnector`.
+
+        Parameters
+        ----------
+        client_secret_path : str
+            Ignored, the stand-in accepts a static token.
+        dir_name : str
+            The folder images are uploaded to.
+        api_url : str
+            The url of the `DriveStandIn`.
+        chunk_size : int
+            The size of each uploaded chunk.
+        session_dir : Optional[str]
+            The directory the folder cache and the upload sessions are kept in.
+        interactive : bool
+            Ignored, there is no oauth flow.
+        """
+        self.auth = _StaticToken()
+        self.gauth = None
+        self.extension_path = session_dir
+        self.folders = DriveFolderCache(str(Path(session_dir, "gdrive-folders.json")))
+        self.api_url = api_url.rstrip("/")
+        self.dir_name = dir_name
+        self.dir_id = self.get_gdrive_folder_id()
+        self.uploader = DriveUploader(self.api_url, chunk_size, session_dir)
+
@@ -0,0 +1 @@
+"""Stand-ins of the webui modules the extension imports."""
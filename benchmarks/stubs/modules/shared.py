@@ -0,0 +1,10 @@
+"""
+A stand-in for the `modules.shared` module of the webui, so the extension can be benchmarked outside of it.
+
+Only the attributes the extension reads outside of its ui callbacks are provided, the benchmark
+fills `opts` with the extension settings it runs with.
+"""
+from types import SimpleNamespace
+
+opts = SimpleNamespace()
+cmd_opts = SimpleNamespace(connect_save_path="", no_gradio_queue=False)
@@ -7,9 +7,12 @@ This file seperated into 2 parts:
     2. helper methods for setting up the extension.
     3. register the callbacks hook.
 """
+import atexit
+import time
 import warnings
-from typing import Type, cast
+from typing import Dict, Type, cast
 
+import gradio as gr
 from fastapi import FastAPI
 from gradio import Blocks
 from modules import script_callbacks, shared
@@ -18,13 +21,19 @@ from PIL.Image import Image
 
 from ConfigObject import ConfigObject
 from ConnectorManager import ConnectorManager
+from ImageCache import image_cache
+from ImageRoutes import ROUTE_PREFIX, load_secret
+from ListingCache import listing_cache
+from Metrics import metrics
 from UI import UI
+from UploadQueue import BACKPRESSURE_POLICIES, UploadJob
 
 warnings.warn("CryptographyDeprecationWarning", DeprecationWarning)
 
 
 def setup_options() -> None:
     """For multiple connections use , to separate them."""
+    started = time.perf_counter()
     shared.options_templates.update(
         shared.options_section(
             ("sd_web_ui_connect", "Remote Drive"),
@@ -60,12 +69,21 @@ def setup_options() -> None:
                 ),
                 "sd_web_ui_connect_gdrive_client_secret": shared.OptionInfo(
                     "",
-                    "google oauth path to client_secret **Need absolute path(After Apply gdrive config app if use have another gdrive oauth apply before you need to delete credentails.json in extension folder)",
+                    "google oauth path to client_secret **Need absolute path(if use have another gdrive oauth apply before you need to delete credentails.json in extension folder)",
                     component_args=shared.hide_dirs,
                 ),
                 "sd_web_ui_connect_gdrive_save_dir": shared.OptionInfo(
                     "",
-                    "save dir (After Apply gdrive config app ui need to restart)",
+                    "save dir",
+                    component_args=shared.hide_dirs,
+                ),
+                "sd_web_ui_connect_gdrive_chunk_mb": shared.OptionInfo(
+                    8,
+                    "Size in MB of each chunk of a google drive upload, an interrupted upload resumes after the last sent chunk",
+                ),
+                "sd_web_ui_connect_gdrive_api_url": shared.OptionInfo(
+                    "",
+                    "Base url google drive uploads are sent to; if empty, it will be https://www.googleapis.com",
                     component_args=shared.hide_dirs,
                 ),
                 "sd_web_ui_connect_sftp_user_passwd": shared.OptionInfo(
@@ -83,75 +101,267 @@ def setup_options() -> None:
                     "Path to connection to sftp server (path contain trailing slash E.g /NasStorage/sd_web_ui)",
                     component_args=shared.hide_dirs,
                 ),
+                "sd_web_ui_connect_upload_queue_size": shared.OptionInfo(
+                    32,
+                    "Maximum number of images waiting in the background upload queue (After Apply app ui need to restart)",
+                ),
+                "sd_web_ui_connect_upload_workers": shared.OptionInfo(
+                    1,
+                    "Number of background upload workers (After Apply app ui need to restart)",
+                ),
+                "sd_web_ui_connect_upload_backpressure": shared.OptionInfo(
+                    "block",
+                    "When the upload queue is full: block the generation, drop the oldest waiting image or spill it to the upload spool (After Apply app ui need to restart)",
+                    gr.Radio,
+                    {"choices": list(BACKPRESSURE_POLICIES)},
+                ),
+                "sd_web_ui_connect_upload_timeout": shared.OptionInfo(
+                    120,
+                    "Seconds an upload to a single remote drive may take before it is retried from the upload spool (0 waits forever)",
+                ),
+                "sd_web_ui_connect_uploads_per_destination": shared.OptionInfo(
+                    2,
+                    "Maximum number of images uploaded to a single remote drive at the same time, remote drives are uploaded to in parallel",
+                ),
+                "sd_web_ui_connect_spool_path": shared.OptionInfo(
+                    "",
+                    "Directory of failed uploads waiting for a retry; if empty, it will be --connect-save-path/spool (After Apply app ui need to restart)",
+                    component_args=shared.hide_dirs,
+                ),
+                "sd_web_ui_connect_spool_max_mb": shared.OptionInfo(
+                    1024,
+                    "Maximum size in MB of failed uploads kept for a retry, the oldest are dropped above it",
+                ),
+                "sd_web_ui_connect_spool_max_age": shared.OptionInfo(
+                    72,
+                    "Hours a failed upload is retried before it is dropped",
+                ),
+                "sd_web_ui_connect_idle_timeout": shared.OptionInfo(
+                    300,
+                    "Seconds an unused connection to a remote drive is kept open",
+                ),
+                "sd_web_ui_connect_max_connections": shared.OptionInfo(
+                    4,
+                    "Maximum number of connections per remote drive, shared by uploads and the remote browser",
+                ),
+                "sd_web_ui_connect_browser_workers": shared.OptionInfo(
+                    4,
+                    "Number of images the remote browser downloads at the same time",
+                ),
+                "sd_web_ui_connect_page_timeout": shared.OptionInfo(
+                    30,
+                    "Seconds the remote browser waits for the images of a page",
+                ),
+                "sd_web_ui_connect_stream_pages": shared.OptionInfo(
+                    True,
+                    "Show the images of a remote browser page as they are downloaded (After Apply app ui need to restart)",
+                ),
+                "sd_web_ui_connect_prefetch_depth": shared.OptionInfo(
+                    1,
+                    "Number of pages before and after the current one the remote browser prefetches (0 disables prefetching)",
+                ),
+                "sd_web_ui_connect_prefetch_share": shared.OptionInfo(
+                    50,
+                    "Percent of the connections per remote drive prefetching may use, the rest is kept for page loads and uploads",
+                    gr.Slider,
+                    {"minimum": 0, "maximum": 100, "step": 5},
+                ),
+                "sd_web_ui_connect_listing_ttl": shared.OptionInfo(
+                    60,
+                    "Seconds the remote browser reuses a directory listing before checking the server again (Refetch always re-lists)",
+                ),
+                "sd_web_ui_connect_image_cache_mb": shared.OptionInfo(
+                    512,
+                    "Memory in MB used to cache images downloaded by the remote browser",
+                ),
+                "sd_web_ui_connect_manifest": shared.OptionInfo(
+                    False,
+                    "Keep a manifest (.sdconnect-manifest.jsonl) in each remote directory, browsing reads it instead of listing the directory",
+                ),
+                "sd_web_ui_connect_encoder_workers": shared.OptionInfo(
+                    0,
+                    "Number of processes encoding png files for remote drives (0 encodes on the upload worker)",
+                ),
+                "sd_web_ui_connect_png_compress_level": shared.OptionInfo(
+                    6,
+                    "Png compression level for remote drives (0 is fastest, 9 is smallest)",
+                    gr.Slider,
+                    {"minimum": 0, "maximum": 9, "step": 1},
+                ),
             },
         )
     )
-    setting_lst_gdrive = config.get_gdrive_config()
-    if setting_lst_gdrive is not None:
+    for option in CONNECTOR_OPTIONS:
+        shared.opts.onchange(option, reload_connectors, call=False)
+    for option in ENCODER_OPTIONS:
+        shared.opts.onchange(option, reload_encoder, call=False)
+    for option in SPOOL_OPTIONS:
+        shared.opts.onchange(option, reload_spool, call=False)
+    shared.opts.onchange(
+        "sd_web_ui_connect_image_cache_mb", reload_caches, call=True
+    )
+    shared.opts.onchange(
+        "sd_web_ui_connect_listing_ttl", reload_caches, call=False
+    )
+    gdrive = config.get_gdrive_config()
+    if gdrive is not None:
         manager.create_gdrive_connector(
-            setting_lst_gdrive[0], setting_lst_gdrive[1], authen_only=True
+            gdrive.client_secret, gdrive.save_dir, authen_only=True, api_url=gdrive.api_url
         )
-
-    UI.on_load(ui)
+    startup_seconds["settings"] = time.perf_counter() - started
 
 
 def on_app_started(gradio: Blocks, fastapi: FastAPI) -> None:
-    """Need to authen first when app started for get access token."""
-    # setting_lst_gdrive = config.get_gdrive_config()
-    # if setting_lst_gdrive is not None:
-    #     manager.create_gdrive_connector(
-    #         setting_lst_gdrive[0], setting_lst_gdrive[1], authen_only=True
-    #     )
+    """
+    Start the upload spool when the app started so uploads left by a previous run are resumed.
 
-    pass
+    Also register the routes the remote browser gallery loads its images from, the metrics route
+    and report the startup cost of the extension, backends are only imported (and google drive authorized)
+    in the background.
+    """
+    started = time.perf_counter()
+    start_uploads()
+    ui.register_routes(fastapi, load_secret(config.get_save_path("url-secret")))
+    metrics.gauge("image_cache_bytes", image_cache.size)
+    metrics.gauge(
+        "image_cache_hit_ratio",
+        lambda: image_cache.hits / max(1, image_cache.hits + image_cache.misses),
+    )
+    metrics.register(fastapi, f"{ROUTE_PREFIX}/metrics")
+    startup_seconds["app started"] = time.perf_counter() - started
+    print(
+        "Remote Drive startup: "
+        + ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in startup_seconds.items())
+    )
 
 
 def save_image_callback(params: ImageSaveParams) -> None:
-    """Logic to perfrom save image for this extension, that will be registered to the webui."""
-    manager.__reset__()
-    setup_connectors(manager, config)
+    """
+    Logic to perfrom save image for this extension, that will be registered to the webui.
+
+    The image is only snapshotted here, uploading happens on the background upload queue.
+    """
+    start_uploads()
     image = cast(
         Type[Image], params.image
     )  # ImageSaveParams not provide type to its this made for support type hinting
     image_name = params.filename
-    manager.save_image(image, image_name, params.pnginfo)
-    manager.before_unload()
+    manager.enqueue_image(image, image_name, params.pnginfo)
+
+
+def start_uploads() -> None:
+    """Open the metadata index, apply the settings and start the upload spool and queue, helper method for the callbacks."""
+    manager.open_index(config.get_save_path("index.sqlite3"))
+    if manager.upload_queue is not None:
+        return
+    reload_connectors()
+    reload_encoder()
+    max_mb, max_age_hours = config.get_spool_config()
+    manager.start_spool(
+        config.get_spool_path(), max_mb * 1024 * 1024, max_age_hours * 3600
+    )
+    queue_size, workers, policy = config.get_upload_queue_config()
+    manager.start_upload_queue(upload_job, queue_size, workers, policy)
+
+
+def upload_job(job: UploadJob) -> None:
+    """Upload a queued image to all connectors, invoked on the upload worker threads."""
+    manager.upload_job(job)
+
+
+def reload_connectors() -> None:
+    """
+    Apply the connector settings without waiting for the network.
+
+    Unchanged connectors keep their pooled connections, removed or changed ones are closed once their
+    queued uploads are done and new ones connect in the background.
+    """
+    manager.pool.idle_timeout = config.get_idle_timeout()
+    manager.pool.max_per_key = config.get_max_connections()
+    manager.fanout.timeout, manager.fanout.per_destination = config.get_fanout_config()
+    manager.set_manifest(config.get_manifest_enabled())
+    manager.reconfigure(lambda m: setup_connectors(m, config))
+
+
+def reload_spool() -> None:
+    """Apply the spool limits, they are enforced on the next compaction."""
+    if manager.spool is None:
+        return
+    max_mb, max_age_hours = config.get_spool_config()
+    manager.spool.max_bytes = max_mb * 1024 * 1024
+    manager.spool.max_age = max_age_hours * 3600
+
+
+def reload_caches() -> None:
+    """Apply the memory budget of the image cache and the ttl of the listing cache."""
+    image_cache.resize(config.get_image_cache_size())
+    listing_cache.ttl = config.get_listing_ttl()
+
+
+def reload_encoder() -> None:
+    """Apply the png encoder settings."""
+    workers, compress_level = config.get_encoder_config()
+    manager.configure_encoder(workers, compress_level)
 
 
 def setup_connectors(manager: ConnectorManager, config: ConfigObject) -> None:
     """Setup all connectors that will be used by this extension, helper method for `save_image_callback`."""
-    setting_lst = config.get_smb_config()
-    if setting_lst is not None:
-        for setting in setting_lst:
-            manager.create_smb_connector(
-                setting[0],
-                setting[1],
-                setting[2],
-                setting[3],
-                setting[4],
-                setting[5],
-                setting[6],
-                setting[7],
-                setting[8],
-            )
-
-    setting_lst_sftp = config.get_sftp_config()
-    if setting_lst_sftp is not None:
-        for setting in setting_lst_sftp:
-            manager.create_sftp_connector(
-                setting[0], setting[1], setting[2], setting[3], setting[4]
-            )
-    setting_lst_gdrive = config.get_gdrive_config()
-    if setting_lst_gdrive is not None:
-        manager.create_gdrive_connector(setting_lst_gdrive[0], setting_lst_gdrive[1])
+    connector_config = config.get_connector_config()
+    for smb in connector_config.smb:
+        manager.create_smb_connector(*smb)
+    for sftp in connector_config.sftp:
+        manager.create_sftp_connector(*sftp)
+    gdrive = connector_config.gdrive
+    if gdrive is not None:
+        manager.create_gdrive_connector(
+            gdrive.client_secret,
+            gdrive.save_dir,
+            api_url=gdrive.api_url,
+            chunk_size=gdrive.chunk_size,
+            session_dir=gdrive.session_dir,
+        )
 
 
 manager = ConnectorManager()
 config = ConfigObject()
 ui = UI(manager)
+# seconds spent in the startup callbacks, printed once the app started.
+startup_seconds: Dict[str, float] = {}
+
+CONNECTOR_OPTIONS = [
+    "sd_web_ui_connect_smb_path",
+    "sd_web_ui_connect_smb_user_passwd",
+    "sd_web_ui_connect_smb_ip_port",
+    "sd_web_ui_connect_smb_server_name_service_name",
+    "sd_web_ui_connect_smb_domain",
+    "sd_web_ui_connect_gdrive_client_secret",
+    "sd_web_ui_connect_gdrive_save_dir",
+    "sd_web_ui_connect_gdrive_chunk_mb",
+    "sd_web_ui_connect_gdrive_api_url",
+    "sd_web_ui_connect_sftp_user_passwd",
+    "sd_web_ui_connect_sftp_ip_port",
+    "sd_web_ui_connect_sftp_remote_path",
+    "sd_web_ui_connect_idle_timeout",
+    "sd_web_ui_connect_max_connections",
+    "sd_web_ui_connect_manifest",
+    "sd_web_ui_connect_upload_timeout",
+    "sd_web_ui_connect_uploads_per_destination",
+]
+SPOOL_OPTIONS = [
+    "sd_web_ui_connect_spool_max_mb",
+    "sd_web_ui_connect_spool_max_age",
+]
+# seconds a reload or exit waits for the running uploads, the ones left are resumed from the spool.
+SHUTDOWN_TIMEOUT = 30.0
+ENCODER_OPTIONS = [
+    "sd_web_ui_connect_encoder_workers",
+    "sd_web_ui_connect_png_compress_level",
+]
 
 
 script_callbacks.on_ui_settings(setup_options)
-# script_callbacks.on_app_started(on_app_started)
+script_callbacks.on_app_started(on_app_started)
 script_callbacks.on_before_image_saved(save_image_callback)
 script_callbacks.on_ui_tabs(ui.on_ui_tabs)
+script_callbacks.on_script_unloaded(lambda: manager.shutdown(SHUTDOWN_TIMEOUT))
+atexit.register(manager.shutdown, SHUTDOWN_TIMEOUT)
@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+# the extension modules are imported flat, like the webui does, the remote drives are served by the
+# stand-ins of the benchmarks.
+sys.path[:0] = [str(REPO_DIR), str(REPO_DIR / "benchmarks")]
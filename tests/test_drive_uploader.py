@@ -0,0 +1,75 @@
+from pathlib import Path
+from typing import Iterable, Iterator, List
+
+import pytest
+import requests
+from standins import DriveStandIn
+
+from DriveUploader import CHUNK_ALIGNMENT, DriveUploader
+
+DATA = bytes(range(256)) * (CHUNK_ALIGNMENT * 3 // 256 - 10)
+METADATA = {"name": "image.png", "parents": ["folder"]}
+
+
+@pytest.fixture
+def drive(tmp_path: Path) -> Iterator[DriveStandIn]:
+    (tmp_path / "drive").mkdir()
+    with DriveStandIn(tmp_path / "drive") as server:
+        yield server
+
+
+def record(uploader: DriveUploader, fail: Iterable[int] = ()) -> List[str]:
+    """Record the requests of an uploader, the ones numbered in `fail` raise a connection error."""
+    send = uploader._request
+    fail = set(fail)
+    requests_sent: List[str] = []
+
+    def request(method: str, url: str, token: object, headers: dict, body: bytes = b"") -> requests.Response:
+        requests_sent.append(f"{method} {headers.get('Content-Range', '')}".strip())
+        if len(requests_sent) in fail:
+            raise requests.ConnectionError("connection reset")
+        return send(method, url, token, headers, body)
+
+    uploader._request = request  # type: ignore[method-assign]
+    return requests_sent
+
+
+def make_uploader(drive: DriveStandIn, session_dir: Path, max_retries: int = 6) -> DriveUploader:
+    return DriveUploader(drive.url, CHUNK_ALIGNMENT, str(session_dir), max_retries, base_delay=0.0)
+
+
+def test_new_upload_sends_chunks_without_a_status_query(drive: DriveStandIn, tmp_path: Path) -> None:
+    uploader = make_uploader(drive, tmp_path / "sessions")
+    sent = record(uploader)
+    uploader.upload(DATA, METADATA, lambda: "token")
+    assert sent[0] == "POST"
+    assert not any(request.startswith("PUT bytes */") for request in sent)
+    assert len(sent) == 4
+    assert (tmp_path / "drive" / "image.png").read_bytes() == DATA
+    assert list((tmp_path / "sessions").iterdir()) == []
+
+
+def test_failed_chunk_is_retried_from_what_drive_received(drive: DriveStandIn, tmp_path: Path) -> None:
+    uploader = make_uploader(drive, tmp_path / "sessions")
+    sent = record(uploader, fail=[3])
+    uploader.upload(DATA, METADATA, lambda: "token")
+    assert sent[3] == f"PUT bytes */{len(DATA)}"
+    assert sent[4].startswith(f"PUT bytes {CHUNK_ALIGNMENT}-")
+    assert (tmp_path / "drive" / "image.png").read_bytes() == DATA
+
+
+def test_interrupted_upload_resumes_its_session(drive: DriveStandIn, tmp_path: Path) -> None:
+    first = make_uploader(drive, tmp_path / "sessions", max_retries=0)
+    record(first, fail=[3])
+    with pytest.raises(requests.ConnectionError):
+        first.upload(DATA, METADATA, lambda: "token")
+    assert len(list((tmp_path / "sessions").iterdir())) == 1
+
+    restarted = make_uploader(drive, tmp_path / "sessions")
+    sent = record(restarted)
+    restarted.upload(DATA, METADATA, lambda: "token")
+    assert "POST" not in sent
+    assert sent[0] == f"PUT bytes */{len(DATA)}"
+    assert sent[1].startswith(f"PUT bytes {CHUNK_ALIGNMENT}-")
+    assert (tmp_path / "drive" / "image.png").read_bytes() == DATA
+    assert list((tmp_path / "sessions").iterdir()) == []
@@ -0,0 +1,136 @@
+from pathlib import Path
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from BaseConnector import RemoteFile
+from ImageRoutes import ImageRoutes, load_secret, parse_range
+from Thumbnail import EncodedImage
+
+DATA = bytes(range(100))
+REMOTE_FILE = RemoteFile("dir/image.png", len(DATA), 1700000000.0)
+
+
+def make_client() -> Tuple[TestClient, ImageRoutes, List[RemoteFile]]:
+    fetched: List[RemoteFile] = []
+
+    def resolve(connector_id: str) -> Optional[Tuple]:
+        return ("smb", connector_id) if connector_id == "smb-0" else None
+
+    def original(key: Tuple, remote_file: RemoteFile) -> bytes:
+        fetched.append(remote_file)
+        return DATA
+
+    def thumbnail(key: Tuple, remote_file: RemoteFile, size: int) -> EncodedImage:
+        return EncodedImage(b"thumbnail", "image/webp", {})
+
+    routes = ImageRoutes(b"s" * 32, resolve, thumbnail, original)
+    app = FastAPI()
+    routes.register(app)
+    return TestClient(app), routes, fetched
+
+
+def path_of(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.path}?{parts.query}"
+
+
+def test_image_is_served_with_cache_headers() -> None:
+    client, routes, _ = make_client()
+    response = client.get(path_of(routes.image_url("", "smb-0", REMOTE_FILE)))
+    assert response.status_code == 200
+    assert response.content == DATA
+    assert response.headers["content-type"] == "image/png"
+    assert "immutable" in response.headers["cache-control"]
+    assert response.headers["accept-ranges"] == "bytes"
+
+
+def test_thumbnail_is_served_encoded() -> None:
+    client, routes, _ = make_client()
+    response = client.get(path_of(routes.thumbnail_url("", "smb-0", REMOTE_FILE, 256)))
+    assert response.status_code == 200
+    assert response.content == b"thumbnail"
+    assert response.headers["content-type"] == "image/webp"
+
+
+@pytest.mark.parametrize("if_none_match", ["{etag}", "W/{etag}", '"other", {etag}', "*"])
+def test_matching_etag_is_not_modified(if_none_match: str) -> None:
+    client, routes, fetched = make_client()
+    url = path_of(routes.image_url("", "smb-0", REMOTE_FILE))
+    etag = client.get(url).headers["etag"]
+    fetched.clear()
+    response = client.get(url, headers={"If-None-Match": if_none_match.format(etag=etag)})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    assert fetched == []
+
+
+def test_other_etag_is_served() -> None:
+    client, routes, _ = make_client()
+    url = path_of(routes.image_url("", "smb-0", REMOTE_FILE))
+    response = client.get(url, headers={"If-None-Match": '"other"'})
+    assert response.status_code == 200
+    assert response.content == DATA
+
+
+@pytest.mark.parametrize(
+    ("range_header", "content_range", "body"),
+    [
+        ("bytes=10-19", "bytes 10-19/100", DATA[10:20]),
+        ("bytes=90-", "bytes 90-99/100", DATA[90:]),
+        ("bytes=-5", "bytes 95-99/100", DATA[95:]),
+        ("bytes=95-200", "bytes 95-99/100", DATA[95:]),
+    ],
+)
+def test_range_is_partial_content(range_header: str, content_range: str, body: bytes) -> None:
+    client, routes, _ = make_client()
+    url = path_of(routes.image_url("", "smb-0", REMOTE_FILE))
+    response = client.get(url, headers={"Range": range_header})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == content_range
+    assert response.content == body
+
+
+def test_unsatisfiable_range() -> None:
+    client, routes, _ = make_client()
+    url = path_of(routes.image_url("", "smb-0", REMOTE_FILE))
+    response = client.get(url, headers={"Range": "bytes=100-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */100"
+
+
+def test_stale_if_range_serves_the_whole_file() -> None:
+    client, routes, _ = make_client()
+    url = path_of(routes.image_url("", "smb-0", REMOTE_FILE))
+    response = client.get(url, headers={"Range": "bytes=10-19", "If-Range": '"old"'})
+    assert response.status_code == 200
+    assert response.content == DATA
+
+
+def test_multiple_ranges_serve_the_whole_file() -> None:
+    assert parse_range("bytes=0-1,5-6", 100) == (0, 99)
+    assert parse_range("items=0-1", 100) == (0, 99)
+
+
+def test_tampered_or_unknown_urls_are_not_found() -> None:
+    client, routes, fetched = make_client()
+    url = path_of(routes.image_url("", "smb-0", REMOTE_FILE))
+    assert client.get(url.replace("image.png", "other.png")).status_code == 404
+    thumbnail_url = path_of(routes.thumbnail_url("", "smb-0", REMOTE_FILE, 256))
+    assert client.get(thumbnail_url.replace("s=256", "s=512")).status_code == 404
+    unknown = path_of(routes.image_url("", "sftp-0", REMOTE_FILE))
+    assert client.get(unknown).status_code == 404
+    assert fetched == []
+
+
+def test_secret_is_kept_across_loads(tmp_path: Path) -> None:
+    path = tmp_path / "keys" / "secret"
+    secret = load_secret(str(path))
+    assert len(secret) == 32
+    assert load_secret(str(path)) == secret
+    path.write_bytes(b"short")
+    assert load_secret(str(path)) not in (secret, b"short")
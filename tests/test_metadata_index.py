@@ -0,0 +1,45 @@
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from MetadataIndex import MetadataIndex
+
+PROMPTS = {
+    "a_b.png": "a_b on a hill\nSteps: 20, Seed: 1, Model: sd_xl",
+    "axb.png": "axb on a hill\nSteps: 20, Seed: 2, Model: sdxxl",
+    "full.png": "100% detail\nSteps: 20, Seed: 3, Model: base",
+    "plain.png": "1000 details\nSteps: 20, Seed: 4, Model: base",
+    "slash.png": "back\\slash\nSteps: 20, Seed: 5, Model: base",
+}
+
+
+@pytest.fixture
+def index(tmp_path: Path) -> MetadataIndex:
+    index = MetadataIndex(str(tmp_path / "index" / "index.db"))
+    for name, parameters in PROMPTS.items():
+        index.add("smb-0", "txt2img-images", name, 1, 64, 64, parameters)
+    return index
+
+
+def search(index: MetadataIndex, query: str) -> List[str]:
+    return sorted(f.name for f in index.page("smb-0", "txt2img-images", 0, 10, "Name", query))
+
+
+def test_words_must_all_appear_in_the_prompt(index: MetadataIndex) -> None:
+    assert search(index, "hill a_b") == ["a_b.png"]
+    assert search(index, "seed:2") == ["axb.png"]
+    assert index.count("smb-0", "txt2img-images", "hill") == 2
+
+
+@pytest.mark.parametrize(
+    ("query", "names"),
+    [
+        ("a_b", ["a_b.png"]),
+        ("100%", ["full.png"]),
+        ("model:sd_x", ["a_b.png"]),
+        ("back\\slash", ["slash.png"]),
+    ],
+)
+def test_like_wildcards_match_only_themselves(index: MetadataIndex, query: str, names: List[str]) -> None:
+    assert search(index, query) == names
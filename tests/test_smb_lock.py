@@ -0,0 +1,66 @@
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from smb.smb_structs import OperationFailure
+from standins import FakeSMBConnection
+
+import SMBConnector
+from SMBConnector import SMBConector
+
+
+@pytest.fixture
+def share(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    # connectors create a missing save directory on connect, concurrent first connections would race.
+    (tmp_path / "share" / "sd_web_ui").mkdir(parents=True)
+    monkeypatch.setattr(FakeSMBConnection, "root", tmp_path)
+    monkeypatch.setattr(SMBConnector, "SMBConnection", FakeSMBConnection)
+    return tmp_path / "share"
+
+
+def connect() -> SMBConector:
+    return SMBConector("user", "password", "local", "server", "share", "", "127.0.0.1")
+
+
+def test_concurrent_appends_keep_every_line(share: Path) -> None:
+    def append(writer: int) -> None:
+        connector = connect()
+        for line in range(20):
+            connector.append_bytes("sd_web_ui/manifest", f"{writer}-{line}\n".encode())
+
+    threads = [threading.Thread(target=append, args=(writer,)) for writer in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    lines = (share / "sd_web_ui" / "manifest").read_text().splitlines()
+    assert sorted(lines) == sorted(f"{writer}-{line}" for writer in range(4) for line in range(20))
+    assert not (share / "sd_web_ui" / "manifest.lock").exists()
+
+
+def test_stale_lock_is_removed_before_the_timeout(share: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    assert SMBConnector.LOCK_EXPIRY < SMBConnector.LOCK_TIMEOUT
+    monkeypatch.setattr(SMBConnector, "LOCK_EXPIRY", 0.2)
+    monkeypatch.setattr(SMBConnector, "LOCK_TIMEOUT", 5.0)
+    connector = connect()
+    (share / "sd_web_ui" / "manifest.lock").mkdir()
+    started = time.monotonic()
+    connector.append_bytes("sd_web_ui/manifest", b"line\n")
+    assert time.monotonic() - started < 5.0
+    assert (share / "sd_web_ui" / "manifest").read_bytes() == b"line\n"
+
+
+def test_lock_times_out_while_held(share: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(SMBConnector, "LOCK_TIMEOUT", 0.3)
+    connector = connect()
+    with connector._lock("sd_web_ui/manifest.lock"), pytest.raises(TimeoutError):
+        connector.append_bytes("sd_web_ui/manifest", b"line\n")
+
+
+def test_lock_that_can_not_be_created_fails_at_once(share: Path) -> None:
+    connector = connect()
+    started = time.monotonic()
+    with pytest.raises(OperationFailure):
+        connector.append_bytes("missing/manifest", b"line\n")
+    assert time.monotonic() - started < 1.0
@@ -0,0 +1,73 @@
+import threading
+import time
+from typing import Hashable, List
+
+from UploadFanout import UploadFanout
+
+SMB = ("smb", "smb-0")
+SFTP = ("sftp", "sftp-0")
+
+
+def test_failed_destinations_are_returned() -> None:
+    fanout = UploadFanout(timeout=5.0)
+    uploaded: List[Hashable] = []
+
+    def upload(key: Hashable) -> None:
+        if key == SFTP:
+            raise OSError("unreachable")
+        uploaded.append(key)
+
+    try:
+        assert fanout.run([SMB, SFTP], upload) == [SFTP]
+    finally:
+        fanout.shutdown()
+    assert uploaded == [SMB]
+
+
+def test_timed_out_upload_reports_its_own_failure() -> None:
+    fanout = UploadFanout(timeout=0.1)
+    release = threading.Event()
+    late: List[Hashable] = []
+    reported = threading.Event()
+
+    def upload(key: Hashable) -> None:
+        release.wait(5)
+        raise OSError("connection reset")
+
+    def late_failure(key: Hashable) -> None:
+        late.append(key)
+        reported.set()
+
+    try:
+        assert fanout.run([SMB], upload, late_failure) == []
+        assert late == []
+        release.set()
+        assert reported.wait(5)
+    finally:
+        fanout.shutdown()
+    assert late == [SMB]
+
+
+def test_timed_out_upload_that_succeeds_is_not_retried() -> None:
+    fanout = UploadFanout(timeout=0.1)
+    release = threading.Event()
+    late: List[Hashable] = []
+    try:
+        assert fanout.run([SMB], lambda key: release.wait(5), late.append) == []
+        release.set()
+    finally:
+        fanout.shutdown()
+    assert late == []
+
+
+def test_shutdown_is_bounded_and_cancels_queued_uploads() -> None:
+    fanout = UploadFanout(timeout=0.1, workers=1)
+    release = threading.Event()
+    late: List[Hashable] = []
+    fanout.run([SMB], lambda key: release.wait(5), late.append)
+    fanout.run([SFTP], lambda key: None, late.append)
+    started = time.monotonic()
+    fanout.shutdown(0.2)
+    assert time.monotonic() - started < 1.0
+    assert late == [SFTP]
+    release.set()
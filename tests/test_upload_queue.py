@@ -0,0 +1,112 @@
+import threading
+import time
+from typing import List, Tuple
+
+from PIL import Image
+
+from UploadQueue import UploadJob, UploadQueue
+
+
+def make_job(name: str) -> UploadJob:
+    return UploadJob.snapshot(name, Image.new("RGB", (4, 4)), {"parameters": name})
+
+
+def blocked_queue(policy: str, **kwargs: object) -> Tuple[UploadQueue, threading.Event, List[str]]:
+    """Return a started one-slot queue whose single worker is stuck on a first job until the event is set."""
+    release = threading.Event()
+    started = threading.Event()
+    uploaded: List[str] = []
+
+    def handler(job: UploadJob) -> None:
+        started.set()
+        release.wait(5)
+        uploaded.append(job.name)
+
+    upload_queue = UploadQueue(handler, maxsize=1, workers=1, policy=policy, **kwargs)
+    upload_queue.start()
+    upload_queue.put(make_job("running"))
+    assert started.wait(5)
+    return upload_queue, release, uploaded
+
+
+def test_snapshot_copies_image_and_png_info() -> None:
+    image = Image.new("RGB", (4, 4))
+    info = {"seed": 1}
+    job = UploadJob.snapshot("a", image, info)
+    image.putpixel((0, 0), (255, 0, 0))
+    info["seed"] = 2
+    assert job.image.getpixel((0, 0)) == (0, 0, 0)
+    assert job.png_info == {"seed": "1"}
+
+
+def test_block_waits_for_a_free_slot() -> None:
+    upload_queue, release, uploaded = blocked_queue("block")
+    upload_queue.put(make_job("queued"))
+    putter = threading.Thread(target=upload_queue.put, args=(make_job("blocked"),))
+    putter.start()
+    putter.join(0.2)
+    assert putter.is_alive()
+    release.set()
+    putter.join(5)
+    upload_queue.shutdown(5)
+    assert uploaded == ["running", "queued", "blocked"]
+
+
+def test_drop_oldest_discards_the_waiting_job() -> None:
+    discarded: List[str] = []
+    upload_queue, release, uploaded = blocked_queue(
+        "drop-oldest", discard=lambda job: discarded.append(job.name)
+    )
+    upload_queue.put(make_job("old"))
+    upload_queue.put(make_job("new"))
+    release.set()
+    upload_queue.shutdown(5)
+    assert discarded == ["old"]
+    assert uploaded == ["running", "new"]
+
+
+def test_spill_hands_overflow_to_the_spill_function() -> None:
+    spilled: List[str] = []
+    upload_queue, release, uploaded = blocked_queue(
+        "spill", spill=lambda job: spilled.append(job.name)
+    )
+    upload_queue.put(make_job("queued"))
+    upload_queue.put(make_job("overflow"))
+    release.set()
+    upload_queue.shutdown(5)
+    assert spilled == ["overflow"]
+    assert uploaded == ["running", "queued"]
+
+
+def test_jobs_put_after_shutdown_are_discarded() -> None:
+    discarded: List[str] = []
+    upload_queue = UploadQueue(lambda job: None, discard=lambda job: discarded.append(job.name))
+    upload_queue.start()
+    upload_queue.shutdown(5)
+    upload_queue.put(make_job("late"))
+    assert discarded == ["late"]
+
+
+def test_shutdown_timeout_with_a_full_queue_and_a_stuck_worker() -> None:
+    upload_queue, release, _ = blocked_queue("block")
+    upload_queue.put(make_job("queued"))
+    started = time.monotonic()
+    upload_queue.shutdown(0.3)
+    assert time.monotonic() - started < 2
+    release.set()
+
+
+def test_a_failing_job_does_not_stop_the_worker() -> None:
+    uploaded: List[str] = []
+
+    def handler(job: UploadJob) -> None:
+        if job.name == "bad":
+            raise OSError("remote is down")
+        uploaded.append(job.name)
+
+    upload_queue = UploadQueue(handler)
+    upload_queue.start()
+    upload_queue.put(make_job("bad"))
+    upload_queue.put(make_job("good"))
+    upload_queue.shutdown(5)
+    assert uploaded == ["good"]
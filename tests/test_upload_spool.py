@@ -0,0 +1,148 @@
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+from UploadSpool import SpoolJobDropped, UploadSpool
+
+
+def make_spool(directory: Path, **kwargs: float) -> UploadSpool:
+    kwargs.setdefault("base_delay", 0.0)
+    kwargs.setdefault("max_delay", 0.0)
+    return UploadSpool(str(directory), **kwargs)
+
+
+def wait_for(predicate: Callable[[], bool], timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_add_writes_one_job_per_connector(tmp_path: Path) -> None:
+    spool = make_spool(tmp_path)
+    spool.add("image.png", b"data", ["smb-0", "gdrive-0"])
+    assert len(spool) == 2
+    assert len(list((tmp_path / "images").iterdir())) == 1
+    jobs = [json.loads(path.read_text()) for path in (tmp_path / "jobs").glob("*.json")]
+    assert sorted(job["connector"] for job in jobs) == ["gdrive-0", "smb-0"]
+
+
+def test_successful_retry_removes_job_and_image(tmp_path: Path) -> None:
+    spool = make_spool(tmp_path)
+    spool.add("image.png", b"data", ["smb-0"])
+    uploaded: List[Tuple[str, str, bytes]] = []
+    spool.start(lambda connector_id, name, data: uploaded.append((connector_id, name, data)))
+    try:
+        assert wait_for(lambda: len(spool) == 0)
+    finally:
+        spool.shutdown()
+    assert uploaded == [("smb-0", "image.png", b"data")]
+    assert list((tmp_path / "jobs").iterdir()) == []
+    assert list((tmp_path / "images").iterdir()) == []
+
+
+def test_failed_retry_keeps_job_with_backoff(tmp_path: Path) -> None:
+    spool = make_spool(tmp_path)
+    spool.add("image.png", b"data", ["smb-0"])
+    spool.base_delay = spool.max_delay = 60.0
+    attempted = threading.Event()
+
+    def failing(connector_id: str, name: str, data: bytes) -> None:
+        attempted.set()
+        raise OSError("share unreachable")
+
+    spool.start(failing)
+    try:
+        assert attempted.wait(5)
+        assert wait_for(lambda: all(job["attempts"] == 1 for job in spool._jobs.values()))
+    finally:
+        spool.shutdown()
+    assert len(spool) == 1
+    (path,) = (tmp_path / "jobs").glob("*.json")
+    job = json.loads(path.read_text())
+    assert job["attempts"] == 1
+    assert job["next_attempt"] <= time.time() + 60.0
+    assert len(list((tmp_path / "images").iterdir())) == 1
+
+
+def test_dropped_job_is_removed_without_retry(tmp_path: Path) -> None:
+    spool = make_spool(tmp_path)
+    spool.add("image.png", b"data", ["removed-0"])
+    attempts: List[str] = []
+
+    def unknown_connector(connector_id: str, name: str, data: bytes) -> None:
+        attempts.append(connector_id)
+        raise SpoolJobDropped(f"the connector {connector_id} is no longer configured")
+
+    spool.start(unknown_connector)
+    try:
+        assert wait_for(lambda: len(spool) == 0)
+    finally:
+        spool.shutdown()
+    assert attempts == ["removed-0"]
+    assert list((tmp_path / "jobs").iterdir()) == []
+    assert list((tmp_path / "images").iterdir()) == []
+
+
+def test_shared_image_is_kept_until_last_job_finishes(tmp_path: Path) -> None:
+    spool = make_spool(tmp_path)
+    spool.add("image.png", b"data", ["smb-0", "gdrive-0"])
+    entries = sorted(spool._jobs)
+    spool._finish(entries[0], spool._jobs[entries[0]])
+    assert len(list((tmp_path / "images").iterdir())) == 1
+    spool._finish(entries[1], spool._jobs[entries[1]])
+    assert list((tmp_path / "images").iterdir()) == []
+
+
+def test_pending_jobs_survive_a_restart(tmp_path: Path) -> None:
+    spool = make_spool(tmp_path, base_delay=60.0, max_delay=60.0)
+    spool.add("image.png", b"data", ["smb-0"])
+    restarted = make_spool(tmp_path, base_delay=60.0, max_delay=60.0)
+
+    def failing(connector_id: str, name: str, data: bytes) -> None:
+        raise OSError("share unreachable")
+
+    restarted.start(failing)
+    restarted.shutdown()
+    assert [job["name"] for job in restarted._jobs.values()] == ["image.png"]
+
+
+def test_compact_drops_expired_jobs(tmp_path: Path) -> None:
+    spool = make_spool(tmp_path, max_age=10.0)
+    spool.add("old.png", b"old", ["smb-0"])
+    spool.add("new.png", b"new", ["smb-0"])
+    old_entry = next(e for e, j in spool._jobs.items() if j["name"] == "old.png")
+    spool._jobs[old_entry]["created"] -= 20.0
+    spool.compact()
+    assert [job["name"] for job in spool._jobs.values()] == ["new.png"]
+    assert not (tmp_path / "jobs" / old_entry).exists()
+
+
+def test_compact_drops_oldest_jobs_above_limits(tmp_path: Path) -> None:
+    spool = make_spool(tmp_path, max_entries=2)
+    for index in range(3):
+        spool.add(f"{index}.png", b"x", ["smb-0"])
+        time.sleep(0.001)
+    spool.compact()
+    assert sorted(job["name"] for job in spool._jobs.values()) == ["1.png", "2.png"]
+
+    spool = make_spool(tmp_path / "bytes", max_bytes=10)
+    spool.add("first.png", b"x" * 6, ["smb-0"])
+    time.sleep(0.001)
+    spool.add("second.png", b"x" * 6, ["smb-0"])
+    spool.compact()
+    assert [job["name"] for job in spool._jobs.values()] == ["second.png"]
+
+
+def test_broken_job_file_is_discarded_on_start(tmp_path: Path) -> None:
+    (tmp_path / "jobs").mkdir()
+    (tmp_path / "jobs" / "broken.json").write_text("{not json")
+    spool = make_spool(tmp_path)
+    spool.start(lambda connector_id, name, data: None)
+    spool.shutdown()
+    assert len(spool) == 0
+    assert not (tmp_path / "jobs" / "broken.json").exists()